@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import time
 import traceback
 from flask import Flask, g, current_app, jsonify
@@ -9,7 +10,10 @@ import secrets
 import logging
 from werkzeug.exceptions import UnprocessableEntity, HTTPException
 
-from api.util import DocstringDefaultException, CustomJSONEncoder, simple_cache, carbon_data_cache
+from api.util import DEFAULT_BA_LOOKUP_PRECISION, DEFAULT_CARBON_DATA_CACHE_MAX_BYTES, DEFAULT_IO_THREAD_POOL_SIZE, \
+    DEFAULT_PROCESS_POOL_SIZE, DEFAULT_PSQL_POOL_SIZE, DocstringDefaultException, CustomJSONEncoder, simple_cache, \
+    carbon_data_cache, carbon_data_range_cache, ba_lookup_cache, scheduler_session_cache, get_io_thread_pool
+from api.shared_cache import DEFAULT_SHARED_CACHE_SQLITE_PATH, get_cache_config, get_persistent_cache_config
 
 
 class CustomApi(Api):
@@ -32,8 +36,31 @@ def create_app():
     app.config['RESTFUL_JSON'] = {
         'cls': CustomJSONEncoder
     }
-    simple_cache.init_app(app)
-    carbon_data_cache.init_app(app)
+    # Size of the long-lived process pool in each gunicorn worker, used by the carbon-aware scheduler.
+    app.config['PROCESS_POOL_SIZE'] = int(os.environ.get('PROCESS_POOL_SIZE', DEFAULT_PROCESS_POOL_SIZE))
+    # Size of the thread pool for I/O-bound lookups, which run in the worker itself to share its caches.
+    app.config['IO_THREAD_POOL_SIZE'] = int(os.environ.get('IO_THREAD_POOL_SIZE', DEFAULT_IO_THREAD_POOL_SIZE))
+    # Maximum number of database connections in each gunicorn worker.
+    app.config['PSQL_POOL_SIZE'] = int(os.environ.get('PSQL_POOL_SIZE', DEFAULT_PSQL_POOL_SIZE))
+    # Memory budget of the carbon data range cache in each gunicorn worker.
+    app.config['CARBON_DATA_CACHE_MAX_BYTES'] = int(os.environ.get('CARBON_DATA_CACHE_MAX_BYTES',
+                                                                   DEFAULT_CARBON_DATA_CACHE_MAX_BYTES))
+    # Backend of the caches shared by the gunicorn workers and their subprocesses, see `get_cache_config()`.
+    app.config['SHARED_CACHE_TYPE'] = os.environ.get('SHARED_CACHE_TYPE', 'simple')
+    app.config['SHARED_CACHE_SQLITE_PATH'] = os.environ.get('SHARED_CACHE_SQLITE_PATH',
+                                                            DEFAULT_SHARED_CACHE_SQLITE_PATH)
+    app.config['SHARED_CACHE_REDIS_URL'] = os.environ.get('SHARED_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    simple_cache.init_app(app, config=get_cache_config(app, 'simple_'))
+    carbon_data_cache.init_app(app, config=get_cache_config(app, 'carbon_data_'))
+    carbon_data_range_cache.init_app(
+        app, carbon_data_cache if app.config['SHARED_CACHE_TYPE'] != 'simple' else None)
+    # Balancing authority lookups are rounded to this many decimal places, so that nearby points share the result.
+    app.config['BA_LOOKUP_PRECISION'] = int(os.environ.get('BA_LOOKUP_PRECISION', DEFAULT_BA_LOOKUP_PRECISION))
+    # If set, balancing authority lookups are kept in this SQLite database across restarts, and the known cloud
+    # regions are looked up in the background at startup.
+    app.config['BA_LOOKUP_CACHE_PATH'] = os.environ.get('BA_LOOKUP_CACHE_PATH')
+    ba_lookup_cache.init_app(app, config=get_persistent_cache_config(app, 'ba_lookup_',
+                                                                     app.config['BA_LOOKUP_CACHE_PATH']))
     if __name__ != '__main__':
         # Source: https://trstringer.com/logging-flask-gunicorn-the-manageable-way/
         gunicorn_logger = logging.getLogger('gunicorn.error')
@@ -42,8 +69,19 @@ def create_app():
 
     from api.routes.balancing_authority import BalancingAuthority
     from api.routes.carbon_intensity import CarbonIntensity
-    from api.routes.carbon_aware_scheduler import CarbonAwareScheduler
+    from api.routes.carbon_aware_scheduler import MAX_SCHEDULER_SESSION_COUNT, CarbonAwareScheduler, \
+        CarbonAwareSchedulerSession
     from api.routes.energy_mixture import EnergyMixture
+    from api.routes.metrics import Metrics
+    from api.helpers.balancing_authority import warm_up_ba_lookup_cache
+
+    scheduler_session_cache.init_app(app, config=get_cache_config(app, 'scheduler_session_') | {
+        'CACHE_THRESHOLD': MAX_SCHEDULER_SESSION_COUNT,
+    })
+
+    if app.config['BA_LOOKUP_CACHE_PATH']:
+        with app.app_context():
+            get_io_thread_pool().submit(warm_up_ba_lookup_cache)
 
     # Alternatively, use this and `from varname import nameof`.
     errors_custom_responses = {
@@ -57,7 +95,9 @@ def create_app():
     api.add_resource(BalancingAuthority, '/balancing-authority/')
     api.add_resource(CarbonIntensity, '/carbon-intensity/')
     api.add_resource(CarbonAwareScheduler, '/carbon-aware-scheduler/')
+    api.add_resource(CarbonAwareSchedulerSession, '/carbon-aware-scheduler/session/')
     api.add_resource(EnergyMixture, '/energy-mixture/')
+    api.add_resource(Metrics, '/metrics/')
 
     # Source: https://github.com/marshmallow-code/webargs/issues/181#issuecomment-621159812
     @webargs.flaskparser.parser.error_handler
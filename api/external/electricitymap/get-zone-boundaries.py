@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+# Source: https://github.com/electricitymaps/electricitymaps-contrib, which publishes the zone geometries as GeoJSON
+#   with the zone id in the "zoneName" property.
+
+import argparse
+import json
+import os
+from pathlib import Path
+import requests
+
+DEFAULT_OUTPUT_FILE = os.path.join(Path(__file__).parent.absolute(), 'data', 'zone-boundaries.geojson')
+
+parser = argparse.ArgumentParser(
+    description='Download the GeoJSON boundaries of Electricity map zones, '
+                'which are used for offline zone lookup.')
+parser.add_argument('url', type=str, help='URL of the zone GeoJSON file, e.g. world.geojson of electricitymaps-contrib')
+parser.add_argument('--output', '-o', type=str, default=DEFAULT_OUTPUT_FILE, help='Output GeoJSON file')
+args = parser.parse_args()
+
+response = requests.get(args.url)
+assert response.ok, "Request failed %d: %s" % (response.status_code, response.text)
+geojson = response.json()
+assert all('zoneName' in (feature.get('properties') or {}) for feature in geojson['features']), \
+    'Missing "zoneName" property in zone features'
+with open(args.output, 'w') as f:
+    json.dump(geojson, f)
+print(f'Saved {len(geojson["features"])} zone boundaries to {args.output}')
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+# Source: https://www.watttime.org/api-documentation/#grid-region-map-geometry
+
+import argparse
+import json
+import os
+from pathlib import Path
+import requests
+
+if __package__:
+    from .util import get_watttime_token
+else:
+    from util import get_watttime_token
+
+DEFAULT_OUTPUT_FILE = os.path.join(Path(__file__).parent.absolute(), 'data', 'ba-boundaries.geojson')
+
+
+def get_ba_boundaries():
+    maps_url = 'https://api2.watttime.org/v2/maps'
+    headers = {'Authorization': 'Bearer {}'.format(get_watttime_token())}
+    return requests.get(maps_url, headers=headers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Download the GeoJSON boundaries of all WattTime balancing authorities, '
+                    'which are used for offline balancing authority lookup.')
+    parser.add_argument('--output', '-o', type=str, default=DEFAULT_OUTPUT_FILE, help='Output GeoJSON file')
+    args = parser.parse_args()
+
+    response = get_ba_boundaries()
+    assert response.ok, "Request failed %d: %s" % (response.status_code, response.text)
+    geojson = response.json()
+    with open(args.output, 'w') as f:
+        json.dump(geojson, f)
+    print(f'Saved {len(geojson["features"])} balancing authority boundaries to {args.output}')
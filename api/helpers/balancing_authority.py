@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 
+import json
 import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Optional
 from flask import current_app
 from werkzeug.exceptions import InternalServerError
-from api.models.common import IsoFormat
+from api.models.common import Coordinate, IsoFormat
 from api.models.common import ISO_PREFIX_WATTTIME
 from api.models.common import ISO_PREFIX_C3LAB
 from api.models.common import ISO_PREFIX_EMAP
 
-from api.util import CustomHTTPException, load_yaml_data, simple_cache
+from api.models.cloud_location import CloudLocationManager
+from api.util import DEFAULT_BA_LOOKUP_PRECISION, CustomHTTPException, ba_lookup_cache, get_io_thread_pool, \
+    load_yaml_data
+from api.helpers.balancing_authority_index import get_emap_zone_index, get_watttime_ba_index
 from api.external.watttime.ba_from_loc import get_watttime_ba_from_loc
 from api.external.electricitymap.ba_from_loc import get_emap_ba_from_loc
 
 YAML_CONFIG = 'balancing_authority.yaml'
+AZURE_REGIONS_GPS_FILE = os.path.join(Path(__file__).parent.parent.parent.absolute(),
+                                      'metadata', 'electricity', 'azure', 'azure-regions.gps.json')
 
 
 def get_mapping_watttime_ba_to_region(config_path: os.path, map_name: str):
@@ -48,8 +54,50 @@ def convert_watttime_ba_abbrev_to_c3lab_region(watttime_abbrev) -> str:
         return ISO_PREFIX_C3LAB + 'unknown:' + watttime_abbrev
 
 
-@simple_cache.memoize(timeout=0)
+def quantize_coordinate(latitude: float, longitude: float) -> tuple[float, float]:
+    """Round the GPS coordinate to the grid of `BA_LOOKUP_PRECISION` decimal places in the app config."""
+    precision = current_app.config.get('BA_LOOKUP_PRECISION', DEFAULT_BA_LOOKUP_PRECISION)
+    # Adding 0. turns -0.0 into 0.0, so that both share the same cache key.
+    return (round(latitude, precision) + 0., round(longitude, precision) + 0.)
+
+
+def _get_lookup_key(source: str, latitude: float, longitude: float) -> str:
+    return '%s:%s:%s' % (source, *quantize_coordinate(latitude, longitude))
+
+
+def _lookup_quantized(source: str, lookup: Callable[[float, float], Any], latitude: float, longitude: float) -> Any:
+    """Lookup at the quantized coordinate, memoized in `ba_lookup_cache` so that nearby points share the result."""
+    key = _get_lookup_key(source, latitude, longitude)
+    (latitude, longitude) = quantize_coordinate(latitude, longitude)
+    result = ba_lookup_cache.get(key)
+    if result is None:
+        result = lookup(latitude, longitude)
+        ba_lookup_cache.set(key, result, timeout=0)
+    return result
+
+
 def lookup_watttime_balancing_authority(latitude: float, longitude: float) -> dict[str, Any]:
+    """Lookup the balancing authority in the local WattTime boundaries, or from WattTime API for points outside."""
+    return _lookup_quantized('watttime', _lookup_watttime_balancing_authority, latitude, longitude)
+
+
+def _lookup_watttime_balancing_authority(latitude: float, longitude: float) -> dict[str, Any]:
+    result = _lookup_watttime_balancing_authority_local(latitude, longitude)
+    return result if result is not None else _lookup_watttime_balancing_authority_remote(latitude, longitude)
+
+
+def _lookup_watttime_balancing_authority_local(latitude: float, longitude: float) -> Optional[dict[str, Any]]:
+    index = get_watttime_ba_index()
+    properties = index.lookup(latitude, longitude) if index is not None else None
+    if properties is None:
+        return None
+    return {
+        'watttime_abbrev': properties['abbrev'],
+        'watttime_name': properties.get('name', properties['abbrev']),
+    }
+
+
+def _lookup_watttime_balancing_authority_remote(latitude: float, longitude: float) -> dict[str, Any]:
     """
         Lookup the balancing authority from WattTime API, and returns the WattTime lookup result."""
     current_app.logger.debug(f'lookup_watttime_balancing_authority({latitude}, {longitude})')
@@ -74,8 +122,23 @@ def lookup_watttime_balancing_authority(latitude: float, longitude: float) -> di
     }
 
 
-@simple_cache.memoize(timeout=0)
 def lookup_emap_balancing_authority(latitude: float, longitude: float) -> str:
+    """Lookup the zone id in the local Electricity map boundaries, or from EMAP API for points outside."""
+    return _lookup_quantized('emap', _lookup_emap_balancing_authority, latitude, longitude)
+
+
+def _lookup_emap_balancing_authority(latitude: float, longitude: float) -> str:
+    result = _lookup_emap_balancing_authority_local(latitude, longitude)
+    return result if result is not None else _lookup_emap_balancing_authority_remote(latitude, longitude)
+
+
+def _lookup_emap_balancing_authority_local(latitude: float, longitude: float) -> Optional[str]:
+    index = get_emap_zone_index()
+    properties = index.lookup(latitude, longitude) if index is not None else None
+    return properties['zoneName'] if properties is not None else None
+
+
+def _lookup_emap_balancing_authority_remote(latitude: float, longitude: float) -> str:
     """Lookup the balancing authority from EMAP API, and returns the zone id (country code)."""
     current_app.logger.debug(f'lookup_emap_balancing_authority({latitude}, {longitude})')
     emap_response = get_emap_ba_from_loc(latitude, longitude)
@@ -107,9 +170,120 @@ def get_iso_from_gps(latitude: float, longitude: float, iso_format: IsoFormat) -
             raise NotImplementedError(f'Unknown ISO format {iso_format}')
 
 
+def _lookup_quantized_batch(source: str, lookup_local: Callable[[float, float], Any],
+                            lookup_remote: Callable[[float, float], Any],
+                            l_coordinates: list[Coordinate]) -> list[Any | Exception]:
+    """Lookup many coordinates, deduplicated on the quantized grid, and return the results in input order.
+
+        Cache misses are first looked up in the local boundaries, and the rest are looked up remotely in parallel on
+        the I/O thread pool, which bounds the number of concurrent requests. The result of a failed lookup is its
+        exception. This must not be called from a task of the I/O thread pool, which may deadlock.
+    """
+    l_keys = [_get_lookup_key(source, latitude, longitude) for (latitude, longitude) in l_coordinates]
+    d_coordinates = {key: quantize_coordinate(latitude, longitude)
+                     for (key, (latitude, longitude)) in zip(l_keys, l_coordinates)}
+    d_results = {key: result for (key, result) in zip(d_coordinates, ba_lookup_cache.get_many(*d_coordinates))
+                 if result is not None}
+    num_cached = len(d_results)
+    d_new_results = {}
+    l_remote_keys = []
+    for (key, (latitude, longitude)) in d_coordinates.items():
+        if key in d_results:
+            continue
+        result = lookup_local(latitude, longitude)
+        if result is not None:
+            d_new_results[key] = result
+        else:
+            l_remote_keys.append(key)
+    io_pool = get_io_thread_pool()
+    d_futures = {key: io_pool.submit(lookup_remote, *d_coordinates[key]) for key in l_remote_keys}
+    for (key, future) in d_futures.items():
+        try:
+            d_new_results[key] = future.result()
+        except Exception as ex:
+            d_results[key] = ex
+    if d_new_results:
+        ba_lookup_cache.set_many(d_new_results, timeout=0)
+    d_results |= d_new_results
+    current_app.logger.info(f'Looked up {len(l_coordinates)} coordinates in {source}: {len(d_coordinates)} unique, '
+                            f'{num_cached} cached, '
+                            f'{len(l_remote_keys)} remote')
+    return [d_results[key] for key in l_keys]
+
+
+def lookup_watttime_balancing_authorities(l_coordinates: list[Coordinate]) -> list[dict[str, Any] | Exception]:
+    """Batch version of `lookup_watttime_balancing_authority()`, where the result of a failed lookup is its exception."""
+    return _lookup_quantized_batch('watttime', _lookup_watttime_balancing_authority_local,
+                                   _lookup_watttime_balancing_authority_remote, l_coordinates)
+
+
+def lookup_emap_balancing_authorities(l_coordinates: list[Coordinate]) -> list[str | Exception]:
+    """Batch version of `lookup_emap_balancing_authority()`, where the result of a failed lookup is its exception."""
+    return _lookup_quantized_batch('emap', _lookup_emap_balancing_authority_local,
+                                   _lookup_emap_balancing_authority_remote, l_coordinates)
+
+
+def get_isos_from_gps(l_coordinates: list[Coordinate], iso_format: IsoFormat) -> list[str | Exception]:
+    """Batch version of `get_iso_from_gps()`, where the result of a failed lookup is its exception."""
+    match iso_format:
+        case IsoFormat.C3Lab:
+            return [convert_watttime_ba_abbrev_to_c3lab_region(result['watttime_abbrev'])
+                    if not isinstance(result, Exception) else result
+                    for result in lookup_watttime_balancing_authorities(l_coordinates)]
+        case IsoFormat.WattTime:
+            return [ISO_PREFIX_WATTTIME + result['watttime_abbrev'] if not isinstance(result, Exception) else result
+                    for result in lookup_watttime_balancing_authorities(l_coordinates)]
+        case IsoFormat.EMap:
+            return [ISO_PREFIX_EMAP + result if not isinstance(result, Exception) else result
+                    for result in lookup_emap_balancing_authorities(l_coordinates)]
+        case _:
+            raise NotImplementedError(f'Unknown ISO format {iso_format}')
+
+
+def get_known_gps_coordinates() -> list[tuple[float, float]]:
+    """Get the GPS coordinates of the known cloud regions, i.e. in `cloud_location.yaml` and the Azure regions."""
+    l_coordinates = [region.gps for public_cloud in CloudLocationManager().get_all_clouds_by_provider().values()
+                     for region in public_cloud.regions]
+    with open(AZURE_REGIONS_GPS_FILE, 'r') as f:
+        # Logical regions, e.g. "europe", have no coordinate.
+        l_coordinates += [(float(region['Latitude']), float(region['Longitude'])) for region in json.load(f)
+                          if region['Latitude'] is not None and region['Longitude'] is not None]
+    return l_coordinates
+
+
+# Taken by the first gunicorn worker that warms up `ba_lookup_cache`, so that the others don't send the same lookups.
+BA_LOOKUP_WARM_UP_LOCK_KEY = 'warm_up_lock'
+BA_LOOKUP_WARM_UP_LOCK_TIMEOUT = 60 * 60
+
+
+def warm_up_ba_lookup_cache() -> int:
+    """Lookup the known GPS coordinates that are not in `ba_lookup_cache` yet, and return the number of lookups.
+
+        Only the first process that calls this within `BA_LOOKUP_WARM_UP_LOCK_TIMEOUT` seconds warms up the cache.
+        Failed lookups, e.g. due to an unavailable external API, are logged and retried on the next request.
+    """
+    if not ba_lookup_cache.add(BA_LOOKUP_WARM_UP_LOCK_KEY, os.getpid(), timeout=BA_LOOKUP_WARM_UP_LOCK_TIMEOUT):
+        current_app.logger.info('Balancing authority lookup cache is warmed up by another process')
+        return 0
+    num_lookups = 0
+    l_coordinates = sorted(set(get_known_gps_coordinates()))
+    for (source, lookup) in [('watttime', lookup_watttime_balancing_authority),
+                             ('emap', lookup_emap_balancing_authority)]:
+        for (latitude, longitude) in l_coordinates:
+            if ba_lookup_cache.has(_get_lookup_key(source, latitude, longitude)):
+                continue
+            try:
+                lookup(latitude, longitude)
+                num_lookups += 1
+            except Exception as e:
+                current_app.logger.warning(f'Failed to warm up {source} lookup of ({latitude}, {longitude}): {e}')
+    current_app.logger.info(f'Warmed up balancing authority lookup cache with {num_lookups} lookups')
+    return num_lookups
+
+
 # def get_all_balancing_authorities():
 #     """Return a list of all balancing authorities for which we have collect data."""
-#     conn = get_psql_connection()
-#     cursor = conn.cursor()
-#     results: list[tuple[str]] = psql_execute_list(cursor, "SELECT DISTINCT region FROM EnergyMixture ORDER BY region;")
+#     with psql_connection() as conn:
+#         cursor = conn.cursor()
+#         results: list[tuple[str]] = psql_execute_list(cursor, "SELECT DISTINCT region FROM EnergyMixture ORDER BY region;")
 #     return [row[0] for row in results]  # one column per row
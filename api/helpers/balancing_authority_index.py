@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import functools
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+from flask import current_app
+import shapely
+from shapely.geometry import shape
+
+EXTERNAL_DIR = os.path.join(Path(__file__).parent.parent.absolute(), 'external')
+# Downloaded by `api/external/watttime/ba_maps.py`.
+WATTTIME_BA_BOUNDARIES_FILE = os.path.join(EXTERNAL_DIR, 'watttime', 'data', 'ba-boundaries.geojson')
+# Downloaded by `api/external/electricitymap/get-zone-boundaries.py`.
+EMAP_ZONE_BOUNDARIES_FILE = os.path.join(EXTERNAL_DIR, 'electricitymap', 'data', 'zone-boundaries.geojson')
+
+
+class BalancingAuthorityIndex:
+    """Offline point-in-polygon lookup of balancing authorities, using an R-tree (STRtree) over their boundaries.
+
+        The boundaries are loaded from a GeoJSON feature collection, and `lookup()` returns the properties of the
+        feature that contains a point. If boundaries overlap, the smallest one, i.e. the most specific, is returned.
+    """
+    def __init__(self, features: list[dict[str, Any]]):
+        features = [feature for feature in features if feature.get('geometry')]
+        self.l_properties: list[dict[str, Any]] = [feature.get('properties') or {} for feature in features]
+        self.geometries = [shape(feature['geometry']) for feature in features]
+        self.areas = [geometry.area for geometry in self.geometries]
+        self.tree = shapely.STRtree(self.geometries)
+
+    @staticmethod
+    def from_geojson_file(path: str) -> 'BalancingAuthorityIndex':
+        with open(path, 'r') as f:
+            geojson = json.load(f)
+        return BalancingAuthorityIndex(geojson['features'])
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[dict[str, Any]]:
+        """Get the properties of the boundary that contains the point, or None if it's outside of all boundaries."""
+        indices = self.tree.query(shapely.Point(longitude, latitude), predicate='intersects')
+        if len(indices) == 0:
+            return None
+        return self.l_properties[min(indices, key=lambda i: self.areas[i])]
+
+
+def _load_index(path: str) -> Optional[BalancingAuthorityIndex]:
+    if not os.path.exists(path):
+        current_app.logger.warning(f'Balancing authority boundaries "{path}" not found, using remote lookup only.')
+        return None
+    index = BalancingAuthorityIndex.from_geojson_file(path)
+    current_app.logger.info(f'Loaded {len(index)} balancing authority boundaries from "{path}"')
+    return index
+
+
+@functools.cache
+def get_watttime_ba_index() -> Optional[BalancingAuthorityIndex]:
+    """Get the index of WattTime balancing authorities, with 'abbrev' and 'name' properties, if available."""
+    return _load_index(WATTTIME_BA_BOUNDARIES_FILE)
+
+
+@functools.cache
+def get_emap_zone_index() -> Optional[BalancingAuthorityIndex]:
+    """Get the index of Electricity map zones, with 'zoneName' property as the zone id, if available."""
+    return _load_index(EMAP_ZONE_BOUNDARIES_FILE)
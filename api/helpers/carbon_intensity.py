@@ -1,18 +1,24 @@
 #!/usr/bin/env python3
 
-import math
 import time
+from typing import Any, Callable, Iterator
 import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from werkzeug.exceptions import BadRequest
 from flask import current_app
 
-from api.helpers.carbon_intensity_c3lab import get_carbon_intensity_list as get_carbon_intensity_list_c3lab
+from api.helpers.carbon_intensity_c3lab import get_carbon_intensity_list as get_carbon_intensity_list_c3lab, \
+    fetch_emissions_many as fetch_emissions_many_c3lab, get_c3lab_region_from_iso, \
+    iter_carbon_intensity as iter_carbon_intensity_c3lab, \
+    get_carbon_intensity_columns as get_carbon_intensity_columns_c3lab
 from api.helpers.carbon_intensity_azure import get_carbon_intensity_list as get_carbon_intensity_list_azure
-from api.helpers.carbon_intensity_emap import get_carbon_intensity_list as get_carbon_intensity_list_emap
+from api.helpers.carbon_intensity_emap import get_carbon_intensity_list as get_carbon_intensity_list_emap, \
+    fetch_emissions_many as fetch_emissions_many_emap, get_emap_region_from_iso, \
+    iter_carbon_intensity as iter_carbon_intensity_emap, \
+    get_carbon_intensity_columns as get_carbon_intensity_columns_emap
 from api.models.common import CarbonDataSource
+from api.models.timeseries import EmissionRateSeries
+from api.util import get_io_thread_pool
 
 
 def get_carbon_intensity_list(iso: str, start: datetime, end: datetime,
@@ -45,6 +51,106 @@ def get_carbon_intensity_list(iso: str, start: datetime, end: datetime,
         case _:
             raise NotImplementedError()
 
+def iter_carbon_intensity_list(iso: str, start: datetime, end: datetime,
+                               carbon_data_source: CarbonDataSource, use_prediction: bool,
+                               desired_renewable_ratio: float = None) -> Iterator[dict]:
+    """Streaming version of `get_carbon_intensity_list()`.
+
+        Historical data in the database is streamed from a server-side cursor, so long ranges don't need to fit in
+        memory. Other data, i.e. predictions and the Azure API, is small and fetched as a list.
+    """
+    current_app.logger.info(f'Streaming carbon intensity for {iso} in range ({start}, {end})')
+    match carbon_data_source:
+        case CarbonDataSource.C3Lab if not use_prediction:
+            return iter_carbon_intensity_c3lab(iso, start, end, desired_renewable_ratio)
+        case CarbonDataSource.EMap if not use_prediction:
+            if desired_renewable_ratio is not None:
+                raise ValueError('Electricity map carbon data source does not support custom renewable ratio.')
+            return iter_carbon_intensity_emap(iso, start, end)
+        case _:
+            return iter(get_carbon_intensity_list(iso, start, end, carbon_data_source, use_prediction,
+                                                  desired_renewable_ratio))
+
+def get_carbon_intensity_columns(iso: str, start: datetime, end: datetime,
+                                 carbon_data_source: CarbonDataSource, use_prediction: bool,
+                                 desired_renewable_ratio: float = None) -> dict[str, np.ndarray]:
+    """Columnar version of `get_carbon_intensity_list()`, with one array per field.
+
+        Historical data in the database is read from the cursor straight into arrays. Other data, i.e. predictions and
+        the Azure API, is small and converted from the list.
+
+        Returns:
+            The 'timestamp' column in seconds since the UNIX epoch, and the float columns of the other fields, e.g.
+            'carbon_intensity', where missing values are NaN.
+    """
+    current_app.logger.info(f'Getting carbon intensity columns for {iso} in range ({start}, {end})')
+    match carbon_data_source:
+        case CarbonDataSource.C3Lab if not use_prediction:
+            return get_carbon_intensity_columns_c3lab(iso, start, end, desired_renewable_ratio)
+        case CarbonDataSource.EMap if not use_prediction:
+            if desired_renewable_ratio is not None:
+                raise ValueError('Electricity map carbon data source does not support custom renewable ratio.')
+            return get_carbon_intensity_columns_emap(iso, start, end)
+    l_carbon_intensity = get_carbon_intensity_list(iso, start, end, carbon_data_source, use_prediction,
+                                                   desired_renewable_ratio)
+    keys = l_carbon_intensity[0].keys() if l_carbon_intensity else ['timestamp', 'carbon_intensity']
+    return {key: np.array([int(d[key].timestamp()) for d in l_carbon_intensity], dtype=np.int64)
+            if key == 'timestamp' else
+            np.array([d[key] for d in l_carbon_intensity], dtype=np.float64)
+            for key in keys}
+
+def _fetch_many_by_region(l_requests: list[tuple[str, datetime, datetime]],
+                          get_region_from_iso: Callable[[str], str],
+                          fetch_many: Callable[[list[tuple]], list[list[dict] | Exception]],
+                          *args) -> list[list[dict] | Exception]:
+    """Convert the ISO of each request to the region of the data source, and fetch all of them in one batch."""
+    l_results: list[list[dict] | Exception | None] = [None] * len(l_requests)
+    l_fetch_indices = []
+    l_fetch_requests = []
+    for (i, (iso, start, end)) in enumerate(l_requests):
+        try:
+            region = get_region_from_iso(iso)
+        except Exception as ex:
+            l_results[i] = ex
+            continue
+        l_fetch_indices.append(i)
+        l_fetch_requests.append((region, start, end, *args))
+    if l_fetch_requests:
+        for (i, result) in zip(l_fetch_indices, fetch_many(l_fetch_requests)):
+            l_results[i] = result
+    return l_results
+
+
+def get_carbon_intensity_lists(l_requests: list[tuple[str, datetime, datetime]],
+                               carbon_data_source: CarbonDataSource, use_prediction: bool,
+                               desired_renewable_ratio: float = None) -> list[list[dict] | Exception]:
+    """Batch version of `get_carbon_intensity_list()` for many (iso, start, end) requests of the same source.
+
+        Historical data in the database is fetched with one query for all requests, and other data, i.e. predictions
+        and the Azure API, is fetched per request in parallel on the I/O thread pool.
+
+        Returns:
+            The time series of each request in order, or the exception that `get_carbon_intensity_list()` would raise.
+    """
+    current_app.logger.info(f'Getting carbon intensity for {len(l_requests)} requests from {carbon_data_source}')
+    match carbon_data_source:
+        case CarbonDataSource.C3Lab if not use_prediction:
+            return _fetch_many_by_region(l_requests, get_c3lab_region_from_iso, fetch_emissions_many_c3lab,
+                                         desired_renewable_ratio)
+        case CarbonDataSource.EMap if not use_prediction:
+            if desired_renewable_ratio is not None:
+                return [ValueError('Electricity map carbon data source does not support custom renewable ratio.')] * \
+                    len(l_requests)
+            return _fetch_many_by_region(l_requests, get_emap_region_from_iso, fetch_emissions_many_emap)
+
+    def task_get_carbon_intensity_list(iso: str, start: datetime, end: datetime) -> list[dict] | Exception:
+        try:
+            return get_carbon_intensity_list(iso, start, end, carbon_data_source, use_prediction,
+                                             desired_renewable_ratio)
+        except Exception as ex:
+            return ex
+    return list(get_io_thread_pool().map(task_get_carbon_intensity_list, *zip(*l_requests))) if l_requests else []
+
 def convert_carbon_intensity_list_to_dict(l_carbon_intensity: list[dict]) -> dict[datetime, float]:
     d_carbon_intensity_by_timestamp: dict[datetime, float] = {}
     for d in l_carbon_intensity:
@@ -65,29 +171,155 @@ def get_carbon_intensity_interval(timestamps: list[datetime]) -> timedelta:
     return values[np.argmax(counts)]
 
 
-def calculate_total_carbon_emissions(start: datetime, runtime: timedelta,
-                                     max_delay: timedelta,
-                                     input_transfer_time: timedelta,
-                                     output_transfer_time: timedelta,
-                                     compute_carbon_emission_rates: pd.Series,
-                                     transfer_carbon_emission_rates: pd.Series,
-                                     ) -> tuple[float, timedelta]:
-    """Calculate the total carbon emission, including both compute and data transfer emissions.
+def _calculate_carbon_emission_in_intervals(starts: np.ndarray, duration: float,
+                                            carbon_emission_cumsum: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Calculate the carbon emission in intervals of the same duration, using the cumulative sum on the timeseries.
 
         Args:
-            start: start time of a workload.
+            starts: the UNIX timestamps of the interval starts.
+            duration: the length of each interval, in seconds.
+            carbon_emission_cumsum: the x and y values returned by `EmissionRateSeries.cumsum()`.
+
+        Returns:
+            The carbon emission of each interval, in the same shape as `starts`.
+    """
+    (x_values, y_values) = carbon_emission_cumsum
+    if x_values.size == 0 or duration <= 0:
+        return np.zeros(np.shape(starts))
+    return np.interp(starts + duration, x_values, y_values) - np.interp(starts, x_values, y_values)
+
+
+def _running_argmin(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate the running minimum along the last axis and the (earliest) index where each running minimum occurs."""
+    running_min = np.minimum.accumulate(values, axis=-1)
+    is_new_min = np.ones(values.shape, dtype=bool)
+    is_new_min[..., 1:] = values[..., 1:] < running_min[..., :-1]
+    indices = np.where(is_new_min, np.arange(values.shape[-1]), 0)
+    return running_min, np.maximum.accumulate(indices, axis=-1)
+
+
+def _earliest_argmin(values: np.ndarray) -> np.ndarray:
+    """Return the earliest index along the last axis whose value is (almost) the minimum, to prefer the earliest
+        schedule on ties."""
+    return np.argmax(np.isclose(values, values.min(axis=-1, keepdims=True), rtol=1e-9, atol=0), axis=-1)
+
+
+def _get_candidate_wait_times(starts: np.ndarray, total_wait_limit: float,
+                              breakpoint_offsets: list[np.ndarray]) -> np.ndarray:
+    """Get the sorted candidate (cumulative) wait times for each start, one row per start.
+
+        Args:
+            starts: the UNIX timestamps of the earliest start of each run.
+            total_wait_limit: the maximum total wait time, in seconds.
+            breakpoint_offsets: absolute timestamps minus the wait time at which the emissions change slope.
+
+        Returns:
+            A 2D array where each row contains the sorted wait times in [0, total_wait_limit] for the same start. Rows
+            only hold the breakpoints inside the window of their start, and are padded with the upper bound, so the
+            width depends on the length of the window rather than the time span of all starts.
+    """
+    breakpoints = np.unique(np.concatenate(breakpoint_offsets))
+    # Each row is the slice of breakpoints strictly inside (start, start + total_wait_limit), between the bounds.
+    first = np.searchsorted(breakpoints, starts, side='right')
+    counts = np.searchsorted(breakpoints, starts + total_wait_limit, side='left') - first
+    columns = np.arange(counts.max())
+    is_inside = columns < counts[:, np.newaxis]
+    indices = np.where(is_inside, first[:, np.newaxis] + columns, 0)
+    wait_times = np.where(is_inside, breakpoints[indices] - starts[:, np.newaxis], total_wait_limit)
+    lower_bounds = np.zeros((starts.size, 1))
+    upper_bounds = np.full((starts.size, 1), total_wait_limit)
+    return np.hstack([lower_bounds, wait_times, upper_bounds])
+
+
+def _solve_optimal_compute_wait_times(compute_starts: np.ndarray, runtime: float, total_wait_limit: float,
+                                      compute_carbon_cumsum: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Find the compute wait times (in seconds) that minimize the compute carbon emission, if there is no transfer.
+
+        All feasible compute starts are evaluated at once, as the optimum can only be where either end of the compute
+        window crosses a timestamp of the emission rates, or at the bounds of the wait time.
+    """
+    (compute_x, _) = compute_carbon_cumsum
+    wait_times = _get_candidate_wait_times(compute_starts, total_wait_limit, [compute_x, compute_x - runtime])
+    compute_emissions = _calculate_carbon_emission_in_intervals(
+        compute_starts[:, np.newaxis] + wait_times, runtime, compute_carbon_cumsum)
+    index_compute = _earliest_argmin(compute_emissions)
+    return wait_times[np.arange(compute_starts.size), index_compute]
+
+
+def _solve_optimal_wait_times(starts: np.ndarray, runtime: float,
+                              input_transfer_time: float, output_transfer_time: float,
+                              total_wait_limit: float,
+                              compute_carbon_cumsum: tuple[np.ndarray, np.ndarray],
+                              transfer_carbon_cumsum: tuple[np.ndarray, np.ndarray]) -> \
+        tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find the input, compute and output wait times (in seconds) that minimize the total carbon emission.
+
+        Using the cumulative wait times u_input <= u_compute <= u_output, with 0 <= u <= total_wait_limit, the total
+        emission is F(u_input) + G(u_compute) + H(u_output), where each term is the integral of a step function over a
+        sliding window, and thus piecewise-linear with kinks only where either end of the window crosses a timestamp.
+        The minimum therefore lies on one of these breakpoints (or the bounds), and we only need to evaluate those.
+    """
+    compute_offset = input_transfer_time
+    output_offset = input_transfer_time + runtime
+    (compute_x, _) = compute_carbon_cumsum
+    (transfer_x, _) = transfer_carbon_cumsum
+    wait_times = _get_candidate_wait_times(starts, total_wait_limit, [
+        transfer_x,
+        transfer_x - input_transfer_time,
+        compute_x - compute_offset,
+        compute_x - compute_offset - runtime,
+        transfer_x - output_offset,
+        transfer_x - output_offset - output_transfer_time,
+    ])
+    timestamps = starts[:, np.newaxis] + wait_times
+
+    input_emissions = _calculate_carbon_emission_in_intervals(
+        timestamps, input_transfer_time, transfer_carbon_cumsum)
+    compute_emissions = _calculate_carbon_emission_in_intervals(
+        timestamps + compute_offset, runtime, compute_carbon_cumsum)
+    output_emissions = _calculate_carbon_emission_in_intervals(
+        timestamps + output_offset, output_transfer_time, transfer_carbon_cumsum)
+
+    # Dynamic programming over the ordered breakpoints, i.e. min(F[i] + G[j] + H[k]) where i <= j <= k.
+    (min_input_emissions, argmin_input) = _running_argmin(input_emissions)
+    (min_input_compute_emissions, argmin_compute) = _running_argmin(min_input_emissions + compute_emissions)
+    total_emissions = min_input_compute_emissions + output_emissions
+    rows = np.arange(starts.size)
+    index_output = _earliest_argmin(total_emissions)
+    index_compute = argmin_compute[rows, index_output]
+    index_input = argmin_input[rows, index_compute]
+
+    (cumulative_input_wait, cumulative_compute_wait, cumulative_output_wait) = (
+        wait_times[rows, index_input], wait_times[rows, index_compute], wait_times[rows, index_output])
+    return (cumulative_input_wait,
+            cumulative_compute_wait - cumulative_input_wait,
+            cumulative_output_wait - cumulative_compute_wait)
+
+
+def calculate_total_carbon_emissions_batch(starts: list[datetime] | np.ndarray, runtime: timedelta,
+                                           max_delay: timedelta,
+                                           input_transfer_time: timedelta,
+                                           output_transfer_time: timedelta,
+                                           compute_carbon_emission_rates: EmissionRateSeries,
+                                           transfer_carbon_emission_rates: EmissionRateSeries,
+                                           ) -> tuple[tuple[np.ndarray, np.ndarray], list[dict[str, Any]]]:
+    """Calculate the total carbon emission of multiple runs of the same workload, including both compute and data
+        transfer emissions, and optimize the schedule of all runs at once.
+
+        Args:
+            starts: start times of all runs of a workload, either as datetimes or a datetime64 array in UTC.
             runtime: runtime of a workload.
             max_delay: the amount of delay that a workload can tolerate.
             transfer_input_time: time to transfer input data.
             transfer_output_time: time to transfer output data.
-            compute_carbon_emission_rates: the compute carbon emission rate in gCO2/s.
-            transfer_carbon_emission_rates: the aggregated data transfer carbon emission rate in gCO2/s.
+            compute_carbon_emission_rates: the compute carbon emission rate in gCO2/s, covering all runs.
+            transfer_carbon_emission_rates: the aggregated data transfer carbon emission rate in gCO2/s, covering all runs.
 
         Returns:
-            Total carbon emissions in kgCO2.
-            Optimal delay of start time, if applicable.
+            Compute and transfer carbon emissions in gCO2 of each run.
+            Timings of the optimal schedule of each run, including delay of start time, if applicable.
     """
-    current_app.logger.info('Calculating total carbon emissions ...')
+    current_app.logger.info(f'Calculating total carbon emissions for {len(starts)} runs ...')
     perf_start_time = time.time()
     if runtime <= timedelta():
         raise BadRequest("Runtime must be positive.")
@@ -95,190 +327,99 @@ def calculate_total_carbon_emissions(start: datetime, runtime: timedelta,
     if input_transfer_time + output_transfer_time > max_delay:
         raise ValueError("Not enough time to finish before deadline.")
 
-    perf_counter_step_size = 0
-
-    def _integrate_series(series: pd.Series) -> tuple[np.ndarray, np.ndarray]:
-        """Calculate the integral of a series, and return the x and y values for a later np.interp call.
-
-            Args:
-                series: A step function represented by a pandas series with a datetime index and numeric values.
-
-            Returns:
-                A tuple of two numpy arrays, the first one is the UNIX timestamp values and the second one is the y values, or cumulative sum of the original series.
-        """
-        # Calculate the size of each step, in seconds.
-        timestamp_seconds = series.index.astype(np.int64) // (10**9)
-        steps_seconds = (-timestamp_seconds.to_series().diff(-1)).to_numpy(na_value=0)
-        # Intergral of the original step function
-        cumsum = np.cumsum(steps_seconds * series.to_numpy())
-        return np.array(timestamp_seconds), np.insert(cumsum[:-1], 0, 0)
-
-    def _calculate_carbon_emission_in_interval(start: datetime, end: datetime,
-                                               carbon_emission_cumsum: tuple[np.ndarray, np.ndarray]) -> float:
-        """Calculate the carbon emission in the given interval, using the cumulative sum on the timeseries."""
-        if carbon_emission_cumsum[0].size == 0 or start >= end:
-            return 0.
-        # Convert start and end to UNIX timestamp.
-        (start_timestamp, end_timestamp) = (start.timestamp(), end.timestamp())
-
-        # look up in existing carbon emission rates' cumulative carbon emission.
-        (x_values, y_values) = carbon_emission_cumsum
-        (start_cumsum, end_cumsum) = np.interp([start_timestamp, end_timestamp], x_values, y_values)
-        return end_cumsum - start_cumsum
-
-    def _calculate_total_emission(curr_wait_times: list[datetime], breakdown=False):
-        """Calculate the total carbon emissions based on the current wait times."""
-        (input_wait, compute_wait, output_wait) = curr_wait_times
-        input_transfer_start = start + input_wait
-        input_transfer_end = input_transfer_start + input_transfer_time
-        compute_start = input_transfer_end + compute_wait
-        compute_end = compute_start + runtime
-        output_transfer_start = compute_end + output_wait
-        output_transfer_end = output_transfer_start + output_transfer_time
+    if len(starts) == 0:
+        return (np.array([]), np.array([])), []
 
-        input_transfer_emission = _calculate_carbon_emission_in_interval(
-                input_transfer_start,
-                input_transfer_end,
-                transfer_carbon_cumsum)
-        compute_emission = _calculate_carbon_emission_in_interval(
-                compute_start,
-                compute_end,
-                compute_carbon_cumsum)
-        output_transfer_emission = _calculate_carbon_emission_in_interval(
-                output_transfer_start,
-                output_transfer_end,
-                transfer_carbon_cumsum)
-        if breakdown:
-            return (compute_emission , input_transfer_emission + output_transfer_emission)
-        else:
-            return input_transfer_emission + compute_emission + output_transfer_emission
-
-    def _get_marginal_emission_rate_delta_and_step_size(curr_wait_times: list[datetime],
-                                                        moving_index: int) -> tuple[float, timedelta]:
-        """Calculate the total marginal emission rate delta by moving the n-th wait time and the minimum step size across all three steps, while the emission rates stay the same."""
-        def _impl_single_interval(start: datetime, end: datetime, carbon_emission_rates: pd.Series):
-            """Calculates the marginal emission rate delta and step size while the emission rate stays the same."""
-            def _get_value_at_timestamp(target: datetime) -> float:
-                index = carbon_emission_rates.index.searchsorted(target, side='right') - 1
-                return carbon_emission_rates[index]
-            def _get_next_timestamp(target: datetime) -> datetime:
-                index = carbon_emission_rates.index.searchsorted(target, side='right')
-                return carbon_emission_rates.index[index]
-            marginal_rate_start = _get_value_at_timestamp(start)
-            marginal_rate_end = _get_value_at_timestamp(end)
-            step_size_start = _get_next_timestamp(start) - start
-            step_size_end = _get_next_timestamp(end) - end
-            return marginal_rate_end - marginal_rate_start, min(step_size_start, step_size_end)
-
-        assert moving_index >= 0 and moving_index < NUM_TIME_VARIABLES, "Invalid moving index."
-
-        (input_wait, compute_wait, output_wait) = curr_wait_times
-        input_transfer_start = start + input_wait
+    # Transform the carbon intensity rates into cumulative sum for faster lookup.
+    compute_carbon_cumsum = compute_carbon_emission_rates.cumsum()
+    transfer_carbon_cumsum = transfer_carbon_emission_rates.cumsum()
+
+    if isinstance(starts, np.ndarray):
+        start_timestamps = starts.astype('datetime64[us]').astype(np.int64) / 1e6
+        starts = [start.replace(tzinfo=timezone.utc) for start in starts.astype('datetime64[us]').tolist()]
+    else:
+        start_timestamps = np.array([start.timestamp() for start in starts])
+    (runtime_seconds, input_seconds, output_seconds) = (runtime.total_seconds(),
+                                                        input_transfer_time.total_seconds(),
+                                                        output_transfer_time.total_seconds())
+    t_total_wait_limit = max_delay - input_transfer_time - output_transfer_time
+    if transfer_carbon_emission_rates.empty:
+        # Same region, so only the compute wait time matters.
+        compute_waits = _solve_optimal_compute_wait_times(start_timestamps + input_seconds,
+                                                          runtime_seconds,
+                                                          t_total_wait_limit.total_seconds(),
+                                                          compute_carbon_cumsum)
+        input_waits = output_waits = np.zeros(start_timestamps.size)
+    else:
+        (input_waits, compute_waits, output_waits) = _solve_optimal_wait_times(start_timestamps,
+                                                                               runtime_seconds,
+                                                                               input_seconds,
+                                                                               output_seconds,
+                                                                               t_total_wait_limit.total_seconds(),
+                                                                               compute_carbon_cumsum,
+                                                                               transfer_carbon_cumsum)
+
+    input_transfer_starts = start_timestamps + input_waits
+    compute_starts = input_transfer_starts + input_seconds + compute_waits
+    output_transfer_starts = compute_starts + runtime_seconds + output_waits
+    input_transfer_emissions = _calculate_carbon_emission_in_intervals(
+        input_transfer_starts, input_seconds, transfer_carbon_cumsum)
+    compute_emissions = _calculate_carbon_emission_in_intervals(
+        compute_starts, runtime_seconds, compute_carbon_cumsum)
+    output_transfer_emissions = _calculate_carbon_emission_in_intervals(
+        output_transfer_starts, output_seconds, transfer_carbon_cumsum)
+
+    perf_elapsed = time.time() - perf_start_time
+    current_app.logger.info('calculate_total_carbon_emissions_batch() took %.3f seconds' % perf_elapsed)
+
+    l_timings = []
+    for (start, input_wait, compute_wait, output_wait) in zip(starts, input_waits, compute_waits, output_waits):
+        input_transfer_start = start + timedelta(seconds=input_wait)
         input_transfer_end = input_transfer_start + input_transfer_time
-        compute_start = input_transfer_end + compute_wait
+        compute_start = input_transfer_end + timedelta(seconds=compute_wait)
         compute_end = compute_start + runtime
-        output_transfer_start = compute_end + output_wait
+        output_transfer_start = compute_end + timedelta(seconds=output_wait)
         output_transfer_end = output_transfer_start + output_transfer_time
+        l_timings.append({
+            'input_transfer_start': input_transfer_start,
+            'input_transfer_duration': input_transfer_time,
+            'input_transfer_end': input_transfer_end,
+            'compute_start': compute_start,
+            'compute_duration': runtime,
+            'compute_end': compute_end,
+            'output_transfer_start': output_transfer_start,
+            'output_transfer_duration': output_transfer_time,
+            'output_transfer_end': output_transfer_end,
+            'min_start': start,
+            'max_end': start + runtime + max_delay,
+            'total_transfer_time': input_transfer_time + output_transfer_time,
+        })
+    return (compute_emissions, input_transfer_emissions + output_transfer_emissions), l_timings
 
-        sum_rate_delta = 0
-        min_step_size = timedelta(days=365)
-        # Moving the first time afects the latter two steps, and moving the second time affects the last step.
-        if moving_index <= 0 and not transfer_carbon_emission_rates.empty:
-            input_rate_delta, input_step_size = _impl_single_interval(input_transfer_start, input_transfer_end,
-                                                                      transfer_carbon_emission_rates)
-            sum_rate_delta += input_rate_delta
-            min_step_size = min(min_step_size, input_step_size)
-        if moving_index <= 1:
-            compute_rate_delta, compute_step_size = _impl_single_interval(compute_start, compute_end,
-                                                                          compute_carbon_emission_rates)
-            sum_rate_delta += compute_rate_delta
-            min_step_size = min(min_step_size, compute_step_size)
-        if moving_index <= 2 and not transfer_carbon_emission_rates.empty:
-            output_rate_delta, output_step_size = _impl_single_interval(output_transfer_start, output_transfer_end,
-                                                                        transfer_carbon_emission_rates)
-            sum_rate_delta += output_rate_delta
-            min_step_size = min(min_step_size, output_step_size)
-
-        nonlocal perf_counter_step_size
-        perf_counter_step_size += 1
-
-        return sum_rate_delta, min_step_size
-
-    def _advance_wait_times_and_get_emission_delta(curr_wait_times: list[timedelta],
-                      total_wait_limit: timedelta) -> tuple[list[timedelta], float]:
-        """Advance the wait time to the next step and return the accumulated emission delta."""
-        moving_index = NUM_TIME_VARIABLES - 1
-        marginal_emission_rate_delta, step_size = _get_marginal_emission_rate_delta_and_step_size(curr_wait_times, moving_index)
-        if sum(curr_wait_times, timedelta()) + step_size <= total_wait_limit:
-            curr_wait_times[moving_index] += step_size
-            emission_delta = marginal_emission_rate_delta * step_size.total_seconds()
-            return emission_delta
-        else:
-            while moving_index > 0:
-                curr_wait_times[moving_index] = timedelta()
-                moving_index -= 1
-                _, step_size = _get_marginal_emission_rate_delta_and_step_size(curr_wait_times, moving_index)
-                if sum(curr_wait_times, timedelta()) + step_size <= total_wait_limit:
-                    curr_wait_times[moving_index] += step_size
-                    return math.nan
-            curr_wait_times = [timedelta()] * len(curr_wait_times)
-            raise StopIteration()
-
-    # Transform the carbon intensity rates into cumulative sum for faster lookup.
-    compute_carbon_cumsum = _integrate_series(compute_carbon_emission_rates)
-    transfer_carbon_cumsum = _integrate_series(transfer_carbon_emission_rates)
 
-    NUM_TIME_VARIABLES = 3  # input wait, compute wait and output wait
-    t_total_wait_limit = max_delay - input_transfer_time - output_transfer_time
+def calculate_total_carbon_emissions(start: datetime, runtime: timedelta,
+                                     max_delay: timedelta,
+                                     input_transfer_time: timedelta,
+                                     output_transfer_time: timedelta,
+                                     compute_carbon_emission_rates: EmissionRateSeries,
+                                     transfer_carbon_emission_rates: EmissionRateSeries,
+                                     ) -> tuple[tuple[float, float], dict[str, Any]]:
+    """Calculate the total carbon emission, including both compute and data transfer emissions.
 
-    curr_wait_times = [timedelta()] * NUM_TIME_VARIABLES
-    current_emission = _calculate_total_emission(curr_wait_times)
-    min_time_values = curr_wait_times.copy()
-    min_total_emission = current_emission
-
-    perf_counter_calculate_total = 0
-
-    try:
-        while True:
-            emission_delta = _advance_wait_times_and_get_emission_delta(curr_wait_times, t_total_wait_limit)
-            if math.isnan(emission_delta):
-                # Re-calculate total emission is delta is unknown
-                current_emission = _calculate_total_emission(curr_wait_times)
-                perf_counter_calculate_total += 1
-            else:
-                current_emission += emission_delta
-            if current_emission < min_total_emission and not math.isclose(current_emission, min_total_emission):
-                min_total_emission = current_emission
-                min_time_values = curr_wait_times.copy()
-    except StopIteration:
-        pass
+        Args:
+            start: start time of a workload.
+            runtime: runtime of a workload.
+            max_delay: the amount of delay that a workload can tolerate.
+            transfer_input_time: time to transfer input data.
+            transfer_output_time: time to transfer output data.
+            compute_carbon_emission_rates: the compute carbon emission rate in gCO2/s.
+            transfer_carbon_emission_rates: the aggregated data transfer carbon emission rate in gCO2/s.
 
-    perf_elapsed = time.time() - perf_start_time
-    current_app.logger.info('calculate_total_carbon_emissions() took %.3f seconds' % perf_elapsed)
-    current_app.logger.info('perf_counter_calculate_total = %d' % perf_counter_calculate_total)
-    current_app.logger.info('perf_counter_step_size = %d' % perf_counter_step_size)
-
-    curr_wait_times = min_time_values.copy()
-
-    (input_wait, compute_wait, output_wait) = curr_wait_times
-    input_transfer_start = start + input_wait
-    input_transfer_end = input_transfer_start + input_transfer_time
-    compute_start = input_transfer_end + compute_wait
-    compute_end = compute_start + runtime
-    output_transfer_start = compute_end + output_wait
-    output_transfer_end = output_transfer_start + output_transfer_time
-
-    return (_calculate_total_emission(curr_wait_times, True), {
-        'input_transfer_start': input_transfer_start,
-        'input_transfer_duration': input_transfer_time,
-        'input_transfer_end': input_transfer_end,
-        'compute_start': compute_start,
-        'compute_duration': runtime,
-        'compute_end': compute_end,
-        'output_transfer_start': output_transfer_start,
-        'output_transfer_duration': output_transfer_time,
-        'output_transfer_end': output_transfer_end,
-        'min_start': start,
-        'max_end': start + runtime + max_delay,
-        'total_transfer_time': input_transfer_time + output_transfer_time,
-    })
+        Returns:
+            Compute and transfer carbon emissions in gCO2.
+            Timings of the optimal schedule, including delay of start time, if applicable.
+    """
+    (compute_emissions, transfer_emissions), l_timings = calculate_total_carbon_emissions_batch(
+        [start], runtime, max_delay, input_transfer_time, output_transfer_time,
+        compute_carbon_emission_rates, transfer_carbon_emission_rates)
+    return (compute_emissions[0], transfer_emissions[0]), l_timings[0]
@@ -7,7 +7,7 @@ import arrow
 
 from api.helpers.balancing_authority import MAPPING_WATTTIME_BA_TO_AZURE_REGION
 from api.models.common import ISO_PREFIX_WATTTIME
-from api.util import carbon_data_cache, round_down, round_up
+from api.util import carbon_data_cache, carbon_data_range_cache, round_down, round_up
 
 M_ISO_TO_AZURE_REGION = MAPPING_WATTTIME_BA_TO_AZURE_REGION
 
@@ -21,11 +21,9 @@ def get_azure_region_from_iso(iso: str) -> str:
     else:
         raise NotImplementedError(f'Unknown azure region for iso {iso}')
 
-@carbon_data_cache.memoize()
-def fetch_emissions(region: str, start: datetime, end: datetime) -> tuple[bool, list[dict]|str]:
-    """Fetch emission data and return success/failure and either:
-        (on success) the time series carbon data, or
-        (on failure) any error message."""
+@carbon_data_range_cache.memoize()
+def fetch_emissions(region: str, start: datetime, end: datetime) -> list[dict]:
+    """Fetch the time series carbon data, or raise ValueError with the error message on failure."""
     current_app.logger.debug(f'fetch_emissions({region}, {start}, {end})')
     url_get_carbon_intensity = 'https://carbon-aware-api.azurewebsites.net/emissions/bylocations'
     response = requests.get(url_get_carbon_intensity, params={
@@ -33,16 +31,14 @@ def fetch_emissions(region: str, start: datetime, end: datetime) -> tuple[bool,
         'time': arrow.get(start).for_json(),
         'toTime': arrow.get(end).for_json(),
     })
-    try:
-        assert response.ok
-    except AssertionError:
-        return False, "GSF carbon intensity lookup failed (%d): %s" % (response.status_code, response.text)
+    if not response.ok:
+        raise ValueError("GSF carbon intensity lookup failed (%d): %s" % (response.status_code, response.text))
     if response.status_code == 204:
-        return True, []
+        return []
     try:
         response_json = response.json()
     except (ValueError, TypeError) as e:
-        return False, f'Failed to read JSON: "{e}", url: "{response.request.path_url}", text: "{response.text}"'
+        raise ValueError(f'Failed to read JSON: "{e}", url: "{response.request.path_url}", text: "{response.text}"')
 
     rows = []
     if len(response_json) == 0:
@@ -57,7 +53,7 @@ def fetch_emissions(region: str, start: datetime, end: datetime) -> tuple[bool,
             'timestamp': timestamp,
             'carbon_intensity': rating
         })
-    return True, rows
+    return rows
 
 
 @carbon_data_cache.memoize()
@@ -122,10 +118,12 @@ def get_carbon_intensity_list(iso: str, start: datetime, end: datetime,
             A list of time series data.
     """
     region = get_azure_region_from_iso(iso)
-    if use_prediction:
-        success, result_or_error = fetch_prediction(region, start, end)
-    else:
-        success, result_or_error = fetch_emissions(region, start, end)
+    if not use_prediction:
+        try:
+            return fetch_emissions(region, start, end)
+        except ValueError as e:
+            raise ValueError('Failed to get carbon intensity: ' + str(e))
+    success, result_or_error = fetch_prediction(region, start, end)
     if success:
         return result_or_error
     else:
@@ -6,14 +6,19 @@ import numpy as np
 import psycopg2
 from pathlib import Path
 from datetime import datetime
+from typing import Iterable, Iterator
 
 from api.helpers.balancing_authority import MAPPING_WATTTIME_BA_TO_C3LAB_REGION
-from api.helpers.carbon_intensity_shared import validate_region_exists, validate_time_range
+from api.helpers.carbon_intensity_shared import fetch_time_series_columns_in_range, fetch_time_series_in_range, \
+    fetch_time_series_in_ranges, iter_time_series_in_range, validate_region_exists, validate_time_range
 from api.models.common import ISO_PREFIX_C3LAB, ISO_PREFIX_WATTTIME
-from api.util import load_yaml_data, get_psql_connection, psql_execute_list, carbon_data_cache
+from api.util import load_yaml_data, psql_connection, psql_execute_iter, psql_execute_list, carbon_data_cache, \
+    carbon_data_range_cache
 
 TABLE_NAME = 'energymixture'
 REGION_COLUMN = 'region'
+# Precomputed per-(region, datetime) carbon intensity, maintained by the crawler.
+CARBON_INTENSITY_TABLE_NAME = 'carbonintensitybyrenewablematerialized'
 
 M_ISO_TO_C3LAB_REGION = MAPPING_WATTTIME_BA_TO_C3LAB_REGION
 
@@ -68,29 +73,15 @@ def _calculate_scaled_carbon_intensity(
 def _get_average_carbon_intensity(conn: psycopg2.extensions.connection,
                                  region: str, start: datetime, end: datetime,
                                  desired_renewable_ratio: float) -> list[dict]:
-    cursor = conn.cursor()
-    # in case start/end lie in between two timestamps, find the timestamp <= start and >= end.
-    records: list[tuple[datetime, float]] = psql_execute_list(
-        cursor,
-        """SELECT datetime,
-                Renewable_CarbonIntensity,
-                NonRenewable_CarbonIntensity,
-                Renewable_Ratio
-            FROM CarbonIntensityByRenewable
-            WHERE region = %(region)s
-                AND datetime >= (SELECT COALESCE(
-                    (SELECT MAX(datetime) FROM EnergyMixture
-                        WHERE datetime <= %(start)s AND region = %(region)s),
-                    (SELECT MIN(datetime) FROM EnergyMixture
-                        WHERE region = %(region)s)))
-                AND datetime <= (SELECT COALESCE(
-                    (SELECT MIN(datetime) FROM EnergyMixture
-                        WHERE datetime >= %(end)s AND region = %(region)s),
-                    (SELECT MAX(datetime) FROM EnergyMixture
-                        WHERE region = %(region)s)))
-            ORDER BY datetime;""",
-        dict(region=region, start=start, end=end))
-    l_carbon_intensity = []
+    records: list[tuple[datetime, float, float, float]] = fetch_time_series_in_range(
+        conn, region, start, end,
+        ['renewable_carbonintensity', 'nonrenewable_carbonintensity', 'renewable_ratio'],
+        CARBON_INTENSITY_TABLE_NAME, REGION_COLUMN)
+    return list(_convert_records(records, desired_renewable_ratio))
+
+
+def _convert_records(records: Iterable[tuple[datetime, float, float, float]],
+                     desired_renewable_ratio: float) -> Iterator[dict]:
     for tuple in records:
         (timestamp, renewable_carbon_intensity, nonrenewable_carbon_intensity, renewable_ratio) = tuple
         carbon_intensity = _calculate_scaled_carbon_intensity(
@@ -98,12 +89,11 @@ def _get_average_carbon_intensity(conn: psycopg2.extensions.connection,
             nonrenewable_carbon_intensity,
             renewable_ratio,
             desired_renewable_ratio)
-        l_carbon_intensity.append({
+        yield {
             'timestamp': timestamp,
             'carbon_intensity': carbon_intensity,
             'renewable_ratio': desired_renewable_ratio if desired_renewable_ratio else renewable_ratio
-        })
-    return l_carbon_intensity
+        }
 
 
 def _get_power_by_timestamp_and_fuel_source(conn: psycopg2.extensions.connection,
@@ -144,18 +134,81 @@ def _calculate_average_carbon_intensity(
         })
     return l_carbon_intensity_by_timestamp
 
-@carbon_data_cache.memoize()
+@carbon_data_range_cache.memoize()
 def fetch_emissions(region: str, start: datetime, end: datetime,
                                  desired_renewable_ratio: float) -> list[dict]:
     # TODO: make this not throw exception for memoize to work
     current_app.logger.debug(f'fetch_emissions({region}, {start}, {end}, {desired_renewable_ratio})')
-    conn = get_psql_connection()
-    validate_region_exists(conn, region, TABLE_NAME, REGION_COLUMN)
-    validate_time_range(conn, region, start, end, TABLE_NAME, REGION_COLUMN)
-    return _get_average_carbon_intensity(conn, region, start, end, desired_renewable_ratio)
+    with psql_connection() as conn:
+        return _get_average_carbon_intensity(conn, region, start, end, desired_renewable_ratio)
     # power_by_fuel_source = get_power_by_timestamp_and_fuel_source(conn, region, start, end)
     # return _calculate_average_carbon_intensity(power_by_fuel_source)
 
+@carbon_data_range_cache.memoize_many(fetch_emissions)
+def fetch_emissions_many(l_requests: list[tuple[str, datetime, datetime, float]]) -> list[list[dict] | Exception]:
+    """Batch version of `fetch_emissions()`, which fetches all (region, start, end, desired_renewable_ratio)
+        requests in one query."""
+    current_app.logger.debug(f'fetch_emissions_many({len(l_requests)} requests)')
+    with psql_connection() as conn:
+        l_records = fetch_time_series_in_ranges(
+            conn, [(region, start, end) for (region, start, end, _) in l_requests],
+            ['renewable_carbonintensity', 'nonrenewable_carbonintensity', 'renewable_ratio'],
+            CARBON_INTENSITY_TABLE_NAME, REGION_COLUMN)
+    return [list(_convert_records(records, desired_renewable_ratio)) if not isinstance(records, Exception) else records
+            for (records, (_, _, _, desired_renewable_ratio)) in zip(l_records, l_requests)]
+
+def iter_carbon_intensity(iso: str, start: datetime, end: datetime,
+                          desired_renewable_ratio: float = None) -> Iterator[dict]:
+    """Streaming version of `get_carbon_intensity_list()` for historical data, which bypasses the caches."""
+    region = get_c3lab_region_from_iso(iso)
+    with psql_connection() as conn:
+        yield from _convert_records(iter_time_series_in_range(
+            conn, region, start, end,
+            ['renewable_carbonintensity', 'nonrenewable_carbonintensity', 'renewable_ratio'],
+            CARBON_INTENSITY_TABLE_NAME, REGION_COLUMN), desired_renewable_ratio)
+
+def _calculate_scaled_carbon_intensity_columns(
+            renewable_carbon_intensity: np.ndarray,
+            nonrenewable_carbon_intensity: np.ndarray,
+            current_renewable_ratio: np.ndarray,
+            desired_renewable_ratio: float = None) -> tuple[np.ndarray, np.ndarray]:
+    """Vectorized version of `_calculate_scaled_carbon_intensity()` over columns where None is NaN.
+
+        Returns:
+            The carbon intensity and renewable ratio columns.
+    """
+    renewable_ratio = np.full_like(current_renewable_ratio, desired_renewable_ratio) \
+        if desired_renewable_ratio else current_renewable_ratio
+    carbon_intensity = renewable_carbon_intensity * renewable_ratio + \
+        nonrenewable_carbon_intensity * (1 - renewable_ratio)
+    # Cannot scale if only one type of sources is used
+    carbon_intensity = np.where(np.isnan(nonrenewable_carbon_intensity), renewable_carbon_intensity, carbon_intensity)
+    carbon_intensity = np.where(np.isnan(renewable_carbon_intensity), nonrenewable_carbon_intensity, carbon_intensity)
+    return carbon_intensity, renewable_ratio
+
+def get_carbon_intensity_columns(iso: str, start: datetime, end: datetime,
+                                 desired_renewable_ratio: float = None) -> dict[str, np.ndarray]:
+    """Columnar version of `get_carbon_intensity_list()` for historical data, which bypasses the caches.
+
+        Returns:
+            The 'timestamp' column in seconds since the UNIX epoch, and the 'carbon_intensity' and 'renewable_ratio'
+            columns, where missing values are NaN.
+    """
+    region = get_c3lab_region_from_iso(iso)
+    with psql_connection() as conn:
+        d_columns = fetch_time_series_columns_in_range(
+            conn, region, start, end,
+            ['renewable_carbonintensity', 'nonrenewable_carbonintensity', 'renewable_ratio'],
+            CARBON_INTENSITY_TABLE_NAME, REGION_COLUMN)
+    (carbon_intensity, renewable_ratio) = _calculate_scaled_carbon_intensity_columns(
+        d_columns['renewable_carbonintensity'], d_columns['nonrenewable_carbonintensity'],
+        d_columns['renewable_ratio'], desired_renewable_ratio)
+    return {
+        'timestamp': d_columns['timestamp'],
+        'carbon_intensity': carbon_intensity,
+        'renewable_ratio': renewable_ratio,
+    }
+
 @carbon_data_cache.memoize()
 def fetch_prediction(region: str, start: datetime, end: datetime,
         desired_renewable_ratio: float) -> list[dict]:
@@ -188,10 +241,10 @@ def get_carbon_intensity_list(iso: str, start: datetime, end: datetime,
 def get_power_by_fuel_type(iso: str, start: datetime, end: datetime) -> list[dict]:
     """Retrieves the raw power (in MW) broken down by timestamp and fuel type."""
     region = get_c3lab_region_from_iso(iso)
-    conn = get_psql_connection()
-    validate_region_exists(conn, region, TABLE_NAME, REGION_COLUMN)
-    validate_time_range(conn, region, start, end, TABLE_NAME, REGION_COLUMN)
-    d_timestamp_fuel_power = _get_power_by_timestamp_and_fuel_source(conn, region, start, end)
+    with psql_connection() as conn:
+        validate_region_exists(conn, region, TABLE_NAME, REGION_COLUMN)
+        validate_time_range(conn, region, start, end, TABLE_NAME, REGION_COLUMN)
+        d_timestamp_fuel_power = _get_power_by_timestamp_and_fuel_source(conn, region, start, end)
     result = []
     for timestamp in d_timestamp_fuel_power:
         l_fuel_mix = []
@@ -206,3 +259,53 @@ def get_power_by_fuel_type(iso: str, start: datetime, end: datetime) -> list[dic
             'values': l_fuel_mix
         })
     return result
+
+
+def iter_power_by_fuel_type(iso: str, start: datetime, end: datetime) -> Iterator[tuple[datetime, str, float]]:
+    """Streaming version of `get_power_by_fuel_type()`, which yields (timestamp, fuel type, power in MW) rows
+        ordered by timestamp from a server-side cursor."""
+    region = get_c3lab_region_from_iso(iso)
+    with psql_connection() as conn:
+        validate_region_exists(conn, region, TABLE_NAME, REGION_COLUMN)
+        validate_time_range(conn, region, start, end, TABLE_NAME, REGION_COLUMN)
+        yield from psql_execute_iter(
+            conn,
+            """SELECT datetime, category, power_mw FROM EnergyMixture
+                WHERE region = %s AND %s <= datetime AND datetime <= %s
+                ORDER BY datetime, category;""",
+            [region, start, end])
+
+
+def get_power_by_fuel_type_columns(iso: str, start: datetime, end: datetime) -> dict[str, np.ndarray]:
+    """Columnar version of `get_power_by_fuel_type()`, with one row per timestamp.
+
+        Returns:
+            The 'timestamp' column in seconds since the UNIX epoch, and one column of power in MW per fuel type, where
+            NaN means that the fuel type has no value at the timestamp.
+    """
+    region = get_c3lab_region_from_iso(iso)
+    with psql_connection() as conn:
+        validate_region_exists(conn, region, TABLE_NAME, REGION_COLUMN)
+        validate_time_range(conn, region, start, end, TABLE_NAME, REGION_COLUMN)
+        l_fuel_types: list[str] = [fuel_type for (fuel_type,) in psql_execute_list(
+            conn.cursor(),
+            """SELECT DISTINCT category FROM EnergyMixture
+                WHERE region = %s AND %s <= datetime AND datetime <= %s
+                ORDER BY category;""",
+            [region, start, end])]
+        if not l_fuel_types:
+            return {'timestamp': np.empty(0, dtype=np.int64)}
+        # The fuel types are fetched as their index in `l_fuel_types`, so that all fields are numeric.
+        records = np.fromiter(psql_execute_iter(
+            conn,
+            """SELECT EXTRACT(EPOCH FROM datetime)::bigint, array_position(%s::text[], category::text) - 1,
+                    COALESCE(power_mw::float8, 'NaN')
+                FROM EnergyMixture
+                WHERE region = %s AND %s <= datetime AND datetime <= %s
+                ORDER BY datetime, category;""",
+            [l_fuel_types, region, start, end]),
+            dtype=[('timestamp', np.int64), ('fuel_type', np.int64), ('power_mw', np.float64)])
+    (timestamps, row_indices) = np.unique(records['timestamp'], return_inverse=True)
+    power_mw = np.full((len(l_fuel_types), len(timestamps)), np.nan)
+    power_mw[records['fuel_type'], row_indices] = records['power_mw']
+    return {'timestamp': timestamps} | dict(zip(l_fuel_types, power_mw))
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
+from typing import Iterable, Iterator
 from flask import current_app
 import psycopg2
-from psycopg2 import sql
-from api.helpers.carbon_intensity_shared import validate_region_exists, validate_time_range
+import numpy as np
+from api.helpers.carbon_intensity_shared import fetch_time_series_columns_in_range, fetch_time_series_in_range, \
+    fetch_time_series_in_ranges, iter_time_series_in_range
 
 from api.models.common import ISO_PREFIX_EMAP
-from api.util import carbon_data_cache, get_psql_connection, psql_execute_list
+from api.util import carbon_data_cache, carbon_data_range_cache, psql_connection
 
 TABLE_NAME = 'emapcarbonintensity'
 REGION_COLUMN = 'zoneid'
@@ -22,33 +24,17 @@ def get_emap_region_from_iso(iso: str) -> str:
 def _get_carbon_intensity_timeseries(conn: psycopg2.extensions.connection,
                                  region: str, start: datetime, end: datetime) -> list[dict]:
     """Get the carbon intensity time series data from the database."""
-    cursor = conn.cursor()
-    # in case start/end lie in between two timestamps, find the timestamp <= start and >= end.
-    records: list[tuple[datetime, float]] = psql_execute_list(
-        cursor,
-        sql.SQL("""SELECT datetime, CarbonIntensity
-            FROM {table}
-            WHERE zoneid = %(region)s
-                AND datetime >= (SELECT COALESCE(
-                    (SELECT MAX(datetime) FROM EnergyMixture
-                        WHERE datetime <= %(start)s AND zoneid = %(region)s),
-                    (SELECT MIN(datetime) FROM EnergyMixture
-                        WHERE zoneid = %(region)s)))
-                AND datetime <= (SELECT COALESCE(
-                    (SELECT MIN(datetime) FROM EnergyMixture
-                        WHERE datetime >= %(end)s AND zoneid = %(region)s),
-                    (SELECT MAX(datetime) FROM EnergyMixture
-                        WHERE zoneid = %(region)s)))
-            ORDER BY datetime;""").format(table=sql.Identifier(TABLE_NAME)),
-        dict(region=region, start=start, end=end))
-    l_carbon_intensity = []
+    records: list[tuple[datetime, float]] = fetch_time_series_in_range(
+        conn, region, start, end, ['carbonintensity'], TABLE_NAME, REGION_COLUMN)
+    return list(_convert_records(records))
+
+def _convert_records(records: Iterable[tuple[datetime, float]]) -> Iterator[dict]:
     for tuple in records:
         (timestamp, carbon_intensity) = tuple
-        l_carbon_intensity.append({
+        yield {
             'timestamp': timestamp,
             'carbon_intensity': carbon_intensity,
-        })
-    return l_carbon_intensity
+        }
 
 def get_carbon_intensity_list(iso: str, start: datetime, end: datetime,
         use_prediction: bool = False) -> list[dict]:
@@ -74,10 +60,35 @@ def fetch_prediction(region: str, start: datetime, end: datetime) -> list[dict]:
     current_app.logger.debug(f'fetch_prediction({region}, {start}, {end})')
     raise ValueError('Electricit map carbon data source does not support prediction')
 
-@carbon_data_cache.memoize()
+@carbon_data_range_cache.memoize()
 def fetch_emissions(region: str, start: datetime, end: datetime) -> list[dict]:
     current_app.logger.debug(f'fetch_emissions({region}, {start}, {end})')
-    conn = get_psql_connection()
-    validate_region_exists(conn, region, TABLE_NAME, REGION_COLUMN)
-    validate_time_range(conn, region, start, end, TABLE_NAME, REGION_COLUMN)
-    return _get_carbon_intensity_timeseries(conn, region, start, end)
+    with psql_connection() as conn:
+        return _get_carbon_intensity_timeseries(conn, region, start, end)
+
+@carbon_data_range_cache.memoize_many(fetch_emissions)
+def fetch_emissions_many(l_requests: list[tuple[str, datetime, datetime]]) -> list[list[dict] | Exception]:
+    """Batch version of `fetch_emissions()`, which fetches all (region, start, end) requests in one query."""
+    current_app.logger.debug(f'fetch_emissions_many({len(l_requests)} requests)')
+    with psql_connection() as conn:
+        l_records = fetch_time_series_in_ranges(conn, l_requests, ['carbonintensity'], TABLE_NAME, REGION_COLUMN)
+    return [list(_convert_records(records)) if not isinstance(records, Exception) else records
+            for records in l_records]
+
+def iter_carbon_intensity(iso: str, start: datetime, end: datetime) -> Iterator[dict]:
+    """Streaming version of `get_carbon_intensity_list()` for historical data, which bypasses the caches."""
+    region = get_emap_region_from_iso(iso)
+    with psql_connection() as conn:
+        yield from _convert_records(iter_time_series_in_range(
+            conn, region, start, end, ['carbonintensity'], TABLE_NAME, REGION_COLUMN))
+
+def get_carbon_intensity_columns(iso: str, start: datetime, end: datetime) -> dict[str, np.ndarray]:
+    """Columnar version of `get_carbon_intensity_list()` for historical data, which bypasses the caches."""
+    region = get_emap_region_from_iso(iso)
+    with psql_connection() as conn:
+        d_columns = fetch_time_series_columns_in_range(
+            conn, region, start, end, ['carbonintensity'], TABLE_NAME, REGION_COLUMN)
+    return {
+        'timestamp': d_columns['timestamp'],
+        'carbon_intensity': d_columns['carbonintensity'],
+    }
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import bisect
 from datetime import datetime
+from typing import Iterator
+import numpy as np
 import psycopg2
 from psycopg2 import sql
-from werkzeug.exceptions import NotFound, BadRequest
+from werkzeug.exceptions import HTTPException, NotFound, BadRequest
 
-from api.util import psql_execute_scalar
+from api.util import psql_execute_iter, psql_execute_list, psql_execute_scalar
 
 
 def validate_region_exists(conn: psycopg2.extensions.connection, region: str,
@@ -53,3 +56,238 @@ def validate_time_range(conn: psycopg2.extensions.connection,
         raise BadRequest("Time range is too new. Data not yet available.")
     if end < available_start:
         raise BadRequest("Time range is too old. No data available.")
+
+
+def _sql_time_series_bounds(table_name: str, region_column: str, datetime_column: str,
+                            region: sql.Composable, start: sql.Composable, end: sql.Composable) -> sql.Composed:
+    """Build a subquery of the bounds of fetching [start, end] of a region, where the region and range are SQL
+        placeholders or columns of the outer query.
+
+        The subquery has one row with available_start and available_end, the first and last timestamps of the region
+        or NULL if it doesn't exist, and range_start and range_end, the timestamps <= start and >= end that bracket
+        the range, or the available ones if there are none. Each timestamp is looked up with `ORDER BY ... LIMIT 1` on
+        the (region, datetime) index of the table.
+    """
+    return sql.SQL("""(SELECT available_start, available_end,
+                COALESCE(bracket_start, available_start) AS range_start,
+                COALESCE(bracket_end, available_end) AS range_end
+            FROM (SELECT
+                    (SELECT {datetime} FROM {table} WHERE {region} = {region_value}
+                        ORDER BY {datetime} LIMIT 1) AS available_start,
+                    (SELECT {datetime} FROM {table} WHERE {region} = {region_value}
+                        ORDER BY {datetime} DESC LIMIT 1) AS available_end,
+                    (SELECT {datetime} FROM {table} WHERE {region} = {region_value} AND {datetime} <= {start}
+                        ORDER BY {datetime} DESC LIMIT 1) AS bracket_start,
+                    (SELECT {datetime} FROM {table} WHERE {region} = {region_value} AND {datetime} >= {end}
+                        ORDER BY {datetime} LIMIT 1) AS bracket_end
+                ) AS probes)""").format(
+        table=sql.Identifier(table_name),
+        region=sql.Identifier(region_column),
+        datetime=sql.Identifier(datetime_column),
+        region_value=region, start=start, end=end)
+
+
+def fetch_time_series_in_range(conn: psycopg2.extensions.connection,
+                               region: str, start: datetime, end: datetime, value_columns: list[str],
+                               table_name: str, region_column: str = "region", datetime_column: str = "datetime") -> \
+        list[tuple]:
+    """Fetch the time series of a region in one query, which also validates the region and time range.
+
+        In case start/end lie in between two timestamps, the series is extended to the timestamp <= start and >= end.
+        The bounds are looked up with `_sql_time_series_bounds()`.
+
+        Returns:
+            A list of (datetime, *value_columns) tuples, ordered by datetime.
+    """
+    if start > end:
+        raise BadRequest("end must be before start")
+    cursor = conn.cursor()
+    records: list[tuple] = psql_execute_list(
+        cursor,
+        sql.SQL("""SELECT bounds.available_start, bounds.available_end, series.*
+            FROM {bounds} AS bounds
+            LEFT JOIN LATERAL (
+                SELECT {datetime}, {values} FROM {table}
+                    WHERE {region} = %(region)s
+                        AND {datetime} >= bounds.range_start AND {datetime} <= bounds.range_end
+            ) AS series ON TRUE
+            ORDER BY series.{datetime};""").format(
+            bounds=_sql_time_series_bounds(table_name, region_column, datetime_column, sql.Placeholder('region'),
+                                           sql.Placeholder('start'), sql.Placeholder('end')),
+            table=sql.Identifier(table_name),
+            region=sql.Identifier(region_column),
+            datetime=sql.Identifier(datetime_column),
+            values=sql.SQL(', ').join(map(sql.Identifier, value_columns))),
+        dict(region=region, start=start, end=end))
+    (available_start, available_end) = records[0][:2]
+    if available_start is None:
+        raise NotFound(f"Region {region} doesn't exist.")
+    if start > available_end:
+        raise BadRequest("Time range is too new. Data not yet available.")
+    if end < available_start:
+        raise BadRequest("Time range is too old. No data available.")
+    return [record[2:] for record in records if record[2] is not None]
+
+
+def _get_time_series_range(conn: psycopg2.extensions.connection,
+                           region: str, start: datetime, end: datetime,
+                           table_name: str, region_column: str, datetime_column: str) -> tuple[datetime, datetime]:
+    """Validate the region and time range, and get the range of timestamps to fetch, i.e. extended to the timestamp
+        <= start and >= end, with a query of the bounds."""
+    if start > end:
+        raise BadRequest("end must be before start")
+    cursor = conn.cursor()
+    ((available_start, available_end, range_start, range_end),) = psql_execute_list(
+        cursor,
+        sql.SQL("SELECT * FROM {bounds} AS bounds;").format(
+            bounds=_sql_time_series_bounds(table_name, region_column, datetime_column, sql.Placeholder('region'),
+                                           sql.Placeholder('start'), sql.Placeholder('end'))),
+        dict(region=region, start=start, end=end))
+    if available_start is None:
+        raise NotFound(f"Region {region} doesn't exist.")
+    if start > available_end:
+        raise BadRequest("Time range is too new. Data not yet available.")
+    if end < available_start:
+        raise BadRequest("Time range is too old. No data available.")
+    return range_start, range_end
+
+
+def iter_time_series_in_range(conn: psycopg2.extensions.connection,
+                              region: str, start: datetime, end: datetime, value_columns: list[str],
+                              table_name: str, region_column: str = "region", datetime_column: str = "datetime") -> \
+        Iterator[tuple]:
+    """Streaming version of `fetch_time_series_in_range()`, which yields the rows from a server-side cursor.
+
+        The region and time range are validated with a query of the bounds before the first row, and the rows are
+        then fetched with `psql_execute_iter()`, so the memory use is independent of the length of the range.
+    """
+    (range_start, range_end) = _get_time_series_range(conn, region, start, end,
+                                                      table_name, region_column, datetime_column)
+    yield from psql_execute_iter(
+        conn,
+        sql.SQL("""SELECT {datetime}, {values} FROM {table}
+            WHERE {region} = %(region)s AND {datetime} >= %(start)s AND {datetime} <= %(end)s
+            ORDER BY {datetime};""").format(
+            table=sql.Identifier(table_name),
+            region=sql.Identifier(region_column),
+            datetime=sql.Identifier(datetime_column),
+            values=sql.SQL(', ').join(map(sql.Identifier, value_columns))),
+        dict(region=region, start=range_start, end=range_end))
+
+
+def fetch_time_series_columns_in_range(conn: psycopg2.extensions.connection,
+                                       region: str, start: datetime, end: datetime, value_columns: list[str],
+                                       table_name: str, region_column: str = "region",
+                                       datetime_column: str = "datetime") -> dict[str, np.ndarray]:
+    """Columnar version of `fetch_time_series_in_range()`, which returns one array per column.
+
+        The rows are read from a server-side cursor straight into a structured array, with the timestamps as int64
+        seconds since the UNIX epoch in 'timestamp', and the values as float64 where NULL is NaN.
+    """
+    (range_start, range_end) = _get_time_series_range(conn, region, start, end,
+                                                      table_name, region_column, datetime_column)
+    records = np.fromiter(
+        psql_execute_iter(
+            conn,
+            sql.SQL("""SELECT EXTRACT(EPOCH FROM {datetime})::bigint, {values} FROM {table}
+                WHERE {region} = %(region)s AND {datetime} >= %(start)s AND {datetime} <= %(end)s
+                ORDER BY {datetime};""").format(
+                table=sql.Identifier(table_name),
+                region=sql.Identifier(region_column),
+                datetime=sql.Identifier(datetime_column),
+                values=sql.SQL(', ').join(sql.SQL("COALESCE({}::float8, 'NaN')").format(sql.Identifier(column))
+                                          for column in value_columns)),
+            dict(region=region, start=range_start, end=range_end)),
+        dtype=[('timestamp', np.int64)] + [(column, np.float64) for column in value_columns])
+    return {name: records[name] for name in records.dtype.names}
+
+
+def fetch_time_series_in_ranges(conn: psycopg2.extensions.connection,
+                                l_ranges: list[tuple[str, datetime, datetime]], value_columns: list[str],
+                                table_name: str, region_column: str = "region", datetime_column: str = "datetime") -> \
+        list[list[tuple] | HTTPException]:
+    """Batch version of `fetch_time_series_in_range()`, which fetches many (region, start, end) ranges in one query.
+
+        The bracketed ranges of each region are merged into their union, whose rows are fetched with one index range
+        scan each, and then sliced into the result of each range.
+
+        Returns:
+            The result of each range in input order, or the exception that `fetch_time_series_in_range()` would raise.
+    """
+    l_results: list[list[tuple] | HTTPException | None] = [None] * len(l_ranges)
+    l_valid_ranges = []
+    for (i, (region, start, end)) in enumerate(l_ranges):
+        if start > end:
+            l_results[i] = BadRequest("end must be before start")
+        else:
+            l_valid_ranges.append((i, region, start, end))
+    if not l_valid_ranges:
+        return l_results
+
+    (_, regions, starts, ends) = zip(*l_valid_ranges)
+    cursor = conn.cursor()
+    records: list[tuple] = psql_execute_list(
+        cursor,
+        sql.SQL("""WITH ranges AS (
+                SELECT * FROM unnest(%(regions)s::text[], %(starts)s::timestamptz[], %(ends)s::timestamptz[])
+                    AS ranges(region, start_time, end_time)
+            ), brackets AS MATERIALIZED (
+                SELECT ranges.region, bounds.*
+                FROM ranges
+                CROSS JOIN LATERAL {bounds} AS bounds
+            ), islands AS (
+                -- Overlapping ranges of a region belong to the same island, i.e. their union.
+                SELECT region, range_start, range_end,
+                    COUNT(*) FILTER (WHERE NOT overlaps_previous)
+                        OVER (PARTITION BY region ORDER BY range_start, range_end) AS island
+                FROM (SELECT region, range_start, range_end,
+                        COALESCE(range_start <= MAX(range_end) OVER (
+                            PARTITION BY region ORDER BY range_start, range_end
+                            ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), FALSE) AS overlaps_previous
+                    FROM brackets WHERE available_start IS NOT NULL) AS sorted_brackets
+            ), merged_ranges AS (
+                SELECT region, MIN(range_start) AS range_start, MAX(range_end) AS range_end
+                FROM islands GROUP BY region, island
+            )
+            SELECT bounds.region, bounds.available_start, bounds.available_end, series.*
+            FROM (SELECT DISTINCT region, available_start, available_end FROM brackets) AS bounds
+            LEFT JOIN (
+                SELECT merged_ranges.region AS series_region, t.*
+                FROM merged_ranges
+                CROSS JOIN LATERAL (
+                    SELECT {datetime}, {values} FROM {table}
+                        WHERE {region} = merged_ranges.region
+                            AND {datetime} >= merged_ranges.range_start AND {datetime} <= merged_ranges.range_end
+                ) AS t
+            ) AS series ON series.series_region = bounds.region
+            ORDER BY bounds.region, series.{datetime};""").format(
+            bounds=_sql_time_series_bounds(table_name, region_column, datetime_column, sql.SQL('ranges.region'),
+                                           sql.SQL('ranges.start_time'), sql.SQL('ranges.end_time')),
+            table=sql.Identifier(table_name),
+            region=sql.Identifier(region_column),
+            datetime=sql.Identifier(datetime_column),
+            values=sql.SQL(', ').join(map(sql.Identifier, value_columns))),
+        dict(regions=list(regions), starts=list(starts), ends=list(ends)))
+
+    d_bounds: dict[str, tuple[datetime, datetime]] = {}
+    d_series: dict[str, list[tuple]] = {}
+    for record in records:
+        d_bounds[record[0]] = record[1:3]
+        if record[4] is not None:
+            d_series.setdefault(record[0], []).append(record[4:])
+    d_timestamps = {region: [row[0] for row in series] for (region, series) in d_series.items()}
+    for (i, region, start, end) in l_valid_ranges:
+        (available_start, available_end) = d_bounds.get(region, (None, None))
+        if available_start is None:
+            l_results[i] = NotFound(f"Region {region} doesn't exist.")
+        elif start > available_end:
+            l_results[i] = BadRequest("Time range is too new. Data not yet available.")
+        elif end < available_start:
+            l_results[i] = BadRequest("Time range is too old. No data available.")
+        else:
+            # The fetched rows contain the rows around start/end, so the brackets are found in them.
+            timestamps = d_timestamps[region]
+            i_start = max(bisect.bisect_right(timestamps, start) - 1, 0)
+            i_end = min(bisect.bisect_left(timestamps, end), len(timestamps) - 1)
+            l_results[i] = d_series[region][i_start:i_end + 1]
+    return l_results
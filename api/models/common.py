@@ -23,6 +23,16 @@ class IsoFormat(str, Enum):
     Unknown = "unknown"
 
 
+class ResponseFormat(str, Enum):
+    JSON = "json"
+    # Streamed line by line, for long time ranges.
+    NDJSON = "ndjson"
+    CSV = "csv"
+    # Columnar binary, with timestamps in seconds since the UNIX epoch.
+    ARROW = "arrow"
+    NPZ = "npz"
+
+
 ISO_PREFIX_WATTTIME = f'{IsoFormat.WattTime}:'
 ISO_PREFIX_C3LAB = f'{IsoFormat.C3Lab}:'
 ISO_PREFIX_EMAP = f'{IsoFormat.EMap}:'
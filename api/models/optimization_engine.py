@@ -3,6 +3,8 @@
 from enum import Enum
 from typing import Optional
 
+import numpy as np
+
 
 class OptimizationFactor(str, Enum):
     EnergyUsage = 'energy-usage'
@@ -17,51 +19,86 @@ class OptimizationFactor(str, Enum):
 
 
 class OptimizationEngine:
-    """A simple optimization engine that takes weights of factors and compute the best candidates."""
+    """A simple optimization engine that takes weights of factors and compute the best candidates.
+
+        Scores are evaluated on a candidates x factors matrix, and lower scores are better for all factors.
+    """
 
     def __init__(self, factors: list[OptimizationFactor], weights: list[float]) -> None:
         if len(factors) != len(weights):
             raise ValueError("Length of factors and weight must be the same.")
 
-        self.factors = factors
-        self.weights = weights
-        # self.factor_index_lookup_table = {}
-        # for i in range(len(factors)):
-        #     self.factor_index_lookup_table[factors[i]] = i
-
-    def _calculate_weighted_score(self, score_dict: dict[OptimizationFactor, float]) -> float:
-        total_weighted_score = 0.
-        for i in range(len(self.factors)):
-            factor = self.factors[i]
-            weight = self.weights[i]
-            score = score_dict[factor] if factor in score_dict else 0.
-            total_weighted_score += score * weight
-        return total_weighted_score / len(self.factors)
-
-    def compare_candidates(self, d_scores: dict[str, dict[OptimizationFactor, float]], return_scores=False) -> \
-            tuple[list, Optional[dict[str, float]]]:
+        self.factors = list(factors)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def with_weights(self, d_weights: dict[OptimizationFactor, float]) -> 'OptimizationEngine':
+        """Get a new engine with some of the weights overridden, and new factors appended if not present yet."""
+        if not d_weights:
+            return self
+        factors = self.factors + [factor for factor in d_weights if factor not in self.factors]
+        weights = [d_weights.get(factor, weight) for (factor, weight) in zip(self.factors, self.weights.tolist())]
+        weights += [d_weights[factor] for factor in factors[len(self.factors):]]
+        return OptimizationEngine(factors, weights)
+
+    def get_score_matrix(self, d_scores: dict[str, dict[OptimizationFactor, float]]) -> tuple[list[str], np.ndarray]:
+        """Convert the scores into a candidates x factors matrix, where missing scores are zero."""
+        candidates = list(d_scores.keys())
+        score_matrix = np.array([[scores.get(factor, 0.) for factor in self.factors]
+                                 for scores in d_scores.values()], dtype=np.float64).reshape(-1, len(self.factors))
+        return candidates, score_matrix
+
+    def calculate_weighted_scores(self, score_matrix: np.ndarray) -> np.ndarray:
+        return score_matrix @ self.weights / len(self.factors)
+
+    def calculate_weighted_score(self, scores: dict[OptimizationFactor, float]) -> float:
+        return float(self.calculate_weighted_scores(self.get_score_matrix({None: scores})[1])[0])
+
+    def compare_candidates(self, d_scores: dict[str, dict[OptimizationFactor, float]], return_scores=False,
+                           top_k: Optional[int] = None) -> tuple[list, Optional[dict[str, float]]]:
         """Compares the candidate based on their scores in each factor and return the best candidates.
 
         Args:
             scores: a map from candidate name to a dict; the latter contains scores key'd by factor.
             return_scores: whether to return the calculated score.
+            top_k: only return the best k candidates, or all candidates if not set. Candidates with equal scores are
+                ordered as in the input.
 
         Returns:
-            A list of the best candidates, and optionally the weighted score per candidate.
+            A list of the best candidates grouped by equal rating, and optionally the weighted score per candidate.
         """
         if len(d_scores) == 0:
             return [], None if return_scores else None
-        d_weighted_scores = dict()
-        d_score_to_candidates = dict()
-        for candidate, scores in d_scores.items():
-            weighted_score = self._calculate_weighted_score(scores)
-            d_weighted_scores[candidate] = weighted_score
-            if weighted_score not in d_score_to_candidates:
-                d_score_to_candidates[weighted_score] = []
-            d_score_to_candidates[weighted_score].append(candidate)
+        candidates, score_matrix = self.get_score_matrix(d_scores)
+        weighted_scores = self.calculate_weighted_scores(score_matrix)
+        order = np.argsort(weighted_scores, kind='stable')[:top_k]
+        sorted_scores = weighted_scores[order]
+        group_starts = np.flatnonzero(np.diff(sorted_scores, prepend=np.nan) != 0)
+        group_ends = np.append(group_starts[1:], len(order))
         optimal_candidates = [
             {
-                'rating': score,
-                'candidates': candidate
-            } for score, candidate in sorted(d_score_to_candidates.items())]
-        return optimal_candidates, d_weighted_scores if return_scores else None
+                'rating': float(sorted_scores[start]),
+                'candidates': [candidates[i] for i in order[start:end].tolist()]
+            } for (start, end) in zip(group_starts.tolist(), group_ends.tolist())]
+        if not return_scores:
+            return optimal_candidates, None
+        d_weighted_scores = {candidates[i]: float(weighted_scores[i]) for i in order.tolist()}
+        return optimal_candidates, d_weighted_scores
+
+    def get_pareto_front(self, d_scores: dict[str, dict[OptimizationFactor, float]]) -> list[str]:
+        """Get the candidates that are not dominated by any other candidate in the factors with non-zero weights.
+
+            A candidate is dominated if another one is no worse in all factors and strictly better in at least one.
+            The result is ordered by the weighted score.
+        """
+        if len(d_scores) == 0:
+            return []
+        candidates, score_matrix = self.get_score_matrix(d_scores)
+        weighted_scores = self.calculate_weighted_scores(score_matrix)
+        m = score_matrix[:, self.weights != 0]
+        # dominates[i, j] is whether candidate i dominates candidate j.
+        no_worse = np.all(m[:, np.newaxis, :] <= m[np.newaxis, :, :], axis=2)
+        better = np.any(m[:, np.newaxis, :] < m[np.newaxis, :, :], axis=2)
+        dominated = np.any(no_worse & better, axis=0)
+        front = np.flatnonzero(~dominated)
+        front = front[np.argsort(weighted_scores[front], kind='stable')]
+        return [candidates[i] for i in front.tolist()]
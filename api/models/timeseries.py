@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
-from typing import Any, Union
-from datetime import datetime, time
+from multiprocessing import shared_memory
+from typing import Any, Hashable, Union
+from datetime import datetime, time, timedelta
+import numpy as np
 
 
 class TimeSeriesData:
@@ -18,3 +20,174 @@ class TimeSeriesData:
         return self.timestamps[index], self.values[index]
 
 
+class EmissionRateSeries:
+    """A compact step function of carbon emission rates, backed by UNIX timestamps (in seconds) and rate arrays.
+
+        Each rate applies from its timestamp until the next one, and the last rate applies indefinitely.
+    """
+    __slots__ = ('timestamps', 'rates')
+
+    def __init__(self, timestamps: np.ndarray, rates: np.ndarray):
+        if len(timestamps) != len(rates):
+            raise ValueError("timestamps and rates must be of equal length")
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+
+    @classmethod
+    def create_empty(cls) -> 'EmissionRateSeries':
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+    @classmethod
+    def from_carbon_intensity_list(cls, l_carbon_intensity: list[dict]) -> 'EmissionRateSeries':
+        """Convert the carbon intensity list into a series of hourly values, in gCO2/kWh.
+
+            A zero-valued entry is appended after the last timestamp to avoid out-of-bound read corner cases.
+        """
+        # Only consider hourly data
+        l_hourly = [d for d in l_carbon_intensity if d['timestamp'].minute == 0]
+        if not l_hourly:
+            raise ValueError("No hourly carbon intensity data available.")
+        timestamps = np.array([int(d['timestamp'].timestamp()) for d in l_hourly], dtype=np.int64)
+        rates = np.array([d['carbon_intensity'] for d in l_hourly], dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        (timestamps, rates) = (timestamps[order], rates[order])
+
+        # Insert end-of-time entry with zero value, one step after the last timestamp
+        step = np.diff(timestamps).min() if len(timestamps) >= 2 else int(timedelta(hours=1).total_seconds())
+        return cls(np.append(timestamps, timestamps[-1] + step), np.append(rates, 0.))
+
+    @property
+    def empty(self) -> bool:
+        return self.timestamps.size == 0
+
+    def __len__(self) -> int:
+        return self.timestamps.size
+
+    def values_at(self, timestamps: np.ndarray) -> np.ndarray:
+        """Look up the rates at the given UNIX timestamps, or zero before the first timestamp."""
+        indices = np.searchsorted(self.timestamps, timestamps, side='right') - 1
+        return np.where(indices >= 0, self.rates[np.maximum(indices, 0)], 0.)
+
+    def min_between(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Get the minimum rate in each of the UNIX timestamp ranges [start, end), where rates before the first
+            timestamp are zero."""
+        (starts, ends) = np.broadcast_arrays(np.asarray(starts), np.asarray(ends))
+        if self.empty:
+            return np.zeros(starts.shape)
+        first = np.searchsorted(self.timestamps, starts, side='right') - 1
+        last = np.maximum(np.searchsorted(self.timestamps, ends, side='left') - 1, first)
+        # Reduce over [first, last] pairs, with a padding entry so that last + 1 is always a valid index.
+        boundaries = np.stack([np.maximum(first, 0), last + 1], axis=-1).ravel()
+        minimums = np.minimum.reduceat(np.append(self.rates, 0.), boundaries)[::2]
+        return np.where(first >= 0, minimums.reshape(starts.shape), 0.)
+
+    def scale(self, factor: float) -> 'EmissionRateSeries':
+        return EmissionRateSeries(self.timestamps, self.rates * factor)
+
+    def __mul__(self, factor: float) -> 'EmissionRateSeries':
+        return self.scale(factor)
+
+    def add(self, other: 'EmissionRateSeries') -> 'EmissionRateSeries':
+        """Add two step functions, aligned on the union of their timestamps."""
+        if other.empty:
+            return self
+        if self.empty:
+            return other
+        if np.array_equal(self.timestamps, other.timestamps):
+            return EmissionRateSeries(self.timestamps, self.rates + other.rates)
+        timestamps = np.union1d(self.timestamps, other.timestamps)
+        return EmissionRateSeries(timestamps, self.values_at(timestamps) + other.values_at(timestamps))
+
+    def __add__(self, other: 'EmissionRateSeries') -> 'EmissionRateSeries':
+        return self.add(other)
+
+    def cumsum(self) -> tuple[np.ndarray, np.ndarray]:
+        """Calculate the integral at each timestamp, and return the x and y values for a later np.interp call."""
+        if self.empty:
+            return np.empty(0), np.empty(0)
+        steps_seconds = np.diff(self.timestamps, append=self.timestamps[-1:])
+        cumsum = np.cumsum(steps_seconds * self.rates)
+        return self.timestamps.astype(np.float64), np.insert(cumsum[:-1], 0, 0.)
+
+    def to_columns(self) -> dict[str, list]:
+        """Convert to a compact columnar dict of UNIX timestamps (in seconds) and rates."""
+        return {'timestamps': self.timestamps.tolist(), 'values': self.rates.tolist()}
+
+
+class SharedEmissionRateStore:
+    """A read-only collection of emission rate series packed into one shared memory block.
+
+        All timestamps are stored first, followed by all rates, and `index` maps each key to the offset and length of
+        its series. Pickling the store only sends the block name and index, and the receiving process attaches to the
+        same memory, so series are read as zero-copy views.
+
+        The creating process owns the block and must call `unlink()` once all users are done. Other processes should
+        only `close()` their handle.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, size: int, index: dict[Hashable, tuple[int, int]],
+                 owner: bool = False):
+        self.shm = shm
+        self.size = size
+        self.index = index
+        self.owner = owner
+        self.timestamps = np.ndarray((size,), dtype=np.int64, buffer=shm.buf)
+        self.rates = np.ndarray((size,), dtype=np.float64, buffer=shm.buf, offset=size * np.dtype(np.int64).itemsize)
+
+    @classmethod
+    def create(cls, d_series: dict[Hashable, EmissionRateSeries]) -> 'SharedEmissionRateStore':
+        size = sum(len(series) for series in d_series.values())
+        nbytes = size * (np.dtype(np.int64).itemsize + np.dtype(np.float64).itemsize)
+        # Zero-sized shared memory is not allowed
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        store = cls(shm, size, {}, owner=True)
+        try:
+            offset = 0
+            for (key, series) in d_series.items():
+                store.timestamps[offset:offset + len(series)] = series.timestamps
+                store.rates[offset:offset + len(series)] = series.rates
+                store.index[key] = (offset, len(series))
+                offset += len(series)
+        except BaseException:
+            # Nobody else can unlink the block, which would otherwise outlive the process.
+            store.close()
+            store.unlink()
+            raise
+        return store
+
+    @classmethod
+    def attach(cls, name: str, size: int, index: dict[Hashable, tuple[int, int]]) -> 'SharedEmissionRateStore':
+        return cls(shared_memory.SharedMemory(name=name), size, index)
+
+    def __reduce__(self):
+        return self.__class__.attach, (self.shm.name, self.size, self.index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.index
+
+    def __getitem__(self, key: Hashable) -> EmissionRateSeries:
+        """Get the series as views into the shared memory, which are only valid until the store is closed."""
+        (offset, length) = self.index[key]
+        return EmissionRateSeries(self.timestamps[offset:offset + length], self.rates[offset:offset + length])
+
+    def keys(self):
+        return self.index.keys()
+
+    def close(self):
+        # Views must be released before the underlying buffer can be closed.
+        self.timestamps = self.rates = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Some series are still referenced, and the mapping is released when they are garbage collected.
+            pass
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self) -> 'SharedEmissionRateStore':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+        self.unlink()
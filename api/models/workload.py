@@ -11,6 +11,7 @@ from api.models.common import CarbonDataSource
 
 # from api.models.common import Coordinate
 from api.models.cloud_location import CloudLocationManager
+from api.models.optimization_engine import OptimizationFactor
 from api.models.dataclass_extensions import *
 
 g_cloud_manager = CloudLocationManager()
@@ -22,12 +23,26 @@ class ScheduleType(Enum):
     ONETIME = "onetime"
 
 
+class DetailLevel(Enum):
+    """How much detail of the scheduling is returned for each region."""
+    NONE = "none"
+    TIMINGS = "timings"
+    FULL = "full"
+
+
 @dataclass
 class WorkloadSchedule:
     type: ScheduleType = field_enum(ScheduleType)
     start_time: Optional[datetime] = optional_field_with_validation(validate_is_timezone_aware)
     interval: Optional[timedelta] = field(metadata=metadata_timedelta_nonzero, default=None)
     max_delay: Optional[timedelta] = field(metadata=metadata_timedelta, default=timedelta())
+    # Seed of the random arrivals, which is generated if not specified and echoed back for reproducibility.
+    seed: Optional[int] = optional_field_with_validation(validate.Range(min=0, max=2**32 - 1))
+
+    def __post_init__(self):
+        # Random arrivals are drawn again on each call, which must return the same runs.
+        if self.type is ScheduleType.POISSON and self.seed is None:
+            self.seed = int(np.random.default_rng().integers(2**32))
 
     @validates_schema
     def validate_schema(self, data, **kwargs):
@@ -67,6 +82,9 @@ DEFAULT_NETWORK_PUE = 2
 
 ALL_CLOUD_PROVIDERS = g_cloud_manager.get_all_cloud_providers()
 
+def _to_utc_datetime64(dt: datetime) -> np.datetime64:
+    return np.datetime64(dt.astimezone(timezone.utc).replace(tzinfo=None), 'us')
+
 def _validate_providers(candidate_providers: list[str]):
     errors = dict()
     existing_providers = set()
@@ -118,6 +136,16 @@ def _validate_location_is_defined(location: str, candidate_locations: list[Cloud
     else:
         return 'Location not defined'
 
+def _validate_optimization_weights(optimization_weights: dict[str, float]):
+    errors = dict()
+    all_factors = get_all_enum_values(OptimizationFactor)
+    for (factor, weight) in optimization_weights.items():
+        if factor not in all_factors:
+            errors[factor] = f'Unknown optimization factor. {custom_validation_error_enum(OptimizationFactor)}'
+        elif weight < 0:
+            errors[factor] = 'Weight must be non-negative'
+    return errors
+
 
 @dataclass
 class Workload:
@@ -141,6 +169,16 @@ class Workload:
     watts_per_core: float = field(default=DEFAULT_CPU_POWER_PER_CORE)
     core_count: float = field(default=1.)
 
+    # Overrides the default weights of optimization factors, key'd by factor name.
+    optimization_weights: Optional[dict[str, float]] = field(default_factory=dict)
+    # Only return the best k regions, or all regions if not set.
+    top_k: Optional[int] = optional_field_with_validation(validate.Range(min=1))
+    # Also return the regions that are not dominated by others in any weighted factor.
+    pareto_front: bool = field(default=False)
+    # Details are opt-in, where "timings" returns the schedule of each run, and "full" also returns the emission rates
+    # and integrals used for scheduling.
+    details: DetailLevel = field_enum(DetailLevel, DetailLevel.NONE)
+
     @validates_schema
     def validate_schema(self, data, **kwargs):
         errors = dict()
@@ -160,9 +198,16 @@ class Workload:
             sub_errors = _validate_location_is_defined(data['original_location'], data['candidate_locations'])
             if sub_errors:
                 errors['original_location'] = sub_errors
+        if data.get('optimization_weights', None):
+            sub_errors = _validate_optimization_weights(data['optimization_weights'])
+            if sub_errors:
+                errors['optimization_weights'] = sub_errors
         if errors:
             raise ValidationError(errors)
 
+    def get_optimization_weights(self) -> dict[OptimizationFactor, float]:
+        return {OptimizationFactor(factor): weight for (factor, weight) in self.optimization_weights.items()}
+
     def get_cputime_in_24h(self) -> timedelta:
         run_count = 0
         match self.schedule.type:
@@ -176,34 +221,31 @@ class Workload:
                 raise NotImplementedError()
         return self.runtime * run_count
 
-    def get_running_intervals_in_24h(self) -> list[tuple[datetime, datetime]]:
-        intervals = []
-
-        def _add_current_run_to_interval(start: datetime):
-            intervals.append((start, start + self.runtime))
-
+    def get_running_starts_in_24h(self) -> np.ndarray:
+        """Get the start times of all runs in a 24h period, as a sorted datetime64 array in UTC."""
+        day = np.timedelta64(1, 'D').astype('timedelta64[us]')
         match self.schedule.type:
             case ScheduleType.ONETIME:
-                _add_current_run_to_interval(self.schedule.start_time)
+                offsets = np.zeros(1, dtype='timedelta64[us]')
             case ScheduleType.POISSON:
-                current_start = self.schedule.start_time
                 lam = 1. / self.schedule.interval.total_seconds()
-                # Draw poisson distribution every second
+                # Draw the number of arrivals in every second of the day
                 distribution_size = int(timedelta(days=1).total_seconds())
-                poisson_distributions = np.random.poisson(lam, distribution_size)
-                for i in range(poisson_distributions):
-                    for _ in range(poisson_distributions[i]):
-                        time_elapsed = timedelta(seconds=i)
-                        start = self.schedule.start_time + time_elapsed
-                        _add_current_run_to_interval(start)
+                rng = np.random.default_rng(self.schedule.seed)
+                arrivals_per_second = rng.poisson(lam, distribution_size)
+                offsets = np.repeat(np.arange(distribution_size), arrivals_per_second).astype('timedelta64[s]')
             case ScheduleType.UNIFORM_RANDOM:
-                current_start = self.schedule.start_time
-                while current_start < self.schedule.start_time + timedelta(days=1):
-                    _add_current_run_to_interval(current_start)
-                    current_start += self.schedule.interval
+                offsets = np.arange(np.timedelta64(0, 'us'), day, np.timedelta64(self.schedule.interval))
             case _:
                 raise NotImplementedError()
-        return intervals
+        return _to_utc_datetime64(self.schedule.start_time) + offsets
+
+    def get_running_intervals_in_24h(self) -> list[tuple[datetime, datetime]]:
+        run_starts = self.get_running_starts_in_24h()
+        start_time = self.schedule.start_time
+        # Convert back to datetime in the same timezone as the schedule
+        time_elapsed = run_starts - _to_utc_datetime64(start_time)
+        return [(start_time + offset, start_time + offset + self.runtime) for offset in time_elapsed.tolist()]
 
     def get_power_in_watts(self) -> float:
         return self.watts_per_core * self.core_count
@@ -5,8 +5,9 @@ import marshmallow_dataclass
 from webargs.flaskparser import use_args
 from flask import current_app
 
-from api.helpers.balancing_authority import get_iso_from_gps, lookup_watttime_balancing_authority
-from api.models.common import ISO_PREFIX_C3LAB, IsoFormat
+from api.helpers.balancing_authority import convert_watttime_ba_abbrev_to_c3lab_region, get_iso_from_gps, \
+    get_isos_from_gps, lookup_watttime_balancing_authorities, lookup_watttime_balancing_authority
+from api.models.common import ISO_PREFIX_C3LAB, ISO_PREFIX_WATTTIME, IsoFormat
 from api.models.dataclass_extensions import *
 
 
@@ -17,6 +18,21 @@ class BalancingAuthorityRequest:
     iso_format: IsoFormat = field_enum(IsoFormat, IsoFormat.WattTime)
 
 
+MAX_BATCH_SIZE = 10000
+
+
+@marshmallow_dataclass.dataclass
+class GpsCoordinate:
+    latitude: float = field_with_validation(lambda x: abs(x) <= 90.)
+    longitude: float = field_with_validation(lambda x: abs(x) <= 180.)
+
+
+@marshmallow_dataclass.dataclass
+class BalancingAuthorityBatchRequest:
+    coordinates: list[GpsCoordinate] = field_with_validation(lambda l: 0 < len(l) <= MAX_BATCH_SIZE)
+    iso_format: IsoFormat = field_enum(IsoFormat, IsoFormat.WattTime)
+
+
 class BalancingAuthority(Resource):
     @use_args(marshmallow_dataclass.class_schema(BalancingAuthorityRequest)(), location='query')
     def get(self, args: BalancingAuthorityRequest):
@@ -39,6 +55,36 @@ class BalancingAuthority(Resource):
                 'region': region,
             }
 
+    @use_args(marshmallow_dataclass.class_schema(BalancingAuthorityBatchRequest)())
+    def post(self, args: BalancingAuthorityBatchRequest):
+        """Lookup many coordinates in one request, with one result per coordinate in the same order.
+
+            Each result is the same as from `get()`, or has an 'error' if the lookup of that coordinate failed.
+        """
+        current_app.logger.info("BalancingAuthority.post(%d coordinates)" % len(args.coordinates))
+        l_coordinates = [(coordinate.latitude, coordinate.longitude) for coordinate in args.coordinates]
+        if args.iso_format == IsoFormat.EMap:
+            l_results = [{'iso': iso} if not isinstance(iso, Exception) else iso
+                         for iso in get_isos_from_gps(l_coordinates, IsoFormat.EMap)]
+        else:
+            l_results = []
+            for watttime_lookup_result in lookup_watttime_balancing_authorities(l_coordinates):
+                if isinstance(watttime_lookup_result, Exception):
+                    l_results.append(watttime_lookup_result)
+                    continue
+                c3lab_iso = convert_watttime_ba_abbrev_to_c3lab_region(watttime_lookup_result['watttime_abbrev'])
+                iso = c3lab_iso if args.iso_format == IsoFormat.C3Lab else \
+                    ISO_PREFIX_WATTTIME + watttime_lookup_result['watttime_abbrev']
+                l_results.append(watttime_lookup_result | {
+                    'iso': iso,
+                    'region': c3lab_iso.removeprefix(ISO_PREFIX_C3LAB),
+                })
+        return {
+            'results': [{'request': {'latitude': latitude, 'longitude': longitude}} |
+                        (result if not isinstance(result, Exception) else {'error': str(result)})
+                        for ((latitude, longitude), result) in zip(l_coordinates, l_results)],
+        }
+
 
 # class BalancingAuthorityList(Resource):
 #     def get(self):
@@ -1,27 +1,29 @@
 #!/usr/bin/env python3
+import dataclasses
 from datetime import timedelta, timezone
+import hashlib
 import json
-from multiprocessing import Pool
 import traceback
 from typing import Any
 
 import marshmallow_dataclass
-from flask import current_app
+from flask import current_app, request
 from flask_restful import Resource
 import numpy as np
-import pandas as pd
-from pandas.tseries.frequencies import to_offset
 from webargs.flaskparser import use_args
-from api.helpers.balancing_authority import get_iso_from_gps
+from api.helpers.balancing_authority import get_isos_from_gps
 
-from api.helpers.carbon_intensity import calculate_total_carbon_emissions, get_carbon_intensity_list
+from api.helpers.carbon_intensity import calculate_total_carbon_emissions_batch, get_carbon_intensity_list
 from api.models.cloud_location import CloudLocationManager, CloudRegion, get_iso_route_between_region
 from api.models.common import CarbonDataSource, ISOName, RouteInISO, get_iso_format_for_carbon_source, identify_iso_format
 from api.models.optimization_engine import OptimizationEngine, OptimizationFactor
+from api.models.timeseries import EmissionRateSeries, SharedEmissionRateStore
 from api.models.wan_bandwidth import load_wan_bandwidth_model
-from api.models.workload import DEFAULT_DC_PUE, DEFAULT_NETWORK_PUE, DEFAULT_STORAGE_POWER, CloudLocation, Workload
+from api.models.workload import DEFAULT_DC_PUE, DEFAULT_NETWORK_PUE, DEFAULT_STORAGE_POWER, CloudLocation, DetailLevel, \
+    Workload
 from api.models.dataclass_extensions import *
-from api.util import Rate, RateUnit, Size, SizeUnit, round_up
+from api.util import DEFAULT_PROCESS_POOL_SIZE, Rate, RateUnit, Size, SizeUnit, get_io_thread_pool, get_process_pool, \
+    round_up, scheduler_session_cache
 
 g_cloud_manager = CloudLocationManager()
 OPTIMIZATION_FACTORS_AND_WEIGHTS = [
@@ -64,68 +66,43 @@ def get_candidate_regions(candidate_providers: list[str], candidate_locations: l
     except Exception as ex:
         raise ValueError(f'Failed to get candidate regions: {ex}') from ex
 
-def init_lookup_iso(_carbon_data_source: CarbonDataSource):
-    global carbon_data_source
-    carbon_data_source = _carbon_data_source
-
-def task_lookup_iso(region: CloudRegion) -> tuple:
-    global carbon_data_source
-    iso_format = get_iso_format_for_carbon_source(carbon_data_source)
-    if region.iso and iso_format == identify_iso_format(region.iso):
-        return str(region), region.iso, None, None
-    try:
-        (latitude, longitude) = region.gps
-        iso = get_iso_from_gps(latitude, longitude, iso_format)
-        return str(region), iso, None, None
-    except Exception as ex:
-        return str(region), None, str(ex), traceback.format_exc()
-
-def init_preload_carbon_data(_workload: Workload,
-                                    _carbon_data_source: CarbonDataSource,
-                                    _use_prediction: bool,
-                                    _desired_renewable_ratio: float = None):
-    global workload, carbon_data_source, use_prediction, desired_renewable_ratio
-    workload = _workload
-    carbon_data_source = _carbon_data_source
-    use_prediction = _use_prediction
-    desired_renewable_ratio = _desired_renewable_ratio
+def get_running_window_in_24h(workload: Workload) -> tuple[datetime, datetime]:
+    """Get the time window that covers all runs of a workload, so carbon data only needs to be loaded once."""
+    running_intervals = workload.get_running_intervals_in_24h()
+    if not running_intervals:
+        return workload.schedule.start_time, workload.schedule.start_time
+    return running_intervals[0][0], running_intervals[-1][1]
 
 def preload_carbon_data(workload: Workload,
                         iso: str,
                         carbon_data_source: CarbonDataSource,
                         use_prediction: bool,
-                        desired_renewable_ratio: float = None):
+                        desired_renewable_ratio: float = None,
+                        fetch_start: datetime = None):
+    """Load the carbon data that covers all runs of the workload, or only the part after `fetch_start` if given."""
     carbon_data_store = dict()
-    running_intervals = workload.get_running_intervals_in_24h()
-    for (start, end) in running_intervals:
-        max_delay = workload.schedule.max_delay
-        carbon_data_store[(iso, start, end)] = get_carbon_intensity_list(iso, start, end + max_delay,
-                                                        carbon_data_source, use_prediction,
-                                                        desired_renewable_ratio)
+    (start, end) = get_running_window_in_24h(workload)
+    max_delay = workload.schedule.max_delay
+    carbon_data_store[(iso, start, end)] = get_carbon_intensity_list(iso, fetch_start or start, end + max_delay,
+                                                                     carbon_data_source, use_prediction,
+                                                                     desired_renewable_ratio)
     return carbon_data_store
 
-def task_preload_carbon_data(iso: str) -> tuple:
-    global workload, carbon_data_source, use_prediction, desired_renewable_ratio
+def task_preload_carbon_data(iso: str,
+                             workload: Workload,
+                             carbon_data_source: CarbonDataSource,
+                             use_prediction: bool,
+                             desired_renewable_ratio: float = None,
+                             fetch_start: datetime = None) -> tuple:
     try:
-        carbon_data = preload_carbon_data(workload, iso, carbon_data_source, use_prediction, desired_renewable_ratio)
+        carbon_data = preload_carbon_data(workload, iso, carbon_data_source, use_prediction, desired_renewable_ratio,
+                                          fetch_start)
         return iso, carbon_data, None, None
     except Exception as ex:
         return iso, None, str(ex), traceback.format_exc()
 
-def init_parallel_process_candidate(_workload: Workload,
-                                    _carbon_data_source: CarbonDataSource,
-                                    _use_prediction: bool,
-                                    _carbon_data_store: dict,
-                                    _d_candidate_routes: dict[str, RouteInISO]):
-    global workload, carbon_data_source, use_prediction, carbon_data_store, d_candidate_routes
-    workload = _workload
-    carbon_data_source = _carbon_data_source
-    use_prediction = _use_prediction
-    carbon_data_store = _carbon_data_store
-    d_candidate_routes = _d_candidate_routes
-
-def get_preloaded_carbon_data(iso: str, start: datetime, end: datetime) -> list[dict]:
-    global carbon_data_store
+def get_preloaded_carbon_data(carbon_data_store: SharedEmissionRateStore,
+                              iso: str, start: datetime, end: datetime) -> EmissionRateSeries:
     key = (iso, start, end)
     if key in carbon_data_store:
         return carbon_data_store[key]
@@ -147,57 +124,41 @@ def get_per_hop_transfer_power_in_watts(route, transfer_rate: Rate) -> float:
     CORE_ROUTER_CAPACITY_GBPS = 64
     return transfer_rate / Rate(CORE_ROUTER_CAPACITY_GBPS, RateUnit.Gbps) * CORE_ROUTER_POWER_WATT
 
-def get_carbon_emission_rates_as_pd_series(iso: ISOName, start: datetime, end: datetime, power_in_watts: float) -> pd.Series:
-    l_carbon_intensity = get_preloaded_carbon_data(iso, start, end)
-    df = pd.DataFrame(l_carbon_intensity)
-    df.set_index('timestamp', inplace=True)
-
-    # Only consider hourly data
-    df = df.loc[df.index.minute == 0]
-    ds = df['carbon_intensity'].sort_index()
+def get_carbon_emission_rates(carbon_data_store: SharedEmissionRateStore,
+                              iso: ISOName, start: datetime, end: datetime, power_in_watts: float) -> EmissionRateSeries:
+    carbon_intensity = get_preloaded_carbon_data(carbon_data_store, iso, start, end)
     # Conversion: gCO2/kWh * W * 1/(1000*3600) kh/s = gCO2/s
-    ds = ds * power_in_watts / (1000 * 3600)
-    ds.sort_index(inplace=True)
-
-    # Insert end-of-time index with zero value to avoid out-of-bound read corner case handling
-    if len(ds.index) < 2:
-        ds_freq = pd.DateOffset(hours=1)
-    else:
-        ds_freq = to_offset(np.diff(ds.index).min())
-        # pd.infer_freq() only works with perfectly regular frequency
-        # ds_freq = to_offset(pd.infer_freq(ds.index))
-    end_time_of_series = ds.index.max() + ds_freq
-    ds[end_time_of_series.to_pydatetime()] = 0.
-
-    return ds
+    return carbon_intensity.scale(power_in_watts / (1000 * 3600))
 
-def get_compute_carbon_emission_rates(iso: ISOName, start: datetime, end: datetime, host_power_in_watts: float) -> pd.Series:
-    return get_carbon_emission_rates_as_pd_series(iso, start, end, host_power_in_watts)
+def get_compute_carbon_emission_rates(carbon_data_store: SharedEmissionRateStore,
+                                      iso: ISOName, start: datetime, end: datetime,
+                                      host_power_in_watts: float) -> EmissionRateSeries:
+    return get_carbon_emission_rates(carbon_data_store, iso, start, end, host_power_in_watts)
 
-def get_transfer_carbon_emission_rates(route: list[ISOName], start: datetime, end: datetime,
+def get_transfer_carbon_emission_rates(carbon_data_store: SharedEmissionRateStore,
+                                       route: list[ISOName], start: datetime, end: datetime,
                                        host_transfer_power_in_watts: float, per_hop_power_in_watts: float) -> \
-                                        tuple[pd.Series,pd.Series,pd.Series]:
+                                        tuple[EmissionRateSeries, EmissionRateSeries, EmissionRateSeries]:
     if len(route) == 0: # Same region, no transfer needed.
-        return [pd.Series(dtype=float),pd.Series(dtype=float),pd.Series(dtype=float)]
+        return (EmissionRateSeries.create_empty(), EmissionRateSeries.create_empty(), EmissionRateSeries.create_empty())
     # Transfer power includes both end hosts and network devices
-    ds_network = pd.Series(dtype=float)
-    ds_endpoints = pd.Series(dtype=float)
+    ds_network = EmissionRateSeries.create_empty()
+    ds_endpoints = EmissionRateSeries.create_empty()
     for i in range(len(route)):
         hop = route[i]
         # Part 1: Network power consumption
-        ds_hop = get_carbon_emission_rates_as_pd_series(hop, start, end, per_hop_power_in_watts)
-        ds_network = ds_network.add(ds_hop, fill_value=0)
+        ds_network = ds_network.add(get_carbon_emission_rates(carbon_data_store, hop, start, end, per_hop_power_in_watts))
         # Part 2: End host power consumption, or first and last hop.
         if i == 0 or i == len(route) - 1:
-            ds_endpoint = get_carbon_emission_rates_as_pd_series(hop, start, end, host_transfer_power_in_watts)
-            ds_endpoints = ds_endpoints.add(ds_endpoint, fill_value=0)
-    return (ds_network.add(ds_endpoints, fill_value=0), ds_network, ds_endpoints)
+            ds_endpoints = ds_endpoints.add(get_carbon_emission_rates(carbon_data_store, hop, start, end, host_transfer_power_in_watts))
+    return (ds_network.add(ds_endpoints), ds_network, ds_endpoints)
 
-def dump_emission_rates(ds: pd.Series) -> dict:
-    return json.loads(ds.to_json(orient='index', date_format='iso'))
+def dump_emission_rates(ds: EmissionRateSeries) -> dict:
+    return ds.to_columns()
 
-def calculate_workload_scores(workload: Workload, region: CloudRegion) -> tuple[dict[OptimizationFactor, float], dict[str, Any]]:
-    global d_candidate_routes
+def calculate_workload_scores(workload: Workload, region: CloudRegion, route: RouteInISO,
+                              carbon_data_store: SharedEmissionRateStore) -> \
+        tuple[dict[OptimizationFactor, float], dict[str, Any]]:
     d_scores = {}
     d_misc = {}
     for factor in OptimizationFactor:
@@ -210,47 +171,69 @@ def calculate_workload_scores(workload: Workload, region: CloudRegion) -> tuple[
             case OptimizationFactor.CarbonEmissionFromMigration: continue
             case OptimizationFactor.CarbonEmission:
                 # score = energy usage (kWh) * grid carbon intensity (kgCO2/kWh)
+                run_starts = workload.get_running_starts_in_24h()
                 running_intervals = workload.get_running_intervals_in_24h()
                 max_delay = workload.schedule.max_delay
-                route = d_candidate_routes[str(region)]
-                score = 0
-                d_misc['timings'] = []
-                d_misc['emission_rates'] = {}
-                d_misc['emission_integral'] = {}
-                # 24 hour / 5 min = 288 slots
-                for (start, end) in running_intervals:
+                runtime = workload.runtime
+                # All runs share the same carbon data, which covers the entire running window.
+                (window_start, window_end) = get_running_window_in_24h(workload)
+                # 24 hour / 5 min = 288 slots, and runs with the same transfer times are optimized in one batch.
+                d_runs_by_transfer_rate: dict[float, list[int]] = {}
+                for i, (start, end) in enumerate(running_intervals):
+                    transfer_rate = get_transfer_rate(route, start, end, max_delay)
+                    d_runs_by_transfer_rate.setdefault(transfer_rate.bps(), []).append(i)
+
+                compute_carbon_emission_rates = get_compute_carbon_emission_rates(
+                    carbon_data_store, region.iso, window_start, window_end, workload.get_power_in_watts() * DEFAULT_DC_PUE)
+                compute_carbon_emissions = np.zeros(len(running_intervals))
+                transfer_carbon_emissions = np.zeros(len(running_intervals))
+                l_timings = [None] * len(running_intervals)
+                for run_indices in d_runs_by_transfer_rate.values():
+                    (start, end) = running_intervals[run_indices[0]]
                     transfer_rate = get_transfer_rate(route, start, end, max_delay)
                     transfer_input_time = get_transfer_time(workload.dataset.input_size_gb, transfer_rate) if route else timedelta()
                     transfer_output_time = get_transfer_time(workload.dataset.output_size_gb, transfer_rate) if route else timedelta()
 
-                    compute_carbon_emission_rates = get_compute_carbon_emission_rates(
-                        region.iso, start, end, workload.get_power_in_watts() * DEFAULT_DC_PUE)
                     host_transfer_power = DEFAULT_STORAGE_POWER
                     all_transfer_carbon_emission_rates = get_transfer_carbon_emission_rates(
-                        route, start, end,
+                        carbon_data_store, route, window_start, window_end,
                         host_transfer_power * DEFAULT_DC_PUE,
                         get_per_hop_transfer_power_in_watts(route, transfer_rate) * DEFAULT_NETWORK_PUE)
                     (transfer_carbon_emission_rates, \
                         transfer_network_carbon_emission_rates, \
                         transfer_endpoint_carbon_emission_rates) = all_transfer_carbon_emission_rates
 
-                    runtime = end - start
-                    (compute_carbon_emissions, transfer_carbon_emission), timings = \
-                        calculate_total_carbon_emissions(start,
-                                                         runtime,
-                                                         max_delay,
-                                                         transfer_input_time,
-                                                         transfer_output_time,
-                                                         compute_carbon_emission_rates,
-                                                         transfer_carbon_emission_rates) \
-                                                            if workload.optimize_carbon else ((0, 0), {})
-                    d_scores[OptimizationFactor.CarbonEmissionFromCompute] = compute_carbon_emissions
-                    d_scores[OptimizationFactor.CarbonEmissionFromMigration] = transfer_carbon_emission
-                    d_misc['timings'].append(timings)
+                    if not workload.optimize_carbon:
+                        for i in run_indices:
+                            l_timings[i] = {}
+                        continue
+                    (batch_compute_emissions, batch_transfer_emissions), l_batch_timings = \
+                        calculate_total_carbon_emissions_batch(run_starts[run_indices],
+                                                               runtime,
+                                                               max_delay,
+                                                               transfer_input_time,
+                                                               transfer_output_time,
+                                                               compute_carbon_emission_rates,
+                                                               transfer_carbon_emission_rates)
+                    compute_carbon_emissions[run_indices] = batch_compute_emissions
+                    transfer_carbon_emissions[run_indices] = batch_transfer_emissions
+                    for (i, timings) in zip(run_indices, l_batch_timings):
+                        l_timings[i] = timings
+
+                d_scores[OptimizationFactor.CarbonEmissionFromCompute] = compute_carbon_emissions.sum()
+                d_scores[OptimizationFactor.CarbonEmissionFromMigration] = transfer_carbon_emissions.sum()
+                score = compute_carbon_emissions.sum() + transfer_carbon_emissions.sum()
+                if workload.details != DetailLevel.NONE:
+                    d_misc['timings'] = l_timings
+                if workload.details == DetailLevel.FULL:
+                    d_misc['emission_rates'] = {}
+                    d_misc['emission_integral'] = {}
                     d_misc['emission_rates']['compute'] = dump_emission_rates(compute_carbon_emission_rates)
                     d_misc['emission_rates']['transfer'] = dump_emission_rates(transfer_carbon_emission_rates)
-                    d_misc['emission_rates']['transfer.network'] = dump_emission_rates(transfer_network_carbon_emission_rates)
-                    d_misc['emission_rates']['transfer.endpoint'] = dump_emission_rates(transfer_endpoint_carbon_emission_rates)
+                    d_misc['emission_rates']['transfer.network'] = dump_emission_rates(
+                        transfer_network_carbon_emission_rates)
+                    d_misc['emission_rates']['transfer.endpoint'] = dump_emission_rates(
+                        transfer_endpoint_carbon_emission_rates)
                     total_transfer_time = transfer_input_time + transfer_output_time
                     d_misc['emission_integral']['compute'] = dump_emission_rates(
                         compute_carbon_emission_rates * runtime.total_seconds())
@@ -260,7 +243,6 @@ def calculate_workload_scores(workload: Workload, region: CloudRegion) -> tuple[
                         transfer_network_carbon_emission_rates * total_transfer_time.total_seconds())
                     d_misc['emission_integral']['transfer.endpoint'] = dump_emission_rates(
                         transfer_endpoint_carbon_emission_rates * total_transfer_time.total_seconds())
-                    score += (compute_carbon_emissions + transfer_carbon_emission)
             case OptimizationFactor.WanNetworkUsage:
                 # score = input + output data size (GB)
                 # TODO: add WAN demand as weight
@@ -272,16 +254,82 @@ def calculate_workload_scores(workload: Workload, region: CloudRegion) -> tuple[
         d_scores[factor] = score
     return d_scores, d_misc
 
-def task_process_candidate(region: CloudRegion) -> tuple:
-    global workload, carbon_data_source, use_prediction
+def task_process_candidate(region: CloudRegion, workload: Workload, route: RouteInISO,
+                           carbon_data_store: SharedEmissionRateStore) -> tuple:
     region_name = str(region)
     iso = region.iso
     try:
-        scores, d_misc = calculate_workload_scores(workload, region)
+        scores, d_misc = calculate_workload_scores(workload, region, route, carbon_data_store)
         return region_name, iso, scores, d_misc, None, None
     except Exception as ex:
         return region_name, iso, None, None, str(ex), traceback.format_exc()
-
+    finally:
+        carbon_data_store.close()
+
+
+def get_lower_bound_scores(workload: Workload, region: CloudRegion,
+                           carbon_data_store: SharedEmissionRateStore) -> dict[OptimizationFactor, float]:
+    """Get a lower bound of the scores of a region, which is cheap to compute without solving the schedule.
+
+        It assumes that all runs are computed at the lowest carbon intensity in the window, with free data transfers.
+    """
+    carbon_emission = 0.
+    if workload.optimize_carbon:
+        (window_start, window_end) = get_running_window_in_24h(workload)
+        compute_carbon_emission_rates = get_compute_carbon_emission_rates(
+            carbon_data_store, region.iso, window_start, window_end, workload.get_power_in_watts() * DEFAULT_DC_PUE)
+        # Each run is computed within [start, start + max delay + runtime).
+        run_starts = workload.get_running_starts_in_24h().astype('datetime64[s]').astype(np.int64)
+        run_ends = run_starts + int((workload.schedule.max_delay + workload.runtime).total_seconds())
+        min_rates = compute_carbon_emission_rates.min_between(run_starts, run_ends)
+        carbon_emission = float(min_rates.sum()) * workload.runtime.total_seconds()
+    return {
+        OptimizationFactor.EnergyUsage: workload.get_energy_usage_24h(),
+        OptimizationFactor.CarbonEmission: carbon_emission,
+        OptimizationFactor.CarbonEmissionFromCompute: carbon_emission,
+        OptimizationFactor.CarbonEmissionFromMigration: 0.,
+        OptimizationFactor.WanNetworkUsage: workload.dataset.input_size_gb + workload.dataset.output_size_gb,
+    }
+
+def process_candidates_with_pruning(optimizer: OptimizationEngine, l_task_args: list[tuple]) -> \
+        tuple[list[tuple], list[str]]:
+    """Process the candidates in the order of their lower-bound scores, and skip those that cannot be optimal.
+
+        Candidates are processed in chunks of the process pool size, until the best weighted score so far is lower than
+        the lower bound of all remaining candidates.
+
+        Returns:
+            The results of `task_process_candidate()` of the processed candidates, and the names of pruned candidates.
+    """
+    lower_bounds = np.full(len(l_task_args), -np.inf)
+    for i, (region, workload, _, carbon_data_store) in enumerate(l_task_args):
+        try:
+            lower_bounds[i] = optimizer.calculate_weighted_score(
+                get_lower_bound_scores(workload, region, carbon_data_store))
+        except Exception:
+            # Score it anyway, which reports the same error as a warning.
+            pass
+    order = np.argsort(lower_bounds, kind='stable').tolist()
+    chunk_size = current_app.config.get('PROCESS_POOL_SIZE', DEFAULT_PROCESS_POOL_SIZE)
+    best_score = np.inf
+    result = []
+    next_index = 0
+    while next_index < len(order):
+        chunk = []
+        for i in order[next_index:next_index + chunk_size]:
+            if lower_bounds[i] > best_score and not np.isclose(lower_bounds[i], best_score):
+                break
+            chunk.append(i)
+        if not chunk:
+            break
+        next_index += len(chunk)
+        chunk_result = get_process_pool().starmap(task_process_candidate, [l_task_args[i] for i in chunk])
+        for (_, _, scores, _, ex, _) in chunk_result:
+            if not ex:
+                best_score = min(best_score, optimizer.calculate_weighted_score(scores))
+        result += chunk_result
+    pruned_regions = [str(l_task_args[i][0]) for i in order[next_index:]]
+    return result, pruned_regions
 
 def get_routes_in_iso_by_region(original_location: str, d_candidate_regions: dict[str, CloudRegion]) -> dict[str, RouteInISO]:
     # TODO: route must include the src/dst ISOs for the src/dst locations.
@@ -292,17 +340,149 @@ def get_routes_in_iso_by_region(original_location: str, d_candidate_regions: dic
         d_region_route[candidate_region] = route_in_iso
     return d_region_route
 
+def apply_min_start_time(workload: Workload):
+    """Predictions are only available for the future, so move the start time to now if it's earlier."""
+    if workload.use_prediction:
+        min_start_time = round_up(datetime.now(timezone.utc), timedelta(minutes=5))
+        if workload.schedule.start_time < min_start_time:
+            workload.schedule.start_time = min_start_time
+
+def lookup_isos(workload: Workload, candidate_regions: list[CloudRegion]) -> tuple[dict[str, ISOName], dict[str, str]]:
+    """Look up the ISO of each candidate region, which is also set on the region.
+
+        Returns:
+            The ISO of each region, and the error of each region whose lookup failed.
+    """
+    d_region_isos = dict()
+    d_region_warnings = dict()
+    iso_format = get_iso_format_for_carbon_source(workload.carbon_data_source)
+    # Regions without an ISO in the right format are looked up in one batch, where nearby regions share a lookup.
+    l_lookup_regions = [region for region in candidate_regions
+                        if not (region.iso and iso_format == identify_iso_format(region.iso))]
+    l_isos = get_isos_from_gps([region.gps for region in l_lookup_regions], iso_format) if l_lookup_regions else []
+    d_looked_up_isos = {str(region): iso for (region, iso) in zip(l_lookup_regions, l_isos)}
+    for region in candidate_regions:
+        iso = d_looked_up_isos.get(str(region), region.iso)
+        if isinstance(iso, Exception):
+            d_region_warnings[str(region)] = str(iso)
+            current_app.logger.error(f'ISO lookup failed for {region}: {iso}')
+            current_app.logger.error(''.join(traceback.format_exception(iso)))
+        else:
+            d_region_isos[str(region)] = iso
+            region.iso = iso
+    return d_region_isos, d_region_warnings
+
+def load_carbon_data(workload: Workload, isos: set[ISOName], d_fetch_starts: dict[ISOName, datetime] = None) -> \
+        tuple[dict[tuple, list[dict]], dict[ISOName, str]]:
+    """Load the carbon data of all ISOs in parallel.
+
+        Args:
+            d_fetch_starts: only load data from the given time for some ISOs, e.g. when earlier data is already loaded.
+
+        Returns:
+            The carbon data key'd by (iso, start, end), and the error of each ISO whose data failed to load.
+    """
+    d_fetch_starts = d_fetch_starts or {}
+    carbon_data = dict()
+    d_iso_errors = dict()
+    futures = [get_io_thread_pool().submit(task_preload_carbon_data, iso, workload, workload.carbon_data_source,
+                                           workload.use_prediction, workload.desired_renewable_ratio,
+                                           d_fetch_starts.get(iso, None)) for iso in isos]
+    result = [future.result() for future in futures]
+    for (iso, partial_carbon_data, ex, stack_trace) in result:
+        if partial_carbon_data:
+            carbon_data |= partial_carbon_data
+        else:
+            d_iso_errors[iso] = ex
+            current_app.logger.error(f'Carbon data lookup failed for {iso}: {ex}')
+            current_app.logger.error(stack_trace)
+    return carbon_data, d_iso_errors
+
+def get_all_unique_isos(d_region_isos: dict[str, ISOName], d_candidate_routes: dict[str, RouteInISO]) -> set[ISOName]:
+    all_unique_isos = set(d_region_isos.values())
+    unique_transit_isos = set([ hop for route in d_candidate_routes.values() for hop in route])
+    all_unique_isos.update(unique_transit_isos)
+    return all_unique_isos
+
+def schedule_workload(workload: Workload,
+                      candidate_regions: list[CloudRegion],
+                      d_candidate_routes: dict[str, RouteInISO],
+                      d_region_isos: dict[str, ISOName],
+                      d_region_warnings: dict[str, str],
+                      carbon_data: dict[tuple, list[dict]],
+                      d_iso_errors: dict[ISOName, str]) -> tuple[dict, int]:
+    """Score all candidate regions with the preloaded carbon data, and build the response with its status code."""
+    orig_request = {'request': workload}
+    d_region_isos = d_region_isos.copy()
+    d_region_warnings = d_region_warnings.copy()
+    d_iso_errors = d_iso_errors.copy()
+    d_region_scores = dict()
+    d_misc_details = dict()
+
+    # Convert the carbon data once per ISO, and share it with the scoring workers without copying.
+    d_emission_rates = dict()
+    for (key, l_carbon_intensity) in carbon_data.items():
+        try:
+            d_emission_rates[key] = EmissionRateSeries.from_carbon_intensity_list(l_carbon_intensity)
+        except Exception as ex:
+            d_iso_errors[key[0]] = str(ex)
+            current_app.logger.error(f'Invalid carbon data for {key[0]}: {ex}')
+    optimizer = g_optimizer.with_weights(workload.get_optimization_weights())
+    pruned_regions = None
+    with SharedEmissionRateStore.create(d_emission_rates) as carbon_data_store:
+        l_task_args = [(region, workload, d_candidate_routes[str(region)], carbon_data_store)
+                       for region in candidate_regions]
+        if workload.top_k == 1 and not workload.pareto_front:
+            # Only the optimal region is needed, so regions that cannot be optimal are skipped.
+            result, pruned_regions = process_candidates_with_pruning(optimizer, l_task_args)
+            current_app.logger.info(f'Pruned {len(pruned_regions)} of {len(l_task_args)} candidate regions')
+        else:
+            result = get_process_pool().starmap(task_process_candidate, l_task_args)
+    for (region_name, iso, scores, d_misc, ex, stack_trace) in result:
+        d_region_isos[region_name] = iso
+        if not ex:
+            scores[OptimizationFactor.EnergyUsage + '-unit'] = 'kWh'
+            scores[OptimizationFactor.CarbonEmission + '-unit'] = 'gCO2'
+            d_region_scores[region_name] = scores
+            d_misc_details[region_name] = d_misc
+        else:
+            if d_iso_errors.get(iso, None):
+                d_region_warnings[region_name] = d_iso_errors[iso]
+            else:
+                d_region_warnings[region_name] = str(ex)
+                current_app.logger.error(f'Exception when calculating score for region {region_name}: {ex}')
+                current_app.logger.error(stack_trace)
+
+    optimal_regions, d_weighted_scores = optimizer.compare_candidates(d_region_scores, True, workload.top_k)
+    if not optimal_regions:
+        return orig_request | {
+            'error': 'No viable candidate',
+            'isos': d_region_isos,
+            'details': d_region_warnings
+        }, 400
+
+    response = orig_request | {
+        'original-region': str(workload.original_location),
+        'optimal-regions': optimal_regions,
+        'isos': d_region_isos,
+        'weighted-scores': d_weighted_scores,
+        'raw-scores': d_region_scores,
+        'warnings': d_region_warnings,
+    }
+    if workload.details != DetailLevel.NONE:
+        response['details'] = d_misc_details
+    if workload.pareto_front:
+        response['pareto-regions'] = optimizer.get_pareto_front(d_region_scores)
+    if pruned_regions is not None:
+        response['pruned-regions'] = pruned_regions
+    return response, 200
+
 class CarbonAwareScheduler(Resource):
     @use_args(marshmallow_dataclass.class_schema(Workload)())
     def get(self, args: Workload):
         workload = args
-        orig_request = {'request': workload}
         current_app.logger.info("CarbonAwareScheduler.get(%s)" % workload)
-
-        if workload.use_prediction:
-            min_start_time = round_up(datetime.now(timezone.utc), timedelta(minutes=5))
-            if workload.schedule.start_time < min_start_time:
-                workload.schedule.start_time = min_start_time
+        apply_min_start_time(workload)
 
         d_candidate_regions = get_candidate_regions(args.candidate_providers,
                                                   args.candidate_locations,
@@ -310,78 +490,153 @@ class CarbonAwareScheduler(Resource):
         candidate_regions = list(d_candidate_regions.values())
         d_candidate_routes = get_routes_in_iso_by_region(args.original_location, d_candidate_regions)
 
-        d_region_isos = dict()
-        d_region_scores = dict()
-        d_region_warnings = dict()
-        d_misc_details = dict()
-
-        with Pool(1 if __debug__ else 4,
-                  initializer=init_lookup_iso,
-                  initargs=(args.carbon_data_source,)) as pool:
-            result_iso = pool.map(task_lookup_iso, candidate_regions)
-        for i in range(len(candidate_regions)):
-            (region_name, iso, ex, stack_trace) = result_iso[i]
-            if iso:
-                d_region_isos[region_name] = iso
-                candidate_regions[i].iso = iso
-            else:
-                d_region_warnings[region_name] = ex
-                current_app.logger.error(f'ISO lookup failed for {region_name}: {ex}')
-                current_app.logger.error(stack_trace)
-
-        all_unique_isos = set(d_region_isos.values())
-        unique_transit_isos = set([ hop for route in d_candidate_routes.values() for hop in route])
-        all_unique_isos.update(unique_transit_isos)
-        carbon_data = dict()
-        d_iso_errors = dict()
-        with Pool(1 if __debug__ else 4,
-                  initializer=init_preload_carbon_data,
-                  initargs=(workload, args.carbon_data_source, args.use_prediction,
-                            args.desired_renewable_ratio)
-                  ) as pool:
-            result = pool.map(task_preload_carbon_data, all_unique_isos)
-        for (iso, partial_carbon_data, ex, stack_trace) in result:
-            if partial_carbon_data:
-                carbon_data |= partial_carbon_data
-            else:
-                d_iso_errors[iso] = ex
-                current_app.logger.error(f'Carbon data lookup failed for {iso}: {ex}')
-                current_app.logger.error(stack_trace)
-
-        with Pool(1 if __debug__ else 8,
-                  initializer=init_parallel_process_candidate,
-                  initargs=(workload, args.carbon_data_source, args.use_prediction, carbon_data, d_candidate_routes)
-                  ) as pool:
-            result = pool.map(task_process_candidate, candidate_regions)
-        for (region_name, iso, scores, d_misc, ex, stack_trace) in result:
-            d_region_isos[region_name] = iso
-            if not ex:
-                scores[OptimizationFactor.EnergyUsage + '-unit'] = 'kWh'
-                scores[OptimizationFactor.CarbonEmission + '-unit'] = 'gCO2'
-                d_region_scores[region_name] = scores
-                d_misc_details[region_name] = d_misc
-            else:
-                if d_iso_errors.get(iso, None):
-                    d_region_warnings[region_name] = d_iso_errors[iso]
-                else:
-                    d_region_warnings[region_name] = str(ex)
-                    current_app.logger.error(f'Exception when calculating score for region {region_name}: {ex}')
-                    current_app.logger.error(stack_trace)
-
-        optimal_regions, d_weighted_scores = g_optimizer.compare_candidates(d_region_scores, True)
-        if not optimal_regions:
-            return orig_request | {
-                'error': 'No viable candidate',
-                'isos': d_region_isos,
-                'details': d_region_warnings
-            }, 400
-
-        return orig_request | {
-            'original-region': str(args.original_location),
-            'optimal-regions': optimal_regions,
-            'isos': d_region_isos,
-            'weighted-scores': d_weighted_scores,
-            'raw-scores': d_region_scores,
-            'warnings': d_region_warnings,
-            'details': d_misc_details,
-        }
+        d_region_isos, d_region_warnings = lookup_isos(workload, candidate_regions)
+        all_unique_isos = get_all_unique_isos(d_region_isos, d_candidate_routes)
+        carbon_data, d_iso_errors = load_carbon_data(workload, all_unique_isos)
+        return schedule_workload(workload, candidate_regions, d_candidate_routes, d_region_isos, d_region_warnings,
+                                 carbon_data, d_iso_errors)
+
+
+# Sessions expire like the carbon data cache, so that predictions are reloaded.
+SCHEDULER_SESSION_TIMEOUT = timedelta(minutes=15)
+MAX_SCHEDULER_SESSION_COUNT = 256
+
+@dataclasses.dataclass(frozen=True)
+class SchedulerSession:
+    """The state of the last scheduling of a workload, which is reused when the same workload is scheduled again.
+
+        Only the inputs of the scoring are kept, not the cumulative emissions or the optimum of each region, so a new
+        start time is scored again in full over the kept and newly loaded carbon data. A previous optimum cannot be
+        resumed from, as the emission rates end with a zero-valued step after the last loaded timestamp, which the
+        newly loaded data replaces, and the scoring takes milliseconds per region compared to the loading.
+    """
+    created_at: datetime
+    start_time: datetime
+    candidate_regions: list[CloudRegion]
+    d_candidate_routes: dict[str, RouteInISO]
+    d_region_isos: dict[str, ISOName]
+    d_region_warnings: dict[str, str]
+    # Carbon data of each ISO from start_time up to its last loaded timestamp.
+    d_iso_carbon_data: dict[ISOName, list[dict]]
+    # Seed of the random arrivals, which is reused when the request doesn't specify one.
+    seed: int | None
+    response: tuple[dict, int]
+
+def get_workload_fingerprint(workload: Workload) -> str:
+    """Get a fingerprint of the workload that ignores the start time and the seed of the random arrivals."""
+    d_workload = dataclasses.asdict(workload)
+    del d_workload['schedule']['start_time']
+    del d_workload['schedule']['seed']
+    return hashlib.sha1(json.dumps(d_workload, sort_keys=True, default=str).encode()).hexdigest()
+
+def get_requested_seed() -> int | None:
+    """Get the seed specified in the request, as opposed to the one generated for a Poisson workload without one."""
+    return ((request.get_json(silent=True) or {}).get('schedule') or {}).get('seed', None)
+
+def get_scheduler_session(session_id: str) -> SchedulerSession | None:
+    return scheduler_session_cache.get(session_id)
+
+def put_scheduler_session(session_id: str, session: SchedulerSession):
+    """Store the session in the shared cache, so that the polls of other gunicorn workers reuse it, until it expires
+        `SCHEDULER_SESSION_TIMEOUT` after its creation."""
+    timeout = SCHEDULER_SESSION_TIMEOUT - (datetime.now(timezone.utc) - session.created_at)
+    if timeout.total_seconds() < 1:
+        scheduler_session_cache.delete(session_id)
+        return
+    scheduler_session_cache.set(session_id, session, timeout=int(timeout.total_seconds()))
+
+def extend_carbon_data(session: SchedulerSession, workload: Workload) -> \
+        tuple[dict[ISOName, list[dict]], dict[ISOName, str]]:
+    """Load only the carbon data after the last loaded timestamp of each ISO, and drop the data before the new start
+        time.
+
+        ISOs without data in the session, e.g. due to earlier errors, are loaded in full. If loading the new data of an
+        ISO fails, e.g. because no newer data is available yet, the data in the session is kept.
+    """
+    all_unique_isos = get_all_unique_isos(session.d_region_isos, session.d_candidate_routes)
+    (window_start, window_end) = get_running_window_in_24h(workload)
+    fetch_end = window_end + workload.schedule.max_delay
+    d_last_timestamps = {iso: session.d_iso_carbon_data[iso][-1]['timestamp'] for iso in all_unique_isos
+                         if session.d_iso_carbon_data.get(iso)}
+    # The last loaded timestamp is fetched again, so that the fetched range starts within the available data.
+    d_fetch_starts = {iso: last_timestamp for (iso, last_timestamp) in d_last_timestamps.items()
+                      if last_timestamp < fetch_end}
+    isos_to_load = {iso for iso in all_unique_isos if iso in d_fetch_starts or iso not in d_last_timestamps}
+    new_carbon_data, d_iso_errors = load_carbon_data(workload, isos_to_load, d_fetch_starts)
+    d_new_carbon_data = {iso: l_carbon_intensity for ((iso, _, _), l_carbon_intensity) in new_carbon_data.items()}
+
+    # Keep the hourly data point right before the start time.
+    cutoff = window_start - timedelta(hours=1)
+    d_iso_carbon_data = dict()
+    for iso in all_unique_isos:
+        if iso in d_last_timestamps:
+            if iso in d_iso_errors:
+                current_app.logger.warning(f'Keeping the loaded carbon data of {iso}: {d_iso_errors.pop(iso)}')
+            last_timestamp = d_last_timestamps[iso]
+            d_iso_carbon_data[iso] = \
+                [d for d in session.d_iso_carbon_data[iso] if d['timestamp'] > cutoff] + \
+                [d for d in d_new_carbon_data.get(iso, []) if d['timestamp'] > last_timestamp]
+        elif iso in d_new_carbon_data:
+            d_iso_carbon_data[iso] = d_new_carbon_data[iso]
+    return d_iso_carbon_data, d_iso_errors
+
+class CarbonAwareSchedulerSession(Resource):
+    """A stateful variant of `CarbonAwareScheduler` for polling the schedule of the same workload.
+
+        Requests of a workload that only differ in the start time share a session, which keeps the ISO lookups, the
+        loaded carbon data and the last response. A request with an unchanged start time returns the last response,
+        and a later start time only loads the carbon data that is not loaded yet, and then scores all candidate regions
+        again, see `SchedulerSession`. Sessions are kept in the shared cache, so any gunicorn worker can serve the
+        polls of a workload unless `SHARED_CACHE_TYPE` is 'simple'.
+    """
+    @use_args(marshmallow_dataclass.class_schema(Workload)())
+    def get(self, args: Workload):
+        workload = args
+        current_app.logger.info("CarbonAwareSchedulerSession.get(%s)" % workload)
+        apply_min_start_time(workload)
+
+        session_id = get_workload_fingerprint(workload)
+        session = get_scheduler_session(session_id)
+        requested_seed = get_requested_seed()
+        if session and requested_seed is not None and requested_seed != session.seed:
+            session = None
+        if session:
+            workload.schedule.seed = session.seed
+        start_time = workload.schedule.start_time
+        if session and session.start_time == start_time:
+            (response, status_code) = session.response
+            return response | {'session': {'id': session_id, 'update': 'cached'}}, status_code
+
+        if session and session.start_time < start_time:
+            update = 'incremental'
+            (candidate_regions, d_candidate_routes) = (session.candidate_regions, session.d_candidate_routes)
+            (d_region_isos, d_region_warnings) = (session.d_region_isos, session.d_region_warnings)
+            d_iso_carbon_data, d_iso_errors = extend_carbon_data(session, workload)
+        else:
+            update = 'full'
+            d_candidate_regions = get_candidate_regions(workload.candidate_providers,
+                                                        workload.candidate_locations,
+                                                        workload.original_location)
+            candidate_regions = list(d_candidate_regions.values())
+            d_candidate_routes = get_routes_in_iso_by_region(workload.original_location, d_candidate_regions)
+            d_region_isos, d_region_warnings = lookup_isos(workload, candidate_regions)
+            all_unique_isos = get_all_unique_isos(d_region_isos, d_candidate_routes)
+            carbon_data, d_iso_errors = load_carbon_data(workload, all_unique_isos)
+            d_iso_carbon_data = {iso: l_carbon_intensity for ((iso, _, _), l_carbon_intensity) in carbon_data.items()}
+
+        (window_start, window_end) = get_running_window_in_24h(workload)
+        carbon_data = {(iso, window_start, window_end): l_carbon_intensity
+                       for (iso, l_carbon_intensity) in d_iso_carbon_data.items()}
+        (response, status_code) = schedule_workload(workload, candidate_regions, d_candidate_routes, d_region_isos,
+                                                    d_region_warnings, carbon_data, d_iso_errors)
+        put_scheduler_session(session_id, SchedulerSession(
+            created_at=session.created_at if update == 'incremental' else datetime.now(timezone.utc),
+            start_time=start_time,
+            candidate_regions=candidate_regions,
+            d_candidate_routes=d_candidate_routes,
+            d_region_isos=d_region_isos,
+            d_region_warnings=d_region_warnings,
+            d_iso_carbon_data=d_iso_carbon_data,
+            seed=workload.schedule.seed,
+            response=(response, status_code)))
+        return response | {'session': {'id': session_id, 'update': update}}, status_code
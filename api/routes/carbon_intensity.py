@@ -6,11 +6,16 @@ from flask_restful import Resource
 from webargs.flaskparser import use_args
 from typing import Optional
 import marshmallow_dataclass
-from api.helpers.balancing_authority import get_iso_from_gps
+from marshmallow import validates_schema, ValidationError
+from api.helpers.balancing_authority import get_iso_from_gps, get_isos_from_gps
 
-from api.helpers.carbon_intensity import get_carbon_intensity_list
-from api.models.common import ISO_PREFIX_C3LAB, CarbonDataSource, IsoFormat, get_iso_format_for_carbon_source
+from api.helpers.carbon_intensity import get_carbon_intensity_columns, get_carbon_intensity_list, \
+    get_carbon_intensity_lists, iter_carbon_intensity_list
+from api.models.common import ISO_PREFIX_C3LAB, CarbonDataSource, IsoFormat, ResponseFormat, \
+    get_iso_format_for_carbon_source
 from api.models.dataclass_extensions import *
+from api.util import COLUMNAR_FORMATS, STREAMING_FORMATS, make_columnar_response, make_streaming_response, \
+    negotiate_response_format
 
 
 @marshmallow_dataclass.dataclass
@@ -24,6 +29,46 @@ class CarbonIntensityRequest:
     use_prediction: bool = field(default=False)
     desired_renewable_ratio: Optional[float] = \
         optional_field_with_validation(lambda ratio: 0. <= ratio <= 1.)
+    # Stream the time series as NDJSON or CSV records, or return it as Arrow IPC or NumPy npz columns instead, with the
+    # ISO and region in the headers. Overrides the format negotiated from the Accept header.
+    format: Optional[ResponseFormat] = field_enum(ResponseFormat)
+
+MAX_BATCH_SIZE = 1000
+
+
+@marshmallow_dataclass.dataclass
+class CarbonIntensityBatchItem:
+    start: datetime = field_default()
+    end: datetime = field_default()
+    # Either the GPS coordinate or the ISO in the format of the carbon data source, e.g. "emap:DE".
+    latitude: Optional[float] = optional_field_with_validation(lambda x: abs(x) <= 90.)
+    longitude: Optional[float] = optional_field_with_validation(lambda x: abs(x) <= 180.)
+    iso: Optional[str] = field(default=None)
+    carbon_data_source: CarbonDataSource = field_enum(CarbonDataSource, CarbonDataSource.C3Lab)
+
+    @validates_schema
+    def validate_schema(self, data, **kwargs):
+        has_gps = data.get('latitude', None) is not None and data.get('longitude', None) is not None
+        if has_gps == bool(data.get('iso', None)):
+            raise ValidationError({'iso': 'Must provide one of iso and latitude/longitude'})
+
+
+@marshmallow_dataclass.dataclass
+class CarbonIntensityBatchRequest:
+    items: list[CarbonIntensityBatchItem] = field_with_validation(lambda l: 0 < len(l) <= MAX_BATCH_SIZE)
+    use_prediction: bool = field(default=False)
+    desired_renewable_ratio: Optional[float] = \
+        optional_field_with_validation(lambda ratio: 0. <= ratio <= 1.)
+
+
+def _to_columns(l_carbon_intensity: list[dict]) -> dict[str, list]:
+    """Convert the time series to one list per field, e.g. 'timestamps' and 'carbon_intensities'."""
+    d_columns = {'timestamps': [d['timestamp'] for d in l_carbon_intensity],
+                 'carbon_intensities': [d['carbon_intensity'] for d in l_carbon_intensity]}
+    if l_carbon_intensity and 'renewable_ratio' in l_carbon_intensity[0]:
+        d_columns['renewable_ratios'] = [d['renewable_ratio'] for d in l_carbon_intensity]
+    return d_columns
+
 
 class CarbonIntensity(Resource):
     @use_args(marshmallow_dataclass.class_schema(CarbonIntensityRequest)(), location='query')
@@ -34,6 +79,17 @@ class CarbonIntensity(Resource):
         iso_format = get_iso_format_for_carbon_source(request.carbon_data_source)
         iso = get_iso_from_gps(request.latitude, request.longitude, iso_format)
         region = get_iso_from_gps(request.latitude, request.longitude, IsoFormat.C3Lab).removeprefix(ISO_PREFIX_C3LAB)
+        response_format = negotiate_response_format(request.format and request.format.value)
+        if response_format in STREAMING_FORMATS:
+            return make_streaming_response(
+                iter_carbon_intensity_list(iso, request.start, request.end, request.carbon_data_source,
+                                           request.use_prediction, request.desired_renewable_ratio),
+                response_format, headers={'X-ISO': iso, 'X-Region': region})
+        if response_format in COLUMNAR_FORMATS:
+            return make_columnar_response(
+                get_carbon_intensity_columns(iso, request.start, request.end, request.carbon_data_source,
+                                             request.use_prediction, request.desired_renewable_ratio),
+                response_format, headers={'X-ISO': iso, 'X-Region': region})
         l_carbon_intensity = get_carbon_intensity_list(iso, request.start, request.end,
                                                        request.carbon_data_source, request.use_prediction,
                                                        request.desired_renewable_ratio)
@@ -43,3 +99,38 @@ class CarbonIntensity(Resource):
             'iso': iso,
             'carbon_intensities': l_carbon_intensity,
         }
+
+    @use_args(marshmallow_dataclass.class_schema(CarbonIntensityBatchRequest)())
+    def post(self, request: CarbonIntensityBatchRequest):
+        """Get the carbon intensity of many (location or ISO, start, end) items in one request.
+
+            Items are grouped by carbon data source, so that the ISOs of each source are looked up in one batch and
+            their carbon data is fetched together. Each result has the columns of the time series, or an 'error'.
+        """
+        current_app.logger.info("CarbonIntensity.post(%d items)" % len(request.items))
+        l_results: list[dict] = [{'request': item} for item in request.items]
+        for carbon_data_source in CarbonDataSource:
+            l_indices = [i for (i, item) in enumerate(request.items) if item.carbon_data_source == carbon_data_source]
+            if not l_indices:
+                continue
+            l_gps_indices = [i for i in l_indices if not request.items[i].iso]
+            l_isos = get_isos_from_gps(
+                [(request.items[i].latitude, request.items[i].longitude) for i in l_gps_indices],
+                get_iso_format_for_carbon_source(carbon_data_source)) if l_gps_indices else []
+            d_isos = {i: request.items[i].iso for i in l_indices} | dict(zip(l_gps_indices, l_isos))
+            l_fetch_indices = []
+            for i in l_indices:
+                if isinstance(d_isos[i], Exception):
+                    l_results[i]['error'] = str(d_isos[i])
+                else:
+                    l_results[i]['iso'] = d_isos[i]
+                    l_fetch_indices.append(i)
+            l_carbon_intensity_lists = get_carbon_intensity_lists(
+                [(d_isos[i], request.items[i].start, request.items[i].end) for i in l_fetch_indices],
+                carbon_data_source, request.use_prediction, request.desired_renewable_ratio)
+            for (i, l_carbon_intensity) in zip(l_fetch_indices, l_carbon_intensity_lists):
+                if isinstance(l_carbon_intensity, Exception):
+                    l_results[i]['error'] = str(l_carbon_intensity)
+                else:
+                    l_results[i] |= _to_columns(l_carbon_intensity)
+        return {'results': l_results}
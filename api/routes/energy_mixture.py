@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
+from typing import Optional
 from flask_restful import Resource
 import marshmallow_dataclass
 from webargs import fields
@@ -8,9 +9,12 @@ from webargs.flaskparser import use_args
 from flask import current_app
 from api.helpers.balancing_authority import get_iso_from_gps
 
-from api.helpers.carbon_intensity_c3lab import get_power_by_fuel_type
-from api.models.common import ISO_PREFIX_C3LAB, IsoFormat
+from api.helpers.carbon_intensity_c3lab import get_power_by_fuel_type, get_power_by_fuel_type_columns, \
+    iter_power_by_fuel_type
+from api.models.common import ISO_PREFIX_C3LAB, IsoFormat, ResponseFormat
 from api.models.dataclass_extensions import *
+from api.util import COLUMNAR_FORMATS, STREAMING_FORMATS, make_columnar_response, make_streaming_response, \
+    negotiate_response_format
 
 
 @marshmallow_dataclass.dataclass
@@ -20,6 +24,10 @@ class EnergyMixtureRequest:
     start: datetime = field_default()
     end: datetime = field_default()
     iso_format: IsoFormat = field_enum(IsoFormat, IsoFormat.WattTime)
+    # Stream one record per timestamp and fuel type as NDJSON or CSV, or return one column per fuel type as Arrow IPC
+    # or NumPy npz instead, with the ISO and region in the headers. Overrides the format negotiated from the Accept
+    # header.
+    format: Optional[ResponseFormat] = field_enum(ResponseFormat)
 
 class EnergyMixture(Resource):
     @use_args(marshmallow_dataclass.class_schema(EnergyMixtureRequest)(), location='query')
@@ -36,6 +44,15 @@ class EnergyMixture(Resource):
         # assert args.iso_format == IsoFormat.C3Lab, "Only C3Lab is supported for energy mixture endpoint"
         iso = get_iso_from_gps(args.latitude, args.longitude, args.iso_format)
         region = get_iso_from_gps(args.latitude, args.longitude, IsoFormat.C3Lab).removeprefix(ISO_PREFIX_C3LAB)
+        response_format = negotiate_response_format(args.format and args.format.value)
+        if response_format in STREAMING_FORMATS:
+            return make_streaming_response(
+                ({'timestamp': timestamp, 'type': fuel_type, 'power_mw': power_mw}
+                 for (timestamp, fuel_type, power_mw) in iter_power_by_fuel_type(iso, args.start, args.end)),
+                response_format, headers={'X-ISO': iso, 'X-Region': region})
+        if response_format in COLUMNAR_FORMATS:
+            return make_columnar_response(get_power_by_fuel_type_columns(iso, args.start, args.end),
+                                          response_format, headers={'X-ISO': iso, 'X-Region': region})
         power_by_fuel_type = get_power_by_fuel_type(iso, args.start, args.end)
 
         return orig_request | {
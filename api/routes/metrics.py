@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+
+import os
+
+from flask_restful import Resource
+
+from api.util import carbon_data_range_cache, get_psql_pool
+
+
+class Metrics(Resource):
+    """Runtime metrics of the current worker process."""
+    def get(self):
+        return {
+            'pid': os.getpid(),
+            'psql-pool': get_psql_pool().get_metrics(),
+            'carbon-data-range-cache': carbon_data_range_cache.get_metrics(),
+        }
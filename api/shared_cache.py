@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import sqlite3
+import stat
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any
+
+from flask import Flask, current_app
+from flask_caching.backends.base import BaseCache
+
+# In a directory private to the user, as the cached values are unpickled.
+DEFAULT_SHARED_CACHE_SQLITE_PATH = os.path.join(tempfile.gettempdir(), f'energy-data-api-{os.getuid()}',
+                                                'cache.sqlite3')
+
+
+def create_private_file(path: str):
+    """Create the file, if missing, with 0600 permissions in a directory with 0700 permissions, and check that both
+        are owned by the current user, so that no other user can plant or modify the file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if st.st_uid != os.getuid() or not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o077:
+        raise PermissionError(f'Directory "{directory}" must be owned by the current user and not accessible by '
+                              'others.')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        if os.fstat(fd).st_uid != os.getuid():
+            raise PermissionError(f'File "{path}" must be owned by the current user.')
+        os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+class SQLiteCache(BaseCache):
+    """A Flask-Caching backend in an on-host SQLite database, which is shared by all processes on the host.
+
+        Select it with `CACHE_TYPE = 'api.shared_cache.SQLiteCache'` and `CACHE_SQLITE_PATH`. Values are pickled, and
+        beyond `CACHE_THRESHOLD` entries the expired and then the least recently written entries are removed. The
+        database must be in a directory private to the user, see `create_private_file()`.
+    """
+    # Prune once every this many writes.
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: str = DEFAULT_SHARED_CACHE_SQLITE_PATH, default_timeout: int = 300,
+                 threshold: int = 100000, key_prefix: str = ''):
+        super().__init__(default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self.key_prefix = key_prefix
+        self.local = threading.local()
+        self.num_writes = 0
+        create_private_file(path)
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            expires REAL NOT NULL)""")
+
+    @classmethod
+    def factory(cls, app: Flask, config: dict, args: list, kwargs: dict):
+        kwargs.update(path=config.get('CACHE_SQLITE_PATH', DEFAULT_SHARED_CACHE_SQLITE_PATH),
+                      threshold=config['CACHE_THRESHOLD'], key_prefix=config['CACHE_KEY_PREFIX'])
+        return cls(*args, **kwargs)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the connection of the current thread, which is reopened in forked processes."""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL lets readers in other processes proceed while one process writes.
+            conn.execute('PRAGMA journal_mode=WAL;')
+            conn.execute('PRAGMA synchronous=NORMAL;')
+            (self.local.conn, self.local.pid) = (conn, os.getpid())
+        return self.local.conn
+
+    def _get_expires(self, timeout: int | None) -> float:
+        timeout = self._normalize_timeout(timeout)
+        return datetime.now().timestamp() + timeout if timeout != 0 else 0.
+
+    def _prune(self, conn: sqlite3.Connection):
+        conn.execute('DELETE FROM cache WHERE expires != 0 AND expires <= ?;', [datetime.now().timestamp()])
+        (count,) = conn.execute('SELECT COUNT(*) FROM cache;').fetchone()
+        if count > self.threshold:
+            # Replaced entries get a new rowid, so the smallest rowids are the least recently written.
+            conn.execute('DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?);',
+                         [count - self.threshold])
+
+    def _write(self, query: str, args: list) -> bool:
+        try:
+            conn = self._connection()
+            rowcount = conn.execute(query, args).rowcount
+            self.num_writes += 1
+            if self.num_writes % self.PRUNE_INTERVAL == 0:
+                self._prune(conn)
+            return rowcount > 0
+        except sqlite3.Error as e:
+            current_app.logger.warning(f'SQLiteCache: failed to write to {self.path}: {e}')
+            return False
+
+    def get(self, key: str) -> Any:
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires = 0 OR expires > ?);',
+                [self.key_prefix + key, datetime.now().timestamp()]).fetchone()
+        except sqlite3.Error as e:
+            current_app.logger.warning(f'SQLiteCache: failed to read from {self.path}: {e}')
+            return None
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            # E.g. a corrupt value, or the class of the value no longer exists.
+            current_app.logger.warning(f'SQLiteCache: failed to unpickle {key} from {self.path}: {e!r}')
+            return None
+
+    def has(self, key: str) -> bool:
+        try:
+            return self._connection().execute(
+                'SELECT 1 FROM cache WHERE key = ? AND (expires = 0 OR expires > ?);',
+                [self.key_prefix + key, datetime.now().timestamp()]).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+    def set(self, key: str, value: Any, timeout: int | None = None) -> bool:
+        return self._write('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?);',
+                           [self.key_prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                            self._get_expires(timeout)])
+
+    def add(self, key: str, value: Any, timeout: int | None = None) -> bool:
+        return self._write("""INSERT INTO cache (key, value, expires) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires
+                WHERE cache.expires != 0 AND cache.expires <= ?;""",
+                           [self.key_prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                            self._get_expires(timeout), datetime.now().timestamp()])
+
+    def delete(self, key: str) -> bool:
+        return self._write('DELETE FROM cache WHERE key = ?;', [self.key_prefix + key])
+
+    def clear(self) -> bool:
+        """Remove the entries of this cache, i.e. with its key prefix."""
+        self._write('DELETE FROM cache WHERE substr(key, 1, ?) = ?;', [len(self.key_prefix), self.key_prefix])
+        return True
+
+
+def get_cache_config(app: Flask, key_prefix: str) -> dict:
+    """Get the Flask-Caching config of the shared cache backend selected by `SHARED_CACHE_TYPE` in the app config.
+
+        - 'simple': a cache private to each process (the default).
+        - 'sqlite': an SQLite database at `SHARED_CACHE_SQLITE_PATH`, shared by all processes on the host.
+        - 'redis': a Redis-protocol server at `SHARED_CACHE_REDIS_URL`, which requires the `redis` package.
+
+        Caches that share a backend are separated by `key_prefix`.
+    """
+    config = {'CACHE_KEY_PREFIX': key_prefix}
+    match app.config.get('SHARED_CACHE_TYPE', 'simple'):
+        case 'simple':
+            return config | {'CACHE_TYPE': 'SimpleCache'}
+        case 'sqlite':
+            return config | {
+                'CACHE_TYPE': 'api.shared_cache.SQLiteCache',
+                'CACHE_SQLITE_PATH': app.config.get('SHARED_CACHE_SQLITE_PATH', DEFAULT_SHARED_CACHE_SQLITE_PATH),
+            }
+        case 'redis':
+            return config | {
+                'CACHE_TYPE': 'flask_caching.backends.RedisCache',
+                'CACHE_REDIS_URL': app.config['SHARED_CACHE_REDIS_URL'],
+            }
+        case shared_cache_type:
+            raise ValueError(f'Unknown shared cache type "{shared_cache_type}"')
+
+
+# Of a persistent cache, whose entries never expire and are only pruned as a safeguard.
+PERSISTENT_CACHE_THRESHOLD = 1000000
+
+
+def get_persistent_cache_config(app: Flask, key_prefix: str, path: str | None) -> dict:
+    """Get the Flask-Caching config of a cache that is kept across restarts, e.g. `supervisorctl reload`.
+
+        The cache is an SQLite database at `path` if set, or otherwise the shared cache backend. Unlike other caches,
+        it is not pruned to the default `CACHE_THRESHOLD` of 500 entries.
+    """
+    if not path:
+        return get_cache_config(app, key_prefix) | {'CACHE_THRESHOLD': PERSISTENT_CACHE_THRESHOLD}
+    return {
+        'CACHE_KEY_PREFIX': key_prefix,
+        'CACHE_TYPE': 'api.shared_cache.SQLiteCache',
+        'CACHE_SQLITE_PATH': path,
+        'CACHE_THRESHOLD': PERSISTENT_CACHE_THRESHOLD,
+    }
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import json
+from flask_caching import Cache
+
+import api.helpers.balancing_authority as balancing_authority
+from api.helpers.balancing_authority_index import BalancingAuthorityIndex
+from api.models.common import ISO_PREFIX_WATTTIME, IsoFormat
+from api.shared_cache import get_persistent_cache_config
+
+
+def square_feature(properties: dict, min_lon: float, min_lat: float, size: float) -> dict:
+    (max_lon, max_lat) = (min_lon + size, min_lat + size)
+    return {
+        'type': 'Feature',
+        'properties': properties,
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat],
+                             [min_lon, min_lat]]],
+        },
+    }
+
+
+FEATURES = [
+    square_feature({'abbrev': 'CAISO_NORTH', 'name': 'California ISO Northern'}, -124., 36., 6.),
+    # Nested in CAISO_NORTH
+    square_feature({'abbrev': 'BANC', 'name': 'Balancing Authority of Northern California'}, -122., 38., 1.),
+    square_feature({'abbrev': 'PJM_DC', 'name': 'PJM DC'}, -78., 38., 1.),
+    {'type': 'Feature', 'properties': {'abbrev': 'NO_GEOMETRY'}, 'geometry': None},
+]
+
+
+def test_lookup_picks_smallest_containing_boundary(tmp_path):
+    path = tmp_path / 'ba-boundaries.geojson'
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': FEATURES}))
+    index = BalancingAuthorityIndex.from_geojson_file(str(path))
+    assert len(index) == 3
+    assert index.lookup(37., -120.)['abbrev'] == 'CAISO_NORTH'
+    assert index.lookup(38.5, -121.5)['abbrev'] == 'BANC'
+    assert index.lookup(38.9, -77.0)['abbrev'] == 'PJM_DC'
+    assert index.lookup(0., 0.) is None
+
+
+def test_get_iso_from_gps_falls_back_to_remote_outside_boundaries(app, monkeypatch):
+    index = BalancingAuthorityIndex(FEATURES)
+    monkeypatch.setattr(balancing_authority, 'get_watttime_ba_index', lambda: index)
+    l_remote_lookups = []
+
+    def lookup_remote(latitude, longitude):
+        l_remote_lookups.append((latitude, longitude))
+        return {'watttime_abbrev': 'ERCOT_AUSTIN', 'watttime_name': 'ERCOT Austin'}
+
+    monkeypatch.setattr(balancing_authority, '_lookup_watttime_balancing_authority_remote', lookup_remote)
+    with app.app_context():
+        iso = balancing_authority.get_iso_from_gps(38.5, -121.5, IsoFormat.WattTime)
+        assert iso == ISO_PREFIX_WATTTIME + 'BANC'
+        assert l_remote_lookups == []
+        iso = balancing_authority.get_iso_from_gps(30.3, -97.7, IsoFormat.WattTime)
+        assert iso == ISO_PREFIX_WATTTIME + 'ERCOT_AUSTIN'
+        assert l_remote_lookups == [(30.3, -97.7)]
+
+
+def test_nearby_points_share_quantized_lookup(app, monkeypatch):
+    l_lookups = []
+
+    def lookup(latitude, longitude):
+        l_lookups.append((latitude, longitude))
+        return {'watttime_abbrev': 'ERCOT_AUSTIN', 'watttime_name': 'ERCOT Austin'}
+
+    monkeypatch.setattr(balancing_authority, '_lookup_watttime_balancing_authority', lookup)
+    app.config['BA_LOOKUP_PRECISION'] = 2
+    with app.app_context():
+        balancing_authority.lookup_watttime_balancing_authority(30.2672, -97.7431)
+        balancing_authority.lookup_watttime_balancing_authority(30.2718, -97.7405)
+        balancing_authority.lookup_watttime_balancing_authority(30.2849, -97.7341)
+    assert l_lookups == [(30.27, -97.74), (30.28, -97.73)]
+
+
+def test_warm_up_persists_known_regions(app, monkeypatch, tmp_path):
+    l_lookups = []
+
+    def lookup(latitude, longitude):
+        l_lookups.append((latitude, longitude))
+        return {'watttime_abbrev': 'CAISO_NORTH', 'watttime_name': 'California ISO Northern'}
+
+    monkeypatch.setattr(balancing_authority, '_lookup_watttime_balancing_authority', lookup)
+    monkeypatch.setattr(balancing_authority, '_lookup_emap_balancing_authority', lambda latitude, longitude: 'DE')
+    monkeypatch.setattr(balancing_authority, 'get_known_gps_coordinates', lambda: [(37.00578, -121.56828)] * 2)
+    path = str(tmp_path / 'ba-lookup.sqlite3')
+    cache = Cache()
+    with app.app_context():
+        cache.init_app(app, config=get_persistent_cache_config(app, 'ba_lookup_', path))
+        monkeypatch.setattr(balancing_authority, 'ba_lookup_cache', cache)
+        assert balancing_authority.warm_up_ba_lookup_cache() == 2
+        # After a restart, once the lock of the warm-up expired, the lookups are served from the file.
+        cache.init_app(app, config=get_persistent_cache_config(app, 'ba_lookup_', path))
+        cache.delete(balancing_authority.BA_LOOKUP_WARM_UP_LOCK_KEY)
+        assert balancing_authority.warm_up_ba_lookup_cache() == 0
+        assert balancing_authority.get_iso_from_gps(37.0061, -121.5679, IsoFormat.WattTime) == \
+            ISO_PREFIX_WATTTIME + 'CAISO_NORTH'
+    assert l_lookups == [(37.01, -121.57)]
+
+
+def test_warm_up_runs_in_one_worker(app, monkeypatch, tmp_path):
+    l_lookups = []
+    monkeypatch.setattr(balancing_authority, '_lookup_emap_balancing_authority',
+                        lambda latitude, longitude: l_lookups.append((latitude, longitude)) or 'DE')
+    monkeypatch.setattr(balancing_authority, 'get_known_gps_coordinates', lambda: [(37.00578, -121.56828)])
+    path = str(tmp_path / 'ba-lookup.sqlite3')
+    (cache_a, cache_b) = (Cache(), Cache())
+    with app.app_context():
+        cache_a.init_app(app, config=get_persistent_cache_config(app, 'ba_lookup_', path))
+        cache_b.init_app(app, config=get_persistent_cache_config(app, 'ba_lookup_', path))
+        # Another worker on the same file took the lock and is warming up the cache.
+        assert cache_a.add(balancing_authority.BA_LOOKUP_WARM_UP_LOCK_KEY, 1)
+        monkeypatch.setattr(balancing_authority, 'ba_lookup_cache', cache_b)
+        assert balancing_authority.warm_up_ba_lookup_cache() == 0
+    assert l_lookups == []
+
+
+def test_known_gps_coordinates_include_cloud_and_azure_regions():
+    l_coordinates = balancing_authority.get_known_gps_coordinates()
+    assert (37.00578, -121.56828) in l_coordinates  # AWS us-west-1
+    assert (37.3719, -79.8164) in l_coordinates  # Azure eastus
+
+
+def test_batch_lookup_dedups_and_keeps_input_order(app, monkeypatch):
+    monkeypatch.setattr(balancing_authority, 'get_watttime_ba_index', lambda: BalancingAuthorityIndex(FEATURES))
+    l_remote_lookups = []
+
+    def lookup_remote(latitude, longitude):
+        l_remote_lookups.append((latitude, longitude))
+        if latitude < 0:
+            raise ValueError('No balancing authority found')
+        return {'watttime_abbrev': 'ERCOT_AUSTIN', 'watttime_name': 'ERCOT Austin'}
+
+    monkeypatch.setattr(balancing_authority, '_lookup_watttime_balancing_authority_remote', lookup_remote)
+    app.config['BA_LOOKUP_PRECISION'] = 2
+    l_coordinates = [(30.2672, -97.7431), (38.5, -121.5), (-30., 0.), (30.2718, -97.7405), (38.9, -77.0)]
+    with app.app_context():
+        l_isos = balancing_authority.get_isos_from_gps(l_coordinates, IsoFormat.WattTime)
+        assert l_isos[:2] == [ISO_PREFIX_WATTTIME + 'ERCOT_AUSTIN', ISO_PREFIX_WATTTIME + 'BANC']
+        assert isinstance(l_isos[2], ValueError)
+        assert l_isos[3:] == [ISO_PREFIX_WATTTIME + 'ERCOT_AUSTIN', ISO_PREFIX_WATTTIME + 'PJM_DC']
+        assert sorted(l_remote_lookups) == [(-30., 0.), (30.27, -97.74)]
+        # Successful lookups are cached, and failed ones are retried.
+        balancing_authority.get_isos_from_gps(l_coordinates, IsoFormat.WattTime)
+        assert sorted(l_remote_lookups) == [(-30., 0.), (-30., 0.), (30.27, -97.74)]
+
+
+def test_post_balancing_authority_batch(app, client, monkeypatch):
+    monkeypatch.setattr(balancing_authority, 'get_watttime_ba_index', lambda: BalancingAuthorityIndex(FEATURES))
+
+    def lookup_remote(latitude, longitude):
+        raise ValueError('Not found')
+
+    monkeypatch.setattr(balancing_authority, '_lookup_watttime_balancing_authority_remote', lookup_remote)
+    response = client.post('/balancing-authority/', json={
+        'coordinates': [{'latitude': 38.5, 'longitude': -121.5}, {'latitude': 0., 'longitude': 0.}],
+    })
+    assert response.status_code == 200
+    assert response.json['results'] == [
+        {
+            'request': {'latitude': 38.5, 'longitude': -121.5},
+            'watttime_abbrev': 'BANC',
+            'watttime_name': 'Balancing Authority of Northern California',
+            'iso': ISO_PREFIX_WATTTIME + 'BANC',
+            'region': 'unknown:BANC',
+        },
+        {'request': {'latitude': 0., 'longitude': 0.}, 'error': 'Not found'},
+    ]
+    assert client.post('/balancing-authority/', json={'coordinates': []}).status_code == 422
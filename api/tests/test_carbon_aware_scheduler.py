@@ -1,7 +1,16 @@
 #!/usr/bin/env python3
 
-from datetime import timedelta
+import dataclasses
+from datetime import datetime, timedelta
+from dateutil import tz
+from flask_caching import Cache
+import marshmallow_dataclass
 
+from api.models.workload import Workload
+import api.routes.carbon_aware_scheduler as carbon_aware_scheduler
+from api.routes.carbon_aware_scheduler import SchedulerSession, extend_carbon_data, get_scheduler_session, \
+    get_workload_fingerprint, put_scheduler_session
+from api.shared_cache import get_cache_config
 from api.tests.util import logger, assert_response_ok
 
 
@@ -18,7 +27,8 @@ class TestCarbonAwareScheduler:
             "dataset": {
                 "input_size_gb": 0,
                 "output_size_gb": 0
-            }
+            },
+            "details": "timings"
         }
         # PACW is the cleanest one due to hydro, and currently the other scores are the same across regions
         expected_selected_region = 'AWS:us-west-2'
@@ -29,6 +39,8 @@ class TestCarbonAwareScheduler:
             ('AWS:us-east-2', 'US-PJM'),
         ]
         expected_cloud_regions = [cloud_region for cloud_region, _ in expected_cloud_regions_and_isos]
+        request_payload['candidate_locations'] = [{'id': cloud_region} for cloud_region in expected_cloud_regions]
+        request_payload['original_location'] = expected_cloud_regions[0]
 
         response = client.get('/carbon-aware-scheduler/', json=request_payload)
         assert_response_ok(response)
@@ -36,19 +48,110 @@ class TestCarbonAwareScheduler:
         assert 'error' not in response_json
         logger.debug(response_json)
 
-        assert 'iso' in response_json
-        actual_iso_mapping = response_json['iso']
+        assert 'isos' in response_json
+        actual_iso_mapping = response_json['isos']
         for cloud_region, expected_iso in expected_cloud_regions_and_isos:
             assert actual_iso_mapping[cloud_region] == expected_iso
 
-        assert response_json['selected-region'] == expected_selected_region
+        assert response_json['optimal-regions'][0]['candidates'][0] == expected_selected_region
 
         assert 'weighted-scores' in response_json
         assert set(response_json['weighted-scores'].keys()) == set(expected_cloud_regions)
 
-        assert 'warning' not in response_json or not response_json['warning']
+        assert 'warnings' not in response_json or not response_json['warnings']
 
         for cloud_region, details in response_json['details'].items():
-            assert all([start_delay == 0 for start_delay in details['start_delay']])
-            assert all([migration_duration == [0, 0] for migration_duration in details['migration_duration']])
-            assert all([migration_emission == [0, 0] for migration_emission in details['migration_emission']])
+            # Without delay or data to transfer, each run computes right at its start time.
+            for timings in details['timings']:
+                assert timings['compute_start'] == timings['min_start']
+                assert timings['input_transfer_duration'] == timings['output_transfer_duration'] == '00:00:00'
+
+
+def test_workload_fingerprint_ignores_start_time():
+    def _load_workload(start_time: str, runtime: timedelta) -> Workload:
+        return marshmallow_dataclass.class_schema(Workload)().load({
+            'runtime': runtime.total_seconds(),
+            'schedule': {'type': 'onetime', 'start_time': start_time},
+            'dataset': {'input_size_gb': 0, 'output_size_gb': 0},
+            'candidate_providers': ['AWS'],
+        })
+    fingerprint = get_workload_fingerprint(_load_workload('2022-07-28T20:40:52-07:00', timedelta(hours=1)))
+    assert fingerprint == get_workload_fingerprint(_load_workload('2022-07-28T20:45:52-07:00', timedelta(hours=1)))
+    assert fingerprint != get_workload_fingerprint(_load_workload('2022-07-28T20:40:52-07:00', timedelta(hours=2)))
+
+
+def test_workload_fingerprint_ignores_generated_seed():
+    def _load_workload() -> Workload:
+        return marshmallow_dataclass.class_schema(Workload)().load({
+            'runtime': timedelta(minutes=10).total_seconds(),
+            'schedule': {'type': 'poisson', 'start_time': '2022-07-28T20:40:52-07:00',
+                         'interval': timedelta(hours=1).total_seconds()},
+            'dataset': {'input_size_gb': 0, 'output_size_gb': 0},
+            'candidate_providers': ['AWS'],
+        })
+    (workload_a, workload_b) = (_load_workload(), _load_workload())
+    assert workload_a.schedule.seed != workload_b.schedule.seed
+    assert get_workload_fingerprint(workload_a) == get_workload_fingerprint(workload_b)
+
+
+T0 = datetime(2022, 7, 1, tzinfo=tz.UTC)
+
+
+def _hourly(l_hours: list[int]) -> list[dict]:
+    return [{'timestamp': T0 + timedelta(hours=hour), 'carbon_intensity': float(hour)} for hour in l_hours]
+
+
+def test_extend_carbon_data_loads_after_last_timestamp(app, monkeypatch):
+    workload = marshmallow_dataclass.class_schema(Workload)().load({
+        'runtime': timedelta(hours=1).total_seconds(),
+        'schedule': {'type': 'onetime', 'start_time': (T0 + timedelta(hours=2, minutes=30)).isoformat()},
+        'dataset': {'input_size_gb': 0, 'output_size_gb': 0},
+        'candidate_providers': ['AWS'],
+    })
+    session = SchedulerSession(
+        created_at=T0, start_time=T0, candidate_regions=[], d_candidate_routes={'AWS:us-west-1': ['US-BPA']},
+        d_region_isos={'AWS:us-west-1': 'US-CAISO', 'AWS:us-east-1': 'US-PJM', 'AWS:us-west-2': 'US-PACW'},
+        d_region_warnings={},
+        d_iso_carbon_data={'US-CAISO': _hourly([0, 1, 2, 3]), 'US-PJM': _hourly([0, 1, 2, 3]),
+                           'US-BPA': _hourly([0, 1, 2, 3, 4])},
+        seed=None, response=({}, 200))
+    l_loads = []
+
+    def load_carbon_data(workload, isos, d_fetch_starts):
+        l_loads.append((isos, d_fetch_starts))
+        carbon_data = {('US-CAISO', None, None): _hourly([3, 4]), ('US-PACW', None, None): _hourly([1, 2, 3, 4])}
+        return carbon_data, {'US-PJM': 'Time range is too new. Data not yet available.'}
+
+    monkeypatch.setattr(carbon_aware_scheduler, 'load_carbon_data', load_carbon_data)
+    with app.app_context():
+        (d_iso_carbon_data, d_iso_errors) = extend_carbon_data(session, workload)
+    # BPA is already loaded past the end of the window, and PACW has no data yet.
+    assert l_loads == [({'US-CAISO', 'US-PJM', 'US-PACW'},
+                        {'US-CAISO': T0 + timedelta(hours=3), 'US-PJM': T0 + timedelta(hours=3)})]
+    # The data before the hour of the new start time is dropped, and the new data is appended without duplicates.
+    assert d_iso_carbon_data['US-CAISO'] == _hourly([2, 3, 4])
+    # If loading the new data fails, the loaded data is kept.
+    assert d_iso_carbon_data['US-PJM'] == _hourly([2, 3])
+    assert d_iso_carbon_data['US-BPA'] == _hourly([2, 3, 4])
+    assert d_iso_carbon_data['US-PACW'] == _hourly([1, 2, 3, 4])
+    assert d_iso_errors == {}
+
+
+def test_scheduler_sessions_are_shared_between_workers(app, monkeypatch, tmp_path):
+    app.config.update(SHARED_CACHE_TYPE='sqlite', SHARED_CACHE_SQLITE_PATH=str(tmp_path / 'cache.sqlite3'))
+    (cache_a, cache_b) = (Cache(), Cache())
+    cache_a.init_app(app, config=get_cache_config(app, 'scheduler_session_'))
+    cache_b.init_app(app, config=get_cache_config(app, 'scheduler_session_'))
+    session = SchedulerSession(
+        created_at=datetime.now(tz.UTC), start_time=T0, candidate_regions=[], d_candidate_routes={},
+        d_region_isos={'AWS:us-west-1': 'US-CAISO'}, d_region_warnings={},
+        d_iso_carbon_data={'US-CAISO': _hourly([0, 1])}, seed=42, response=({'selected-region': 'AWS:us-west-1'}, 200))
+    with app.app_context():
+        monkeypatch.setattr(carbon_aware_scheduler, 'scheduler_session_cache', cache_a)
+        put_scheduler_session('fingerprint', session)
+        monkeypatch.setattr(carbon_aware_scheduler, 'scheduler_session_cache', cache_b)
+        assert get_scheduler_session('fingerprint') == session
+        # Sessions expire after the timeout since their creation.
+        put_scheduler_session('expired', dataclasses.replace(
+            session, created_at=session.created_at - carbon_aware_scheduler.SCHEDULER_SESSION_TIMEOUT * 2))
+        assert get_scheduler_session('expired') is None
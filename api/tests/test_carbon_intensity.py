@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from dateutil import tz
 import pytest
 import numpy as np
 import warnings
+from werkzeug.exceptions import BadRequest, NotFound
 
+from api.helpers.carbon_intensity import get_carbon_intensity_lists
+from api.helpers.carbon_intensity_shared import fetch_time_series_in_ranges
+from api.models.common import CarbonDataSource, IsoFormat
+import api.routes.carbon_intensity
 from api.tests.util import add_timezone_by_gps, logger, assert_response_ok
 
 warnings.filterwarnings("ignore", category=np.VisibleDeprecationWarning)
@@ -58,3 +64,106 @@ class TestCarbonIntensity:
             assert expected_ci_min <= min(l_actual_ci)
         if expected_ci_max is not None:
             assert max(l_actual_ci) <= expected_ci_max
+
+
+T0 = datetime(2022, 7, 1, tzinfo=tz.UTC)
+
+
+def test_carbon_intensity_batch_groups_items_by_source(client, monkeypatch):
+    l_gps_lookups = []
+    l_fetches = []
+
+    def get_isos_from_gps(l_coordinates, iso_format):
+        l_gps_lookups.append((l_coordinates, iso_format))
+        return [ValueError('Unknown location') if latitude == 0. else f'{iso_format.value}:{latitude:g}'
+                for (latitude, _) in l_coordinates]
+
+    def get_carbon_intensity_lists(l_requests, carbon_data_source, use_prediction, desired_renewable_ratio):
+        l_fetches.append((l_requests, carbon_data_source, use_prediction, desired_renewable_ratio))
+        return [BadRequest('Time range is too new.') if iso == 'US-MISO' else
+                [{'timestamp': start, 'carbon_intensity': 100.}, {'timestamp': end, 'carbon_intensity': 200.}]
+                for (iso, start, end) in l_requests]
+
+    monkeypatch.setattr(api.routes.carbon_intensity, 'get_isos_from_gps', get_isos_from_gps)
+    monkeypatch.setattr(api.routes.carbon_intensity, 'get_carbon_intensity_lists', get_carbon_intensity_lists)
+    (start, end) = (T0, T0 + timedelta(hours=1))
+    response = client.post('/carbon-intensity/', json={
+        'items': [
+            {'latitude': 32.88, 'longitude': -117.23, 'start': start.isoformat(), 'end': end.isoformat()},
+            {'iso': 'DE', 'carbon_data_source': 'emap', 'start': start.isoformat(), 'end': end.isoformat()},
+            {'latitude': 0., 'longitude': 0., 'start': start.isoformat(), 'end': end.isoformat()},
+            {'iso': 'US-MISO', 'start': start.isoformat(), 'end': end.isoformat()},
+        ],
+        'desired_renewable_ratio': 0.5,
+    })
+    assert_response_ok(response)
+
+    # One lookup of the GPS items and one fetch of the ISOs per carbon data source.
+    assert l_gps_lookups == [([(32.88, -117.23), (0., 0.)], IsoFormat.WattTime)]
+    assert l_fetches == [
+        ([('watttime:32.88', start, end), ('US-MISO', start, end)], CarbonDataSource.C3Lab, False, 0.5),
+        ([('DE', start, end)], CarbonDataSource.EMap, False, 0.5)]
+    l_results = response.json['results']
+    assert [result.get('iso') for result in l_results] == ['watttime:32.88', 'DE', None, 'US-MISO']
+    assert l_results[0]['carbon_intensities'] == l_results[1]['carbon_intensities'] == [100., 200.]
+    assert len(l_results[0]['timestamps']) == 2
+    assert 'Unknown location' in l_results[2]['error'] and 'carbon_intensities' not in l_results[2]
+    assert 'Time range is too new.' in l_results[3]['error'] and 'carbon_intensities' not in l_results[3]
+
+
+def test_carbon_intensity_batch_rejects_unsupported_renewable_ratio_per_item(app):
+    l_requests = [('DE', T0, T0 + timedelta(hours=1)), ('FR', T0, T0 + timedelta(hours=1))]
+    with app.app_context():
+        l_results = get_carbon_intensity_lists(l_requests, CarbonDataSource.EMap, False, 0.5)
+    assert len(l_results) == 2
+    assert all(isinstance(result, ValueError) and 'renewable ratio' in str(result) for result in l_results)
+
+
+class FakeBatchCursor:
+    """Answers the query of `fetch_time_series_in_ranges()` with all rows of the requested regions."""
+    def __init__(self, d_series: dict[str, list[datetime]]):
+        self.d_series = d_series
+        self.args = None
+
+    def execute(self, query, args):
+        self.args = args
+
+    def fetchall(self) -> list[tuple]:
+        records = []
+        for region in sorted(set(self.args['regions'])):
+            timestamps = self.d_series.get(region, [])
+            if not timestamps:
+                records.append((region, None, None, None, None, None))
+            for timestamp in timestamps:
+                records.append((region, timestamps[0], timestamps[-1], region, timestamp, float(timestamp.hour)))
+        return records
+
+
+class FakeBatchConnection:
+    def __init__(self, cursor: FakeBatchCursor):
+        self._cursor = cursor
+
+    def cursor(self) -> FakeBatchCursor:
+        return self._cursor
+
+
+def test_fetch_time_series_in_ranges_slices_and_maps_errors(app):
+    cursor = FakeBatchCursor({'CA': [T0 + timedelta(hours=i) for i in range(11)]})
+    l_ranges = [('CA', T0 + timedelta(hours=1, minutes=30), T0 + timedelta(hours=3, minutes=30)),
+                ('CA', T0 + timedelta(hours=2), T0 + timedelta(hours=2)),
+                ('CA', T0 - timedelta(hours=5), T0 + timedelta(hours=1)),
+                ('CA', T0 + timedelta(hours=3), T0 + timedelta(hours=1)),
+                ('CA', T0 + timedelta(hours=12), T0 + timedelta(hours=13)),
+                ('CA', T0 - timedelta(hours=5), T0 - timedelta(hours=1)),
+                ('XX', T0, T0 + timedelta(hours=1))]
+    with app.app_context():
+        l_results = fetch_time_series_in_ranges(FakeBatchConnection(cursor), l_ranges, ['value'], 'table')
+
+    # The rows bracketing each range are included.
+    assert [[row[0].hour for row in rows] for rows in l_results[:3]] == [[1, 2, 3, 4], [2], [0, 1]]
+    assert isinstance(l_results[3], BadRequest) and 'end must be before start' in l_results[3].description
+    assert isinstance(l_results[4], BadRequest) and 'too new' in l_results[4].description
+    assert isinstance(l_results[5], BadRequest) and 'too old' in l_results[5].description
+    assert isinstance(l_results[6], NotFound)
+    # Invalid ranges are not queried.
+    assert len(cursor.args['regions']) == len(l_ranges) - 1
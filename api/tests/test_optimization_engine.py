@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+from api.models.optimization_engine import OptimizationEngine, OptimizationFactor
+
+
+FACTORS = [OptimizationFactor.EnergyUsage, OptimizationFactor.CarbonEmission]
+D_SCORES = {
+    'a': {OptimizationFactor.EnergyUsage: 1., OptimizationFactor.CarbonEmission: 4.},
+    'b': {OptimizationFactor.EnergyUsage: 2., OptimizationFactor.CarbonEmission: 2.},
+    'c': {OptimizationFactor.EnergyUsage: 3., OptimizationFactor.CarbonEmission: 3.},
+    'd': {OptimizationFactor.EnergyUsage: 4., OptimizationFactor.CarbonEmission: 1.},
+}
+
+
+def test_compare_candidates_groups_equal_ratings():
+    engine = OptimizationEngine(FACTORS, [1, 1])
+    optimal_candidates, d_weighted_scores = engine.compare_candidates(D_SCORES, True)
+    assert optimal_candidates == [
+        {'rating': 2., 'candidates': ['b']},
+        {'rating': 2.5, 'candidates': ['a', 'd']},
+        {'rating': 3., 'candidates': ['c']},
+    ]
+    assert d_weighted_scores == {'a': 2.5, 'b': 2., 'c': 3., 'd': 2.5}
+
+
+def test_compare_candidates_top_k():
+    engine = OptimizationEngine(FACTORS, [1, 1])
+    optimal_candidates, d_weighted_scores = engine.compare_candidates(D_SCORES, True, top_k=2)
+    assert optimal_candidates == [{'rating': 2., 'candidates': ['b']}, {'rating': 2.5, 'candidates': ['a']}]
+    assert d_weighted_scores == {'b': 2., 'a': 2.5}
+
+
+def test_with_weights_overrides_defaults():
+    engine = OptimizationEngine(FACTORS, [1, 1]).with_weights({OptimizationFactor.EnergyUsage: 0.,
+                                                               OptimizationFactor.WanNetworkUsage: 1.})
+    assert engine.factors == FACTORS + [OptimizationFactor.WanNetworkUsage]
+    optimal_candidates, _ = engine.compare_candidates(D_SCORES, top_k=1)
+    assert optimal_candidates == [{'rating': 1. / 3, 'candidates': ['d']}]
+
+
+def test_pareto_front():
+    engine = OptimizationEngine(FACTORS, [1, 1])
+    assert engine.get_pareto_front(D_SCORES) == ['b', 'a', 'd']
+    # Factors without weight are not considered
+    assert OptimizationEngine(FACTORS, [1, 0]).get_pareto_front(D_SCORES) == ['a']
+    assert engine.get_pareto_front({}) == []
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta
+import multiprocessing
+import os
+import stat
+from dateutil import tz
+from flask_caching import Cache
+import pytest
+
+from api.shared_cache import SQLiteCache, get_cache_config, get_persistent_cache_config
+from api.util import TimeSeriesRangeCache
+
+
+T0 = datetime(2022, 7, 1, tzinfo=tz.UTC)
+
+
+def _set_in_subprocess(path: str):
+    SQLiteCache(path).set('key', {'value': 42})
+
+
+def fetch_hourly(region: str, start: datetime, end: datetime) -> list[dict]:
+    fetch_hourly.calls.append((region, start, end))
+    hours = int((end - start) / timedelta(hours=1))
+    return [{'timestamp': start + timedelta(hours=i), 'carbon_intensity': float(i)} for i in range(hours + 1)]
+
+
+def test_sqlite_cache_get_set_add_delete(app, tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite3'))
+    with app.app_context():
+        assert cache.get('key') is None
+        assert cache.set('key', [1, 2]) and cache.get('key') == [1, 2]
+        assert not cache.add('key', [3])
+        assert cache.add('other', [3]) and cache.has('other')
+        assert cache.delete('key') and not cache.has('key')
+        # Entries with a timeout of 0 never expire.
+        cache.set('forever', 1, timeout=0)
+        cache.set('expired', 1, timeout=-1)
+        assert cache.get('forever') == 1 and cache.get('expired') is None
+
+
+def test_sqlite_cache_file_is_private(app, tmp_path):
+    path = tmp_path / 'cache' / 'cache.sqlite3'
+    SQLiteCache(str(path))
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # A directory that other users can write to, e.g. to plant a file of pickled values, is refused.
+    os.chmod(path.parent, 0o777)
+    with pytest.raises(PermissionError):
+        SQLiteCache(str(path))
+
+
+def test_sqlite_cache_ignores_corrupt_values(app, tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite3'))
+    with app.app_context():
+        for (key, value) in [('truncated', b''), ('garbage', b'not a pickle')]:
+            cache._connection().execute('INSERT INTO cache (key, value, expires) VALUES (?, ?, 0);', [key, value])
+            assert cache.get(key) is None
+
+
+def test_persistent_cache_is_not_pruned_to_default_threshold(app, tmp_path):
+    cache = Cache()
+    cache.init_app(app, config=get_persistent_cache_config(app, 'ba_lookup_', str(tmp_path / 'ba-lookup.sqlite3')))
+    with app.app_context():
+        cache.set_many({f'key{i}': i for i in range(1000)}, timeout=0)
+        assert cache.get('key0') == 0 and cache.get('key999') == 999
+
+
+def test_sqlite_cache_is_shared_between_processes(app, tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = SQLiteCache(path)
+    process = multiprocessing.get_context('fork').Process(target=_set_in_subprocess, args=(path,))
+    process.start()
+    process.join()
+    with app.app_context():
+        assert cache.get('key') == {'value': 42}
+
+
+def test_sqlite_cache_key_prefixes_are_separate(app, tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    (cache_a, cache_b) = (SQLiteCache(path, key_prefix='a_'), SQLiteCache(path, key_prefix='b_'))
+    with app.app_context():
+        cache_a.set('key', 'a')
+        cache_b.set('key', 'b')
+        cache_a.clear()
+        assert (cache_a.get('key'), cache_b.get('key')) == (None, 'b')
+
+
+def test_memoize_with_sqlite_backend(app, tmp_path):
+    app.config.update(SHARED_CACHE_TYPE='sqlite', SHARED_CACHE_SQLITE_PATH=str(tmp_path / 'cache.sqlite3'))
+    (cache_a, cache_b) = (Cache(), Cache())
+    cache_a.init_app(app, config=get_cache_config(app, 'test_'))
+    cache_b.init_app(app, config=get_cache_config(app, 'test_'))
+    calls = []
+
+    def lookup(x):
+        calls.append(x)
+        return x * 2
+
+    with app.app_context():
+        assert cache_a.memoize()(lookup)(2) == 4
+        # Another cache instance on the same file, like another gunicorn worker, reuses the result.
+        assert cache_b.memoize()(lookup)(2) == 4
+    assert calls == [2]
+
+
+def _test_range_cache_shares_segments(app, shared_cache: Cache):
+    fetch_hourly.calls = []
+    (range_cache_a, range_cache_b) = (TimeSeriesRangeCache(), TimeSeriesRangeCache())
+    range_cache_a.init_app(app, shared_cache)
+    range_cache_b.init_app(app, shared_cache)
+    (fetch_a, fetch_b) = (range_cache_a.memoize()(fetch_hourly), range_cache_b.memoize()(fetch_hourly))
+    with app.app_context():
+        expected = fetch_a('CA', T0, T0 + timedelta(hours=24))
+        assert fetch_b('CA', T0 + timedelta(hours=1), T0 + timedelta(hours=5)) == expected[1:6]
+        assert len(fetch_hourly.calls) == 1
+        # Only the gap is fetched, and the merged segment is visible to the other instance again.
+        fetch_b('CA', T0 + timedelta(hours=20), T0 + timedelta(hours=30))
+        assert fetch_hourly.calls[-1] == ('CA', T0 + timedelta(hours=24), T0 + timedelta(hours=30))
+        assert len(fetch_a('CA', T0 + timedelta(hours=23), T0 + timedelta(hours=30))) == 8
+        assert len(fetch_hourly.calls) == 2
+    assert range_cache_b.get_metrics()['shared_hits'] == 1
+    assert range_cache_a.get_metrics()['shared_hits'] == 1
+
+
+def test_range_cache_shares_segments_via_sqlite(app, tmp_path):
+    app.config.update(SHARED_CACHE_TYPE='sqlite', SHARED_CACHE_SQLITE_PATH=str(tmp_path / 'cache.sqlite3'))
+    shared_cache = Cache()
+    shared_cache.init_app(app, config=get_cache_config(app, 'carbon_data_'))
+    _test_range_cache_shares_segments(app, shared_cache)
+
+
+def test_range_cache_shares_segments_via_redis(app):
+    fakeredis = pytest.importorskip('fakeredis')
+    shared_cache = Cache()
+    shared_cache.init_app(app, config={'CACHE_TYPE': 'flask_caching.backends.RedisCache',
+                                       'CACHE_REDIS_HOST': fakeredis.FakeStrictRedis()})
+    _test_range_cache_shares_segments(app, shared_cache)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from multiprocessing import shared_memory
+import pickle
+import pytest
+
+from api.models.timeseries import EmissionRateSeries, SharedEmissionRateStore
+
+
+T0 = datetime(2022, 7, 1, tzinfo=timezone.utc)
+T0_SECONDS = int(T0.timestamp())
+HOUR = 3600
+
+
+def test_from_carbon_intensity_list_keeps_sorted_hourly_data():
+    l_carbon_intensity = [
+        {'timestamp': T0 + timedelta(hours=1), 'carbon_intensity': 200.},
+        {'timestamp': T0 + timedelta(minutes=5), 'carbon_intensity': 999.},
+        {'timestamp': T0, 'carbon_intensity': 100.},
+    ]
+    series = EmissionRateSeries.from_carbon_intensity_list(l_carbon_intensity)
+    assert series.timestamps.tolist() == [T0_SECONDS, T0_SECONDS + HOUR, T0_SECONDS + 2 * HOUR]
+    assert series.rates.tolist() == [100., 200., 0.]
+
+
+def test_from_carbon_intensity_list_without_hourly_data():
+    with pytest.raises(ValueError):
+        EmissionRateSeries.from_carbon_intensity_list([
+            {'timestamp': T0 + timedelta(minutes=5), 'carbon_intensity': 1.}])
+
+
+def test_add_aligns_step_functions():
+    s1 = EmissionRateSeries(np.array([0, 10, 20]), np.array([1., 2., 0.]))
+    s2 = EmissionRateSeries(np.array([5, 15]), np.array([10., 0.]))
+    total = s1 + s2
+    assert total.timestamps.tolist() == [0, 5, 10, 15, 20]
+    assert total.rates.tolist() == [1., 11., 12., 2., 0.]
+    assert (s1 + EmissionRateSeries.create_empty()) is s1
+
+
+def test_scale_and_cumsum():
+    series = EmissionRateSeries(np.array([0, 10, 30]), np.array([1., 2., 0.])) * 2
+    assert series.rates.tolist() == [2., 4., 0.]
+    (x, y) = series.cumsum()
+    assert x.tolist() == [0., 10., 30.]
+    assert y.tolist() == [0., 20., 100.]
+    assert EmissionRateSeries.create_empty().cumsum()[0].size == 0
+
+
+def test_shared_store_round_trip():
+    s1 = EmissionRateSeries(np.array([0, 10, 20]), np.array([1., 2., 0.]))
+    s2 = EmissionRateSeries(np.array([5, 15]), np.array([10., 0.]))
+    with SharedEmissionRateStore.create({'a': s1, 'b': s2}) as store:
+        attached = pickle.loads(pickle.dumps(store))
+        try:
+            assert 'a' in attached and 'c' not in attached
+            assert attached['a'].timestamps.tolist() == [0, 10, 20]
+            assert attached['b'].rates.tolist() == [10., 0.]
+        finally:
+            attached.close()
+
+
+def test_shared_store_empty():
+    with SharedEmissionRateStore.create({}) as store:
+        assert len(store.keys()) == 0
+
+
+def test_shared_store_unlinks_block_on_failure(monkeypatch):
+    l_blocks = []
+
+    class RecordingSharedMemory(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            l_blocks.append(self.name)
+
+    monkeypatch.setattr(shared_memory, 'SharedMemory', RecordingSharedMemory)
+    series = EmissionRateSeries(np.array([0, 10, 20]), np.array([1., 2., 0.]))
+    # Fewer timestamps than rates, so that the rates do not fit.
+    series.timestamps = series.timestamps[:2]
+    with pytest.raises(ValueError):
+        SharedEmissionRateStore.create({'a': series})
+    assert len(l_blocks) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=l_blocks[0])
+
+
+def test_min_between():
+    series = EmissionRateSeries(np.array([10, 20, 30, 40]), np.array([3., 1., 2., 0.]))
+    starts = np.array([10, 15, 30, 25, 5, 35])
+    ends = np.array([20, 25, 40, 25, 15, 45])
+    assert series.min_between(starts, ends).tolist() == [3., 1., 2., 1., 0., 0.]
+    assert series.min_between(10, 20) == 3.
+    assert EmissionRateSeries.create_empty().min_between(starts, ends).tolist() == [0.] * 6
+
+
+def test_to_columns():
+    series = EmissionRateSeries(np.array([T0_SECONDS, T0_SECONDS + HOUR]), np.array([1.5, 0.]))
+    assert series.to_columns() == {'timestamps': [T0_SECONDS, T0_SECONDS + HOUR], 'values': [1.5, 0.]}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pytest
+
+from api.helpers.carbon_intensity import _get_candidate_wait_times, calculate_total_carbon_emissions, \
+    calculate_total_carbon_emissions_batch
+from api.models.timeseries import EmissionRateSeries
+
+
+T0 = datetime(2022, 7, 1, tzinfo=timezone.utc)
+
+
+def hourly_emission_rates(values: list[float], start: datetime = T0) -> EmissionRateSeries:
+    """Build an hourly emission rate series with the zero-valued end-of-time entry."""
+    timestamps = [int((start + timedelta(hours=i)).timestamp()) for i in range(len(values) + 1)]
+    return EmissionRateSeries(np.array(timestamps), np.array(list(values) + [0.]))
+
+
+def brute_force_min_emission(start: datetime, runtime: timedelta, max_delay: timedelta,
+                             input_transfer_time: timedelta, output_transfer_time: timedelta,
+                             compute_rates: EmissionRateSeries, transfer_rates: EmissionRateSeries,
+                             step: timedelta = timedelta(minutes=1)) -> float:
+    """Minimum emission over all wait times on a fixed grid, by direct integration of the step functions."""
+    def _integrate(rates: EmissionRateSeries, begin: datetime, end: datetime) -> float:
+        if rates.empty or begin >= end:
+            return 0.
+        timestamps = [datetime.fromtimestamp(t, timezone.utc) for t in rates.timestamps.tolist()] + \
+            [datetime.max.replace(tzinfo=timezone.utc)]
+        total = 0.
+        for i in range(len(rates)):
+            overlap = min(end, timestamps[i + 1]) - max(begin, timestamps[i])
+            if overlap > timedelta():
+                total += rates.rates[i] * overlap.total_seconds()
+        return total
+
+    wait_limit = max_delay - input_transfer_time - output_transfer_time
+    steps = int(wait_limit / step)
+    wait_times = [step * i for i in range(steps + 1)]
+    input_emissions = [_integrate(transfer_rates, start + w, start + w + input_transfer_time) for w in wait_times]
+    compute_offset = start + input_transfer_time
+    compute_emissions = [_integrate(compute_rates, compute_offset + w, compute_offset + w + runtime)
+                         for w in wait_times]
+    output_offset = compute_offset + runtime
+    output_emissions = [_integrate(transfer_rates, output_offset + w, output_offset + w + output_transfer_time)
+                        for w in wait_times]
+    min_input_compute = np.minimum.accumulate(
+        np.minimum.accumulate(input_emissions) + np.array(compute_emissions))
+    return float(np.min(min_input_compute + np.array(output_emissions)))
+
+
+def test_no_delay_integrates_runtime(app):
+    compute_rates = hourly_emission_rates([1., 2., 3., 4.])
+    with app.app_context():
+        (compute_emission, transfer_emission), timings = calculate_total_carbon_emissions(
+            T0 + timedelta(minutes=30), timedelta(hours=1), timedelta(),
+            timedelta(), timedelta(), compute_rates, EmissionRateSeries.create_empty())
+    assert compute_emission == pytest.approx(1. * 1800 + 2. * 1800)
+    assert transfer_emission == 0.
+    assert timings['compute_start'] == T0 + timedelta(minutes=30)
+
+
+def test_delay_picks_cleanest_window(app):
+    compute_rates = hourly_emission_rates([5., 4., 1., 1., 3., 5.])
+    with app.app_context():
+        (compute_emission, _), timings = calculate_total_carbon_emissions(
+            T0, timedelta(hours=2), timedelta(hours=4),
+            timedelta(), timedelta(), compute_rates, EmissionRateSeries.create_empty())
+    assert timings['compute_start'] == T0 + timedelta(hours=2)
+    assert compute_emission == pytest.approx(2 * 3600.)
+
+
+def test_delay_up_to_window_boundary(app):
+    # The optimum lies at the maximum delay, which is not aligned to any timestamp.
+    compute_rates = hourly_emission_rates([3., 2., 1., 0.5])
+    with app.app_context():
+        _, timings = calculate_total_carbon_emissions(
+            T0, timedelta(minutes=30), timedelta(hours=2, minutes=50),
+            timedelta(), timedelta(), compute_rates, EmissionRateSeries.create_empty())
+    assert timings['compute_start'] == T0 + timedelta(hours=2, minutes=50)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_brute_force_without_transfers(app, seed):
+    rng = np.random.default_rng(seed)
+    compute_rates = hourly_emission_rates(rng.uniform(0.1, 1., 12))
+    start = T0 + timedelta(minutes=int(rng.integers(0, 60)))
+    runtime = timedelta(minutes=int(rng.integers(10, 120)))
+    max_delay = timedelta(hours=int(rng.integers(1, 8)))
+    with app.app_context():
+        (compute_emission, transfer_emission), timings = calculate_total_carbon_emissions(
+            start, runtime, max_delay, timedelta(), timedelta(), compute_rates, EmissionRateSeries.create_empty())
+    expected = brute_force_min_emission(start, runtime, max_delay, timedelta(), timedelta(),
+                                        compute_rates, EmissionRateSeries.create_empty())
+    assert compute_emission == pytest.approx(expected)
+    assert transfer_emission == 0.
+    assert start <= timings['compute_start'] <= start + max_delay
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_brute_force_with_transfers(app, seed):
+    rng = np.random.default_rng(seed)
+    compute_rates = hourly_emission_rates(rng.uniform(0.1, 1., 12))
+    transfer_rates = hourly_emission_rates(rng.uniform(0.1, 1., 12))
+    start = T0 + timedelta(minutes=int(rng.integers(0, 60)))
+    runtime = timedelta(minutes=int(rng.integers(10, 120)))
+    input_transfer_time = timedelta(minutes=int(rng.integers(1, 30)))
+    output_transfer_time = timedelta(minutes=int(rng.integers(1, 30)))
+    max_delay = timedelta(hours=4)
+    with app.app_context():
+        (compute_emission, transfer_emission), timings = calculate_total_carbon_emissions(
+            start, runtime, max_delay, input_transfer_time, output_transfer_time, compute_rates, transfer_rates)
+    expected = brute_force_min_emission(start, runtime, max_delay, input_transfer_time, output_transfer_time,
+                                        compute_rates, transfer_rates)
+    assert compute_emission + transfer_emission == pytest.approx(expected)
+    assert timings['input_transfer_start'] >= start
+    assert timings['compute_start'] >= timings['input_transfer_end']
+    assert timings['output_transfer_start'] >= timings['compute_end']
+    assert timings['output_transfer_end'] <= timings['max_end'] + timedelta(microseconds=1)
+
+
+@pytest.mark.parametrize('has_transfer', [False, True])
+def test_batch_matches_individual_runs(app, has_transfer):
+    rng = np.random.default_rng(42)
+    compute_rates = hourly_emission_rates(rng.uniform(0.1, 1., 36))
+    transfer_rates = hourly_emission_rates(rng.uniform(0.1, 1., 36)) if has_transfer else EmissionRateSeries.create_empty()
+    transfer_time = timedelta(minutes=10) if has_transfer else timedelta()
+    starts = [T0 + timedelta(minutes=5 * i) for i in range(0, 24 * 12, 7)]
+    (runtime, max_delay) = (timedelta(minutes=45), timedelta(hours=6))
+    with app.app_context():
+        (compute_emissions, transfer_emissions), l_timings = calculate_total_carbon_emissions_batch(
+            starts, runtime, max_delay, transfer_time, transfer_time, compute_rates, transfer_rates)
+        assert len(compute_emissions) == len(transfer_emissions) == len(l_timings) == len(starts)
+        for i, start in enumerate(starts):
+            (compute_emission, transfer_emission), timings = calculate_total_carbon_emissions(
+                start, runtime, max_delay, transfer_time, transfer_time, compute_rates, transfer_rates)
+            assert compute_emissions[i] == pytest.approx(compute_emission)
+            assert transfer_emissions[i] == pytest.approx(transfer_emission)
+            assert l_timings[i] == timings
+
+
+def test_candidate_wait_times_only_cover_the_window_of_each_start():
+    breakpoints = np.arange(0., 1000., 10.)
+    starts = np.array([5., 500., 995.])
+    wait_times = _get_candidate_wait_times(starts, 30., [breakpoints, breakpoints - 5.])
+    # Breakpoints every 5 seconds, so at most 5 inside each window besides the bounds.
+    assert wait_times.shape == (3, 7)
+    assert wait_times[0].tolist() == [0., 5., 10., 15., 20., 25., 30.]
+    assert wait_times[1].tolist() == [0., 5., 10., 15., 20., 25., 30.]
+    assert wait_times[2].tolist() == [0., 30., 30., 30., 30., 30., 30.]
+
+
+def test_not_enough_time_for_transfers(app):
+    compute_rates = hourly_emission_rates([1., 1.])
+    with app.app_context(), pytest.raises(ValueError):
+        calculate_total_carbon_emissions(T0, timedelta(hours=1), timedelta(minutes=10),
+                                         timedelta(minutes=6), timedelta(minutes=6),
+                                         compute_rates, compute_rates)
@@ -4,8 +4,14 @@ from datetime import date, datetime, timedelta, time
 from dateutil import tz
 import random
 import arrow
+import io
+import numpy as np
+import psycopg2
+import pytest
 
-from api.util import round_down, xor, timedelta_to_time, Size, SizeUnit, RateUnit, Rate
+from api.util import round_down, xor, timedelta_to_time, Size, SizeUnit, RateUnit, Rate, PSqlConnectionPool, \
+    TimeSeriesRangeCache, encode_arrow_ipc, encode_npz, iter_eagerly, negotiate_response_format, stream_csv, \
+    stream_ndjson
 
 
 def test_round_down_timestamp_no_timezone():
@@ -123,3 +129,219 @@ def test_unit_add_subtract_copy():
     assert s1 - s2 == s3
     assert s1.value == 1.2 and s1.unit == SizeUnit.GB
     assert s2.value == 512 and s2.unit == SizeUnit.MB
+
+
+class FakePSqlConnection:
+    """Just enough of a psycopg2 connection for the pool to manage."""
+    def __init__(self, **kwargs):
+        self.closed = 0
+        self.autocommit = False
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def close(self):
+        self.closed = 1
+
+
+def test_psql_pool_reuses_connections(app, monkeypatch):
+    monkeypatch.setattr(psycopg2, 'connect', FakePSqlConnection)
+    pool = PSqlConnectionPool(2)
+    with app.app_context():
+        with pool.connection() as conn1:
+            assert conn1.autocommit
+            with pool.connection() as conn2:
+                assert conn2 is not conn1
+        with pool.connection() as conn:
+            assert conn is conn1
+    metrics = pool.get_metrics()
+    assert (metrics['checkouts'], metrics['connections_created'], metrics['connections_reused']) == (3, 2, 1)
+    assert (metrics['in_use'], metrics['idle']) == (0, 2)
+
+
+def test_psql_pool_discards_broken_connections(app, monkeypatch):
+    monkeypatch.setattr(psycopg2, 'connect', FakePSqlConnection)
+    pool = PSqlConnectionPool(1)
+    with app.app_context():
+        with pool.connection() as conn:
+            conn.close()
+        with pool.connection() as new_conn:
+            assert new_conn is not conn and not new_conn.closed
+    assert pool.get_metrics()['connections_discarded'] == 1
+
+
+class FakeTimeSeriesSource:
+    """Hourly data in [first, last], fetched with the same bracketing as the database helpers."""
+    def __init__(self, first: datetime, last: datetime):
+        self.timestamps = [first + timedelta(hours=i) for i in range(int((last - first) / timedelta(hours=1)) + 1)]
+        self.calls = []
+
+    def fetch(self, region: str, start: datetime, end: datetime) -> list[dict]:
+        self.calls.append((start, end))
+        if start > self.timestamps[-1] or end < self.timestamps[0]:
+            raise ValueError('No data available.')
+        i_start = max([i for (i, t) in enumerate(self.timestamps) if t <= start], default=0)
+        i_end = min([i for (i, t) in enumerate(self.timestamps) if t >= end], default=len(self.timestamps) - 1)
+        return [{'timestamp': t, 'carbon_intensity': float(t.hour)} for t in self.timestamps[i_start:i_end + 1]]
+
+
+T0 = datetime(2022, 7, 1, tzinfo=tz.UTC)
+
+
+def test_range_cache_serves_sub_ranges_and_fetches_gaps():
+    source = FakeTimeSeriesSource(T0, T0 + timedelta(days=3))
+    cache = TimeSeriesRangeCache()
+    fetch = cache.memoize()(source.fetch)
+    assert fetch('CA', T0 + timedelta(hours=1, minutes=30), T0 + timedelta(hours=24, minutes=30)) == \
+        source.fetch('CA', T0 + timedelta(hours=1, minutes=30), T0 + timedelta(hours=24, minutes=30))
+    source.calls.clear()
+
+    # Contained range is sliced from the cache.
+    assert fetch('CA', T0 + timedelta(hours=2, minutes=10), T0 + timedelta(hours=5)) == \
+        source.fetch('CA', T0 + timedelta(hours=2, minutes=10), T0 + timedelta(hours=5))
+    assert len(source.calls) == 1
+    # Overlapping range only fetches the missing tail and merges it into one segment.
+    source.calls.clear()
+    assert fetch('CA', T0 + timedelta(hours=2, minutes=30), T0 + timedelta(hours=26, minutes=30)) == \
+        source.fetch('CA', T0 + timedelta(hours=2, minutes=30), T0 + timedelta(hours=26, minutes=30))
+    assert source.calls[0] == (T0 + timedelta(hours=24, minutes=30), T0 + timedelta(hours=26, minutes=30))
+    # Other regions are cached separately.
+    fetch('NW', T0 + timedelta(hours=2), T0 + timedelta(hours=3))
+    metrics = cache.get_metrics()
+    assert (metrics['hits'], metrics['partial_hits'], metrics['misses'], metrics['segments']) == (1, 1, 2, 2)
+
+
+def test_range_cache_keeps_errors_of_the_data_source():
+    source = FakeTimeSeriesSource(T0, T0 + timedelta(hours=10))
+    fetch = TimeSeriesRangeCache().memoize()(source.fetch)
+    fetch('CA', T0, T0 + timedelta(hours=12))
+    # Covered by the cached range, but after the last available timestamp.
+    with pytest.raises(ValueError):
+        fetch('CA', T0 + timedelta(hours=11), T0 + timedelta(hours=12))
+    # The missing tail alone is rejected by the data source, but the whole range is valid.
+    assert fetch('CA', T0 + timedelta(hours=9), T0 + timedelta(hours=14)) == \
+        source.fetch('CA', T0 + timedelta(hours=9), T0 + timedelta(hours=14))
+
+
+def test_range_cache_refetches_after_last_available_timestamp():
+    source = FakeTimeSeriesSource(T0, T0 + timedelta(hours=10))
+    fetch = TimeSeriesRangeCache().memoize()(source.fetch)
+    fetch('CA', T0, T0 + timedelta(hours=12))
+    # Data loaded after the first fetch is returned, rather than the tail cached as of the first fetch.
+    source.timestamps.append(T0 + timedelta(hours=11))
+    source.calls.clear()
+    assert fetch('CA', T0 + timedelta(hours=9), T0 + timedelta(hours=12)) == \
+        source.fetch('CA', T0 + timedelta(hours=9), T0 + timedelta(hours=12))
+    assert source.calls[0] == (T0 + timedelta(hours=10), T0 + timedelta(hours=12))
+
+
+def test_range_cache_evicts_least_recently_used_segments():
+    source = FakeTimeSeriesSource(T0, T0 + timedelta(days=30))
+    cache = TimeSeriesRangeCache()
+    fetch = cache.memoize()(source.fetch)
+    fetch('CA', T0, T0 + timedelta(days=1))
+    cache.max_bytes = 2 * cache.get_metrics()['bytes']
+    fetch('NW', T0, T0 + timedelta(days=1))
+    fetch('CA', T0, T0 + timedelta(hours=1))
+    fetch('PJM', T0, T0 + timedelta(days=1))
+    metrics = cache.get_metrics()
+    assert (metrics['segments'], metrics['evictions']) == (2, 1)
+    assert metrics['bytes'] <= cache.max_bytes
+    source.calls.clear()
+    fetch('CA', T0, T0 + timedelta(hours=1))
+    assert source.calls == []
+
+
+def test_range_cache_expires_segments():
+    source = FakeTimeSeriesSource(T0, T0 + timedelta(days=1))
+    fetch = TimeSeriesRangeCache(timeout=0).memoize()(source.fetch)
+    fetch('CA', T0, T0 + timedelta(hours=2))
+    fetch('CA', T0, T0 + timedelta(hours=2))
+    assert len(source.calls) == 2
+
+
+def test_range_cache_batch_shares_segments_with_single_fetch():
+    source = FakeTimeSeriesSource(T0, T0 + timedelta(days=3))
+    cache = TimeSeriesRangeCache()
+    fetch = cache.memoize()(source.fetch)
+    l_batches = []
+
+    @cache.memoize_many(fetch)
+    def fetch_many(l_requests):
+        l_batches.append(l_requests)
+        l_results = []
+        for request in l_requests:
+            try:
+                l_results.append(source.fetch(*request))
+            except ValueError as ex:
+                l_results.append(ex)
+        return l_results
+
+    fetch('CA', T0, T0 + timedelta(hours=10))
+    l_requests = [('CA', T0 + timedelta(hours=2), T0 + timedelta(hours=5)),
+                  ('CA', T0 + timedelta(hours=30), T0 + timedelta(hours=40)),
+                  ('NW', T0 + timedelta(days=5), T0 + timedelta(days=6)),
+                  ('NW', T0 + timedelta(hours=1), T0 + timedelta(hours=2))]
+    l_results = fetch_many(l_requests)
+    assert l_results[0] == source.fetch(*l_requests[0])
+    assert l_results[1] == source.fetch(*l_requests[1])
+    assert isinstance(l_results[2], ValueError)
+    assert l_results[3] == source.fetch(*l_requests[3])
+    # Only the misses are fetched, in one batch.
+    assert l_batches == [l_requests[1:]]
+    # Disjoint ranges of the same region are cached as separate segments.
+    source.calls.clear()
+    assert fetch('CA', T0 + timedelta(hours=32), T0 + timedelta(hours=33)) == \
+        source.fetch('CA', T0 + timedelta(hours=32), T0 + timedelta(hours=33))
+    assert fetch_many(l_requests[3:]) == l_results[3:]
+    assert len(source.calls) == 1 and len(l_batches) == 1
+    assert cache.get_metrics()['segments'] == 3
+
+
+def test_stream_ndjson_and_csv_in_chunks():
+    records = [{'timestamp': T0 + timedelta(hours=i), 'carbon_intensity': float(i)} for i in range(5)]
+    l_chunks = list(stream_ndjson(iter(records), lines_per_chunk=2))
+    assert len(l_chunks) == 3
+    assert ''.join(l_chunks).splitlines()[1] == '{"timestamp": "2022-07-01T01:00:00+00:00", "carbon_intensity": 1.0}'
+    l_chunks = list(stream_csv(iter(records), rows_per_chunk=2))
+    assert len(l_chunks) == 3
+    assert ''.join(l_chunks).splitlines()[:2] == ['timestamp,carbon_intensity', '2022-07-01T00:00:00+00:00,0.0']
+    assert list(stream_csv(iter([]))) == []
+
+
+def test_iter_eagerly_raises_before_iteration():
+    def generate(fail: bool):
+        if fail:
+            raise ValueError('Invalid request')
+        yield from range(3)
+
+    with pytest.raises(ValueError):
+        iter_eagerly(generate(True))
+    assert list(iter_eagerly(generate(False))) == [0, 1, 2]
+    assert list(iter_eagerly(iter([]))) == []
+
+
+def test_encode_columns_as_npz_and_arrow():
+    columns = {'timestamp': np.array([1656633600, 1656637200], dtype=np.int64),
+               'carbon_intensity': np.array([250., np.nan])}
+    with np.load(io.BytesIO(encode_npz(columns))) as npz:
+        assert npz.files == ['timestamp', 'carbon_intensity']
+        assert npz['timestamp'].dtype == np.int64
+        assert np.array_equal(npz['carbon_intensity'], columns['carbon_intensity'], equal_nan=True)
+    pa = pytest.importorskip('pyarrow')
+    table = pa.ipc.open_stream(encode_arrow_ipc(columns)).read_all()
+    assert table.schema.field('timestamp').type == pa.timestamp('s', tz='UTC')
+    assert table.column('carbon_intensity').to_pylist()[0] == 250.
+
+
+def test_negotiate_response_format_from_accept_header(app):
+    def negotiate(accept: str, requested_format: str = None) -> str:
+        with app.test_request_context(headers={'Accept': accept}):
+            app.preprocess_request()
+            return negotiate_response_format(requested_format)
+
+    assert negotiate('*/*') == 'json'
+    assert negotiate('*/*', 'csv') == 'csv'
+    assert negotiate('application/vnd.apache.arrow.stream') == 'arrow'
+    assert negotiate('application/json;q=0.5, application/x-npz') == 'npz'
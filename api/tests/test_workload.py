@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta, timezone
+import marshmallow_dataclass
+import numpy as np
+
+from api.models.workload import DetailLevel, ScheduleType, Workload, WorkloadSchedule
+
+
+def load_workload(schedule_type: ScheduleType, interval: timedelta = None, seed: int = None) -> Workload:
+    schedule = {
+        'type': schedule_type.value,
+        'start_time': '2022-07-28T20:40:52-07:00',
+        'interval': interval.total_seconds() if interval else None,
+    }
+    if seed is not None:
+        schedule['seed'] = seed
+    return marshmallow_dataclass.class_schema(Workload)().load({
+        'runtime': timedelta(minutes=10).total_seconds(),
+        'schedule': schedule,
+        'dataset': {'input_size_gb': 0, 'output_size_gb': 0},
+        'candidate_providers': ['AWS'],
+    })
+
+
+def test_running_starts_onetime():
+    workload = load_workload(ScheduleType.ONETIME)
+    run_starts = workload.get_running_starts_in_24h()
+    assert run_starts.dtype.kind == 'M'
+    assert run_starts.tolist() == [datetime(2022, 7, 29, 3, 40, 52)]
+    assert workload.get_running_intervals_in_24h() == [
+        (workload.schedule.start_time, workload.schedule.start_time + timedelta(minutes=10))]
+
+
+def test_running_starts_uniform():
+    workload = load_workload(ScheduleType.UNIFORM_RANDOM, timedelta(minutes=5))
+    run_starts = workload.get_running_starts_in_24h()
+    assert run_starts.size == 288
+    assert np.all(np.diff(run_starts) == np.timedelta64(5, 'm'))
+    intervals = workload.get_running_intervals_in_24h()
+    assert intervals[-1][0] == workload.schedule.start_time + timedelta(hours=23, minutes=55)
+    assert intervals[-1][0].tzinfo == workload.schedule.start_time.tzinfo
+
+
+def test_running_starts_poisson_is_reproducible():
+    workload = load_workload(ScheduleType.POISSON, timedelta(minutes=5), seed=42)
+    run_starts = workload.get_running_starts_in_24h()
+    assert np.array_equal(run_starts, workload.get_running_starts_in_24h())
+    assert np.array_equal(run_starts, load_workload(ScheduleType.POISSON, timedelta(minutes=5), seed=42)
+                          .get_running_starts_in_24h())
+    assert np.all(np.diff(run_starts) >= np.timedelta64(0))
+    start_time = np.datetime64(workload.schedule.start_time.astimezone(timezone.utc).replace(tzinfo=None))
+    assert np.all((start_time <= run_starts) & (run_starts < start_time + np.timedelta64(1, 'D')))
+    # 288 arrivals expected on average
+    assert 200 < run_starts.size < 400
+
+
+def test_poisson_seed_is_generated_if_missing():
+    workload = load_workload(ScheduleType.POISSON, timedelta(minutes=5))
+    assert workload.schedule.seed is not None
+    assert len(workload.get_running_intervals_in_24h()) == workload.get_running_starts_in_24h().size
+
+
+def test_poisson_seed_is_generated_without_schema():
+    schedule = WorkloadSchedule(type=ScheduleType.POISSON, start_time=datetime(2022, 7, 28, tzinfo=timezone.utc),
+                                interval=timedelta(minutes=5))
+    assert schedule.seed is not None
+    workload = Workload(runtime=timedelta(minutes=10), schedule=schedule, dataset=None, original_location=None)
+    assert np.array_equal(workload.get_running_starts_in_24h(), workload.get_running_starts_in_24h())
+
+
+def test_details_are_opt_in():
+    assert load_workload(ScheduleType.ONETIME).details == DetailLevel.NONE
@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 
+import atexit
+import bisect
+from collections import OrderedDict
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
 from enum import Enum, IntEnum
+import functools
+import io
+import multiprocessing
+from multiprocessing.pool import Pool
+import os
 import random
-from typing import Any, Callable, Sequence, Union
+import sys
+import threading
+from typing import Any, Callable, ContextManager, Iterator, Sequence, Union
 from datetime import datetime, date, timedelta, time
-from time import sleep
+from time import perf_counter, sleep
 import yaml
 import traceback
 import psycopg2
 import dataclasses
-from flask import current_app
+import numpy as np
+from flask import Flask, Response, current_app, request, stream_with_context
 from json import JSONEncoder
 from flask_caching import Cache
-from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import HTTPException, NotAcceptable
 
 
 simple_cache = Cache(config={
@@ -25,6 +39,114 @@ carbon_data_cache = Cache(config={
     'CACHE_DEFAULT_TIMEOUT': 15*60
 })
 
+# Sessions of the carbon-aware scheduler by workload fingerprint, shared by the gunicorn workers that poll them.
+scheduler_session_cache = Cache(config={
+    'CACHE_TYPE': 'SimpleCache',
+    'CACHE_DEFAULT_TIMEOUT': 15*60
+})
+
+# Balancing authority lookups by quantized GPS coordinate, which never expire.
+ba_lookup_cache = Cache(config={
+    'CACHE_TYPE': 'SimpleCache',
+    'CACHE_DEFAULT_TIMEOUT': 0
+})
+
+DEFAULT_PROCESS_POOL_SIZE = 1 if __debug__ else 8
+DEFAULT_IO_THREAD_POOL_SIZE = 16
+DEFAULT_CARBON_DATA_CACHE_MAX_BYTES = 64 << 20
+# Decimal places of the GPS coordinates in balancing authority lookups, i.e. a grid of about 1.1km.
+DEFAULT_BA_LOOKUP_PRECISION = 2
+
+g_process_pool: Pool | None = None
+g_process_pool_pid: int | None = None
+g_process_pool_lock = threading.Lock()
+
+g_io_thread_pool: ThreadPoolExecutor | None = None
+g_io_thread_pool_pid: int | None = None
+g_io_thread_pool_lock = threading.Lock()
+
+
+# Modules imported once by the fork server, rather than by each pool worker.
+PROCESS_POOL_PRELOAD_MODULES = ['api.routes.carbon_aware_scheduler']
+
+
+def _init_process_pool_worker(config: dict, log_level: int):
+    """Pool workers log via `current_app`, so they need an app context of their own, with the app config."""
+    app = Flask(__name__.split('.')[0])
+    app.config.update(config)
+    app.logger.setLevel(log_level)
+    app.app_context().push()
+
+
+def get_process_pool() -> Pool:
+    """Get the long-lived process pool of the current process, which is created on first use.
+
+        The pool size is configured by `PROCESS_POOL_SIZE` in the app config. A pool inherited from a parent process,
+        e.g. the gunicorn master, is not usable and a new one is created instead.
+
+        The workers are started by a fork server rather than forked from the current process, where the I/O and
+        database threads may hold locks at the time of the fork, which would never be released in the workers.
+    """
+    global g_process_pool, g_process_pool_pid
+    with g_process_pool_lock:
+        if g_process_pool is None or g_process_pool_pid != os.getpid():
+            app = current_app._get_current_object()
+            pool_size = app.config.get('PROCESS_POOL_SIZE', DEFAULT_PROCESS_POOL_SIZE)
+            app.logger.info(f'Creating process pool of size {pool_size} in process {os.getpid()}')
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(PROCESS_POOL_PRELOAD_MODULES)
+            g_process_pool = context.Pool(pool_size, initializer=_init_process_pool_worker,
+                                          initargs=(dict(app.config), app.logger.getEffectiveLevel()))
+            g_process_pool_pid = os.getpid()
+        return g_process_pool
+
+
+@atexit.register
+def shutdown_process_pool():
+    """Wait for the pending tasks and shut down the process pool, if it's created by the current process."""
+    global g_process_pool, g_process_pool_pid
+    with g_process_pool_lock:
+        if g_process_pool is not None and g_process_pool_pid == os.getpid():
+            g_process_pool.close()
+            g_process_pool.join()
+        g_process_pool = None
+        g_process_pool_pid = None
+
+
+def _init_io_thread_pool_worker(app: Flask):
+    """Threads don't inherit the app context of the request, so each worker thread pushes its own."""
+    app.app_context().push()
+
+
+def get_io_thread_pool() -> ThreadPoolExecutor:
+    """Get the bounded thread pool of the current process for I/O-bound tasks, e.g. database and HTTP lookups.
+
+        Tasks run in the request process, so results memoized in `simple_cache` and `carbon_data_cache` are kept for
+        later requests. The pool size is configured by `IO_THREAD_POOL_SIZE` in the app config.
+    """
+    global g_io_thread_pool, g_io_thread_pool_pid
+    with g_io_thread_pool_lock:
+        if g_io_thread_pool is None or g_io_thread_pool_pid != os.getpid():
+            app = current_app._get_current_object()
+            pool_size = app.config.get('IO_THREAD_POOL_SIZE', DEFAULT_IO_THREAD_POOL_SIZE)
+            app.logger.info(f'Creating I/O thread pool of size {pool_size} in process {os.getpid()}')
+            g_io_thread_pool = ThreadPoolExecutor(pool_size, thread_name_prefix='io',
+                                                  initializer=_init_io_thread_pool_worker, initargs=(app,))
+            g_io_thread_pool_pid = os.getpid()
+        return g_io_thread_pool
+
+
+@atexit.register
+def shutdown_io_thread_pool():
+    """Wait for the pending tasks and shut down the I/O thread pool, if it's created by the current process."""
+    global g_io_thread_pool, g_io_thread_pool_pid
+    with g_io_thread_pool_lock:
+        if g_io_thread_pool is not None and g_io_thread_pool_pid == os.getpid():
+            g_io_thread_pool.shutdown(wait=True)
+        g_io_thread_pool = None
+        g_io_thread_pool_pid = None
+
+
 def load_yaml_data(filepath):
     with open(filepath, 'r') as f:
         try:
@@ -72,16 +194,419 @@ class CustomHTTPException(HTTPException):
             self.code = code
 
 
-def get_psql_connection(host='/var/run/postgresql/', database="electricity-data") -> psycopg2.extensions.connection:
-    """Get a new postgresql connection."""
-    try:
-        conn = psycopg2.connect(host=host, database=database, user="restapi_ro")
-        conn.autocommit = True
-        return conn
-    except Exception as e:
-        current_app.logger.fatal(f"get_psql_connection: {e}")
-        current_app.logger.fatal(traceback.format_exc())
-        raise PSqlExecuteException("Failed to connect to database.")
+@dataclasses.dataclass(eq=False)
+class _TimeSeriesSegment:
+    """A contiguous piece of a time series that covers the query range [start, end]."""
+    start: datetime
+    end: datetime
+    timestamps: list[datetime]
+    points: list[dict]
+    expires_at: float
+    size: int
+
+
+class TimeSeriesRangeCache:
+    """A per-process cache of time series fetched by time range, which serves any sub-range of the cached ranges.
+
+        Each cached function is called as `f(region, start, end, *args)` and returns the points in [start, end] as dicts
+        ordered by 'timestamp', including the points right before start and right after end if the range lies in between
+        two timestamps. Overlapping results of the same `(region, *args)` are merged into one segment, so that a
+        contained range is answered by slicing and a partially cached range only fetches the missing gaps.
+        Segments expire after `CARBON_DATA_CACHE_TIMEOUT` seconds and the least recently used ones are evicted when
+        their estimated size exceeds `CARBON_DATA_CACHE_MAX_BYTES`.
+
+        With a `shared_cache`, e.g. an SQLite or Redis backed `Cache` shared by all gunicorn workers, the segments of
+        each key are also stored there after every fetch, and looked up there before fetching.
+
+        The returned points are shared between callers and must not be modified.
+    """
+    def __init__(self, timeout: float = 15*60, max_bytes: int = DEFAULT_CARBON_DATA_CACHE_MAX_BYTES):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.d_segments: dict[tuple, list[_TimeSeriesSegment]] = {}
+        self.lru: OrderedDict[_TimeSeriesSegment, tuple] = OrderedDict()
+        self.total_size = 0
+        self.shared_cache: Cache | None = None
+        self.metrics = {
+            'hits': 0,
+            'shared_hits': 0,
+            'partial_hits': 0,
+            'misses': 0,
+            'fallbacks': 0,
+            'evictions': 0,
+        }
+
+    def init_app(self, app: Flask, shared_cache: Cache | None = None):
+        self.timeout = app.config.get('CARBON_DATA_CACHE_TIMEOUT', self.timeout)
+        self.max_bytes = app.config.get('CARBON_DATA_CACHE_MAX_BYTES', self.max_bytes)
+        self.shared_cache = shared_cache
+
+    def clear(self):
+        with self.lock:
+            self.d_segments.clear()
+            self.lru.clear()
+            self.total_size = 0
+
+    @staticmethod
+    def _estimate_size(points: list[dict]) -> int:
+        """Estimate the size of the points and the timestamp index from the first point."""
+        point_size = sys.getsizeof(points[0]) + sum(sys.getsizeof(value) for value in points[0].values())
+        return 2 * sys.getsizeof(points) + len(points) * point_size
+
+    def _remove(self, key: tuple, segment: _TimeSeriesSegment):
+        self.d_segments[key].remove(segment)
+        if not self.d_segments[key]:
+            del self.d_segments[key]
+        del self.lru[segment]
+        self.total_size -= segment.size
+
+    def _get_overlapping_segments(self, key: tuple, start: datetime, end: datetime) -> list[_TimeSeriesSegment]:
+        """Get the unexpired segments that overlap or touch [start, end], ordered by start."""
+        now = datetime.now().timestamp()
+        l_segments = []
+        for segment in list(self.d_segments.get(key, [])):
+            if segment.expires_at <= now:
+                self._remove(key, segment)
+            elif segment.start <= end and start <= segment.end:
+                l_segments.append(segment)
+        return l_segments
+
+    @staticmethod
+    def _slice(segment: _TimeSeriesSegment, start: datetime, end: datetime) -> list[dict] | None:
+        """Slice [start, end] out of the segment, or None if the data source would reject the range.
+
+            The data source raises an error for a range entirely before its first or after its last timestamp, so such
+            ranges are not served from the cache.
+        """
+        if start > segment.timestamps[-1] or end < segment.timestamps[0]:
+            return None
+        i_start = max(bisect.bisect_right(segment.timestamps, start) - 1, 0)
+        i_end = min(bisect.bisect_left(segment.timestamps, end), len(segment.timestamps) - 1)
+        return segment.points[i_start:i_end + 1]
+
+    def _get_missing_ranges(self, l_segments: list[_TimeSeriesSegment],
+                            start: datetime, end: datetime) -> list[tuple[datetime, datetime]]:
+        l_missing_ranges = []
+        for segment in l_segments:
+            if start < segment.start:
+                l_missing_ranges.append((start, segment.start))
+            start = max(start, segment.end)
+        if start < end or not l_segments:
+            l_missing_ranges.append((start, end))
+        return l_missing_ranges
+
+    def _merge(self, key: tuple, l_fetched: list[tuple[datetime, datetime, list[dict]]],
+               expires_at: float | None = None) -> None:
+        """Merge the fetched ranges with the overlapping cached segments of the same key.
+
+            A fetched range ending after its last point, i.e. after the latest available data, only covers up to that
+            point, so that the data loaded later is fetched rather than served as missing.
+        """
+        l_fetched = [(start, min(end, points[-1]['timestamp']), points) for (start, end, points) in l_fetched if points]
+        if not l_fetched:
+            return
+        start = min(fetched_start for (fetched_start, _, _) in l_fetched)
+        end = max(fetched_end for (_, fetched_end, _) in l_fetched)
+        if expires_at is None:
+            expires_at = datetime.now().timestamp() + self.timeout
+        d_points_by_timestamp: dict[datetime, dict] = {}
+        with self.lock:
+            for segment in self._get_overlapping_segments(key, start, end):
+                start = min(start, segment.start)
+                end = max(end, segment.end)
+                expires_at = min(expires_at, segment.expires_at)
+                for point in segment.points:
+                    d_points_by_timestamp[point['timestamp']] = point
+                self._remove(key, segment)
+            # Newly fetched points take precedence over the cached ones.
+            for (_, _, points) in l_fetched:
+                for point in points:
+                    d_points_by_timestamp[point['timestamp']] = point
+            timestamps = sorted(d_points_by_timestamp)
+            points = [d_points_by_timestamp[timestamp] for timestamp in timestamps]
+            segment = _TimeSeriesSegment(start, end, timestamps, points, expires_at, self._estimate_size(points))
+            l_segments = self.d_segments.setdefault(key, [])
+            l_segments.insert(bisect.bisect([s.start for s in l_segments], start), segment)
+            self.lru[segment] = key
+            self.total_size += segment.size
+            while self.total_size > self.max_bytes and len(self.lru) > 1:
+                (lru_segment, lru_key) = next(iter(self.lru.items()))
+                self._remove(lru_key, lru_segment)
+                self.metrics['evictions'] += 1
+
+    @staticmethod
+    def _get_shared_key(key: tuple) -> str:
+        return 'range:' + repr(key)
+
+    def _load_shared(self, key: tuple) -> bool:
+        """Merge the unexpired segments of the key in the shared cache, and return whether there are any."""
+        try:
+            l_shared_segments = self.shared_cache.get(self._get_shared_key(key)) or []
+        except Exception as e:
+            current_app.logger.warning(f'TimeSeriesRangeCache: failed to read from shared cache: {e}')
+            return False
+        now = datetime.now().timestamp()
+        l_shared_segments = [segment for segment in l_shared_segments if segment[3] > now]
+        for (start, end, points, expires_at) in l_shared_segments:
+            self._merge(key, [(start, end, points)], expires_at)
+        return len(l_shared_segments) > 0
+
+    def _store_shared(self, key: tuple):
+        """Replace the segments of the key in the shared cache with the local ones, which include them."""
+        with self.lock:
+            l_segments = [(segment.start, segment.end, segment.points, segment.expires_at)
+                          for segment in self.d_segments.get(key, [])]
+        try:
+            self.shared_cache.set(self._get_shared_key(key), l_segments, timeout=self.timeout)
+        except Exception as e:
+            current_app.logger.warning(f'TimeSeriesRangeCache: failed to write to shared cache: {e}')
+
+    def _lookup(self, key: tuple, start: datetime, end: datetime) -> \
+            tuple[list[dict] | None, list[tuple[datetime, datetime]]]:
+        """Get the cached result if [start, end] is covered by one segment, otherwise the missing ranges."""
+        with self.lock:
+            l_segments = self._get_overlapping_segments(key, start, end)
+            for segment in l_segments:
+                if segment.start <= start and end <= segment.end:
+                    self.lru.move_to_end(segment)
+                    return self._slice(segment, start, end), []
+            return None, self._get_missing_ranges(l_segments, start, end)
+
+    def _lookup_with_shared(self, key: tuple, start: datetime, end: datetime) -> \
+            tuple[list[dict] | None, list[tuple[datetime, datetime]]]:
+        """Like `_lookup()`, but also looks up the shared cache on a local miss, and counts the hits."""
+        (result, l_missing_ranges) = self._lookup(key, start, end)
+        if result is not None:
+            with self.lock:
+                self.metrics['hits'] += 1
+            return result, []
+        if self.shared_cache is not None and self._load_shared(key):
+            (result, l_missing_ranges) = self._lookup(key, start, end)
+            if result is not None:
+                with self.lock:
+                    self.metrics['shared_hits'] += 1
+        return result, l_missing_ranges
+
+    def memoize(self) -> Callable:
+        """Decorate `f(region, start, end, *args)`, which fetches a time series in [start, end]."""
+        def decorator(f: Callable[..., list[dict]]) -> Callable[..., list[dict]]:
+            @functools.wraps(f)
+            def wrapper(region: str, start: datetime, end: datetime, *args):
+                if start.tzinfo is None or end.tzinfo is None or start > end:
+                    return f(region, start, end, *args)
+                key = (f.__module__, f.__qualname__, region, *args)
+                (result, l_missing_ranges) = self._lookup_with_shared(key, start, end)
+                if result is not None:
+                    return result
+                if l_missing_ranges and l_missing_ranges != [(start, end)]:
+                    try:
+                        self._merge(key, [(missing_start, missing_end, f(region, missing_start, missing_end, *args))
+                                          for (missing_start, missing_end) in l_missing_ranges])
+                        if self.shared_cache is not None:
+                            self._store_shared(key)
+                        (result, _) = self._lookup(key, start, end)
+                    except Exception:
+                        # e.g. a gap after the last available timestamp, which is valid as part of the whole range.
+                        result = None
+                    with self.lock:
+                        self.metrics['partial_hits' if result is not None else 'fallbacks'] += 1
+                    if result is not None:
+                        return result
+                else:
+                    with self.lock:
+                        self.metrics['misses'] += 1
+                result = f(region, start, end, *args)
+                self._merge(key, [(start, end, result)])
+                if self.shared_cache is not None:
+                    self._store_shared(key)
+                return result
+            return wrapper
+        return decorator
+
+    def memoize_many(self, f_memoized: Callable) -> Callable:
+        """Decorate `f_many(l_requests)`, the batch version of `f_memoized` that is decorated by `memoize()`.
+
+            Each request is a tuple `(region, start, end, *args)` of `f_memoized`, and `f_many` returns the result of
+            each request in order, or its exception. Requests are answered from the segments of `f_memoized` where
+            possible, and the rest are fetched in one call of `f_many`, whose results are merged into the segments.
+        """
+        def decorator(f_many: Callable[[list[tuple]], list[list[dict] | Exception]]) -> \
+                Callable[[list[tuple]], list[list[dict] | Exception]]:
+            @functools.wraps(f_many)
+            def wrapper(l_requests: list[tuple]) -> list[list[dict] | Exception]:
+                l_results: list[list[dict] | Exception | None] = [None] * len(l_requests)
+                l_missed = []
+                for (i, (region, start, end, *args)) in enumerate(l_requests):
+                    if start.tzinfo is None or end.tzinfo is None or start > end:
+                        l_missed.append(i)
+                        continue
+                    key = (f_memoized.__module__, f_memoized.__qualname__, region, *args)
+                    (l_results[i], _) = self._lookup_with_shared(key, start, end)
+                    if l_results[i] is None:
+                        l_missed.append(i)
+                if not l_missed:
+                    return l_results
+                with self.lock:
+                    self.metrics['misses'] += len(l_missed)
+                l_fetched = f_many([l_requests[i] for i in l_missed])
+                s_fetched_keys = set()
+                for (i, result) in zip(l_missed, l_fetched):
+                    l_results[i] = result
+                    (region, start, end, *args) = l_requests[i]
+                    if not isinstance(result, Exception) and start.tzinfo is not None and end.tzinfo is not None:
+                        key = (f_memoized.__module__, f_memoized.__qualname__, region, *args)
+                        # Ranges are merged one by one, as they may not be contiguous.
+                        self._merge(key, [(start, end, result)])
+                        s_fetched_keys.add(key)
+                if self.shared_cache is not None:
+                    for key in s_fetched_keys:
+                        self._store_shared(key)
+                return l_results
+            return wrapper
+        return decorator
+
+    def get_metrics(self) -> dict[str, Any]:
+        with self.lock:
+            return self.metrics | {'segments': len(self.lru), 'bytes': self.total_size, 'max_bytes': self.max_bytes}
+
+
+carbon_data_range_cache = TimeSeriesRangeCache()
+
+
+class PSqlConnectionPool:
+    """A thread-safe pool of postgresql connections, which waits for a free connection when all are in use.
+
+        Connections are opened on demand and checked out with `connection()`. Broken connections are discarded on
+        return, and connections that have been idle for a while are checked before reuse. Usage statistics are reported
+        by `get_metrics()`.
+    """
+    # Idle connections may have been closed by the server in the meantime.
+    HEALTH_CHECK_IDLE_SECONDS = 30
+
+    def __init__(self, size: int, host='/var/run/postgresql/', database="electricity-data", user="restapi_ro"):
+        self.size = size
+        self.connect_kwargs = dict(host=host, database=database, user=user)
+        self.pid = os.getpid()
+        self.semaphore = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        # Idle connections and when they were returned, used in LIFO order.
+        self.idle_connections: list[tuple[psycopg2.extensions.connection, float]] = []
+        self.metrics = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'connections_discarded': 0,
+            'in_use': 0,
+            'wait_seconds_total': 0.,
+            'wait_seconds_max': 0.,
+        }
+
+    @staticmethod
+    def _is_healthy(conn: psycopg2.extensions.connection) -> bool:
+        return not conn.closed and \
+            conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    @staticmethod
+    def _ping(conn: psycopg2.extensions.connection) -> bool:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: psycopg2.extensions.connection):
+        with self.lock:
+            self.metrics['connections_discarded'] += 1
+        conn.close()
+
+    def _getconn(self) -> psycopg2.extensions.connection:
+        while True:
+            with self.lock:
+                (conn, idle_since) = self.idle_connections.pop() if self.idle_connections else (None, None)
+            if conn is None:
+                conn = psycopg2.connect(**self.connect_kwargs)
+                conn.autocommit = True
+                with self.lock:
+                    self.metrics['connections_created'] += 1
+                return conn
+            if self._is_healthy(conn) and \
+                    (perf_counter() - idle_since < self.HEALTH_CHECK_IDLE_SECONDS or self._ping(conn)):
+                with self.lock:
+                    self.metrics['connections_reused'] += 1
+                return conn
+            self._discard(conn)
+
+    def _putconn(self, conn: psycopg2.extensions.connection):
+        if self._is_healthy(conn):
+            with self.lock:
+                self.idle_connections.append((conn, perf_counter()))
+        else:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        wait_start = perf_counter()
+        self.semaphore.acquire()
+        wait_seconds = perf_counter() - wait_start
+        with self.lock:
+            self.metrics['checkouts'] += 1
+            self.metrics['in_use'] += 1
+            self.metrics['wait_seconds_total'] += wait_seconds
+            self.metrics['wait_seconds_max'] = max(self.metrics['wait_seconds_max'], wait_seconds)
+        try:
+            try:
+                conn = self._getconn()
+            except psycopg2.Error as e:
+                current_app.logger.fatal(f"PSqlConnectionPool.connection: {e}")
+                current_app.logger.fatal(traceback.format_exc())
+                raise PSqlExecuteException("Failed to connect to database.")
+            try:
+                yield conn
+            finally:
+                self._putconn(conn)
+        finally:
+            with self.lock:
+                self.metrics['in_use'] -= 1
+            self.semaphore.release()
+
+    def get_metrics(self) -> dict[str, Any]:
+        with self.lock:
+            return self.metrics | {'size': self.size, 'idle': len(self.idle_connections)}
+
+
+DEFAULT_PSQL_POOL_SIZE = 8
+
+g_psql_pool: PSqlConnectionPool | None = None
+g_psql_pool_lock = threading.Lock()
+# Pools inherited from a parent process are kept alive but never used, because closing their connections would also
+# close the connections of the parent.
+g_inherited_psql_pools: list[PSqlConnectionPool] = []
+
+
+def get_psql_pool() -> PSqlConnectionPool:
+    """Get the postgresql connection pool of the current process, which is created on first use.
+
+        The pool size is configured by `PSQL_POOL_SIZE` in the app config.
+    """
+    global g_psql_pool
+    with g_psql_pool_lock:
+        if g_psql_pool is not None and g_psql_pool.pid != os.getpid():
+            g_inherited_psql_pools.append(g_psql_pool)
+            g_psql_pool = None
+        if g_psql_pool is None:
+            pool_size = current_app.config.get('PSQL_POOL_SIZE', DEFAULT_PSQL_POOL_SIZE)
+            g_psql_pool = PSqlConnectionPool(pool_size)
+        return g_psql_pool
+
+
+def psql_connection() -> ContextManager[psycopg2.extensions.connection]:
+    """Check out a postgresql connection from the pool of the current process, e.g. `with psql_connection() as conn`.
+
+        The connection is in autocommit mode and is returned to the pool at the end of the `with` block.
+    """
+    return get_psql_pool().connection()
 
 
 def psql_execute_scalar(cursor: psycopg2.extensions.cursor, query: str, args: Sequence[Any] = None) -> Any | None:
@@ -109,6 +634,162 @@ def psql_execute_list(cursor: psycopg2.extensions.cursor, query: str,
     return result
 
 
+DEFAULT_PSQL_ITERSIZE = 2000
+
+
+def psql_execute_iter(conn: psycopg2.extensions.connection, query: str,
+                      args: Union[Sequence[Any], dict[str, str]] = None,
+                      itersize: int = DEFAULT_PSQL_ITERSIZE) -> Iterator[tuple]:
+    """Execute the psql query with a server-side cursor, and yield the rows while fetching `itersize` at a time.
+
+        Server-side cursors only live in a transaction, so the connection leaves autocommit mode until the rows are
+        exhausted or the generator is closed, and must not be used for anything else in the meantime.
+    """
+    conn.autocommit = False
+    try:
+        with conn.cursor(name='psql_execute_iter') as cursor:
+            cursor.itersize = itersize
+            try:
+                cursor.execute(query, args)
+            except psycopg2.Error as e:
+                current_app.logger.error(f'psql_execute_iter("{query}", {args}): {e}')
+                current_app.logger.error(traceback.format_exc())
+                raise PSqlExecuteException("Failed to execute SQL query.")
+            yield from cursor
+    finally:
+        try:
+            conn.rollback()
+            conn.autocommit = True
+        except psycopg2.Error:
+            # The connection is broken and will be discarded by the pool.
+            pass
+
+
+def iter_eagerly(iterator: Iterator) -> Iterator:
+    """Advance the iterator to its first item now, so that its errors, e.g. of request validation, are raised before
+        a streaming response starts, and return an iterator of all items."""
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return iter([])
+
+    def generate():
+        try:
+            yield first
+            yield from iterator
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+    return generate()
+
+
+def stream_ndjson(records: Iterator[dict], lines_per_chunk: int = 1000) -> Iterator[str]:
+    """Serialize the records as newline-delimited JSON, in chunks of lines."""
+    encoder = CustomJSONEncoder()
+    lines = []
+    for record in records:
+        lines.append(encoder.encode(record))
+        if len(lines) >= lines_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_csv(records: Iterator[dict], rows_per_chunk: int = 1000) -> Iterator[str]:
+    """Serialize the records as CSV with a header of the keys of the first record, in chunks of rows.
+
+        Datetimes are in ISO 8601 format.
+    """
+    buffer = io.StringIO()
+    writer = None
+    num_rows = 0
+    for record in records:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(record.keys()), lineterminator='\n')
+            writer.writeheader()
+        writer.writerow({key: value.isoformat() if isinstance(value, (datetime, date)) else value
+                         for (key, value) in record.items()})
+        num_rows += 1
+        if num_rows % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell() > 0:
+        yield buffer.getvalue()
+
+
+STREAMING_FORMATS: dict[str, tuple[Callable[[Iterator[dict]], Iterator[str]], str]] = {
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+    'csv': (stream_csv, 'text/csv'),
+}
+
+
+def make_streaming_response(records: Iterator[dict], response_format: str,
+                            headers: dict[str, str] = None) -> Response:
+    """Stream the records in the response format, i.e. 'ndjson' or 'csv', in chunks as they are produced.
+
+        The records are advanced to the first one before the response starts, so that errors like an unknown region
+        are still returned with their HTTP status.
+    """
+    (serialize, mimetype) = STREAMING_FORMATS[response_format]
+    return Response(stream_with_context(serialize(iter_eagerly(records))), mimetype=mimetype, headers=headers)
+
+
+def encode_npz(columns: dict[str, np.ndarray]) -> bytes:
+    """Serialize the columns as an uncompressed NumPy `.npz` archive, with one array per column."""
+    buffer = io.BytesIO()
+    np.savez(buffer, **columns)
+    return buffer.getvalue()
+
+
+def encode_arrow_ipc(columns: dict[str, np.ndarray]) -> bytes:
+    """Serialize the columns as an Apache Arrow IPC stream, which requires the optional `pyarrow` package.
+
+        The 'timestamp' column of seconds since the UNIX epoch has the Arrow type `timestamp[s, tz=UTC]`.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise NotAcceptable('Arrow IPC format is not available, as pyarrow is not installed.')
+    table = pa.table({name: pa.array(values, type=pa.timestamp('s', tz='UTC')) if name == 'timestamp' else values
+                      for (name, values) in columns.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+COLUMNAR_FORMATS: dict[str, tuple[Callable[[dict[str, np.ndarray]], bytes], str]] = {
+    'arrow': (encode_arrow_ipc, 'application/vnd.apache.arrow.stream'),
+    'npz': (encode_npz, 'application/x-npz'),
+}
+
+RESPONSE_FORMAT_MIMETYPES: dict[str, str] = {
+    'json': 'application/json',
+} | {response_format: mimetype for (response_format, (_, mimetype)) in STREAMING_FORMATS.items()} \
+  | {response_format: mimetype for (response_format, (_, mimetype)) in COLUMNAR_FORMATS.items()}
+
+
+def negotiate_response_format(requested_format: str | None) -> str:
+    """Get the response format, i.e. the requested one if set, or otherwise the best match of the Accept header.
+
+        JSON is preferred if the Accept header allows several formats, e.g. "*/*".
+    """
+    if requested_format:
+        return requested_format
+    mimetype = request.accept_mimetypes.best_match(RESPONSE_FORMAT_MIMETYPES.values(), default='application/json')
+    return next(response_format for (response_format, format_mimetype) in RESPONSE_FORMAT_MIMETYPES.items()
+                if format_mimetype == mimetype)
+
+
+def make_columnar_response(columns: dict[str, np.ndarray], response_format: str,
+                           headers: dict[str, str] = None) -> Response:
+    """Serialize the columns in the columnar response format, i.e. 'arrow' or 'npz'."""
+    (encode, mimetype) = COLUMNAR_FORMATS[response_format]
+    return Response(encode(columns), mimetype=mimetype, headers=headers)
+
+
 def get_all_enum_values(enum_type):
     """Get all values of a particular Enum type."""
     return [e.value for e in enum_type]
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import io
+import math
+import os
 import sys
+import threading
 import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import date, datetime, timedelta, time
 import parsers.US_MISO
 import parsers.US_PJM
@@ -17,6 +22,9 @@ from dateutil import tz
 import arrow
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+import requests
+import requests.adapters
 import argparse
 
 map_regions = {
@@ -115,6 +123,13 @@ MAP_OVERRIDE_FETCHFNS = {
 }
 OVERRIDE_DATA_SOURCES = MAP_OVERRIDE_FETCHFNS.keys()
 
+DEFAULT_REGION_TIMEOUT = timedelta(seconds=50)
+# Of a whole run that is not a backfill, which is less than the one-minute interval of the cron job so that runs don't
+#   overlap.
+MAX_RUN_TIME = timedelta(seconds=55)
+# Of each HTTP request of the parsers, so that a hung source fails on its own even without a deadline.
+DEFAULT_REQUEST_TIMEOUT = timedelta(seconds=30)
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-B', '--backfill', action='store_true', help='Run backfill')
 parser.add_argument('-D', '--days-for-backfill', type=int, help='Number of days to run backfill for')
@@ -126,15 +141,20 @@ parser.add_argument('-R', '--regions', nargs='+', choices=map_regions.keys(), he
 parser.add_argument('-N', '--dry-run', action='store_true', help='Only pull data but do not write to database')
 parser.add_argument('-F', '--force', action='store_true', help='Force pulling new data and ignore last updated')
 parser.add_argument('--override-data-source', choices=OVERRIDE_DATA_SOURCES, help='Override the crawler data source')
+parser.add_argument('-W', '--workers', type=int, default=4, help='Number of regions to crawl concurrently')
+parser.add_argument('-T', '--timeout', type=float,
+                    help='Timeout in seconds of each region, after which the run stops waiting for it '
+                         '(default: %.0f, or none for backfill)' % DEFAULT_REGION_TIMEOUT.total_seconds())
 args = parser.parse_args()
 
 
-def get_db_connection(host='/var/run/postgresql/', database="electricity-data"):
+def get_db_connection_pool(max_connections: int, host='/var/run/postgresql/', database="electricity-data"):
+    """Get a pool of up to one connection per worker, which are opened when first used."""
     try:
-        conn = psycopg2.connect(host=host, database=database, user="crawler_rw")
-        return conn
+        return psycopg2.pool.ThreadedConnectionPool(0, max_connections,
+                                                    host=host, database=database, user="crawler_rw")
     except Exception as ex:
-        raise ValueError("Failed to connect to database.") from ex
+        raise ValueError("Failed to create database connection pool.") from ex
 
 
 def get_last_updated(conn, region):
@@ -168,7 +188,7 @@ def is_in_scheduled_downtime(region: str, e: Exception):
     return False
 
 
-def fetch_new_data(region, target_datetime: datetime = None):
+def fetch_new_data(region, session: requests.Session, target_datetime: datetime = None):
     fetch_fn = map_regions[region]['fetchFn']
     l_result = []
     if not args.backfill and map_regions[region]['fetchCurrentData']:
@@ -184,7 +204,7 @@ def fetch_new_data(region, target_datetime: datetime = None):
     if args.override_data_source:
         fetch_fn = MAP_OVERRIDE_FETCHFNS[args.override_data_source]
     try:
-        l_data = fetch_fn(zone_key=region, target_datetime=target_datetime)
+        l_data = fetch_fn(zone_key=region, session=session, target_datetime=target_datetime)
         if not map_regions[region]['fetchResultIsList'] and not args.override_data_source:
             l_data = [l_data]
     except Exception as e:
@@ -231,6 +251,20 @@ def upload_new_data(conn, region, timestamp, d_power_mw_by_category):
                 rows,
                 fetch=True
             )
+            # Keep the materialized carbon intensity of this timestamp in sync, in the same transaction.
+            cur.execute(
+                """INSERT INTO CarbonIntensityByRenewableMaterialized
+                        (DateTime, Region, Renewable_CarbonIntensity, NonRenewable_CarbonIntensity, Renewable_Ratio)
+                    SELECT DateTime, Region, Renewable_CarbonIntensity, NonRenewable_CarbonIntensity, Renewable_Ratio
+                        FROM CarbonIntensityByRenewable
+                        WHERE Region = %s AND DateTime = %s
+                    ON CONFLICT ON CONSTRAINT carbonintensitybyrenewablematerialized_unique_region_datetime
+                    DO UPDATE SET Renewable_CarbonIntensity = EXCLUDED.Renewable_CarbonIntensity,
+                                  NonRenewable_CarbonIntensity = EXCLUDED.NonRenewable_CarbonIntensity,
+                                  Renewable_Ratio = EXCLUDED.Renewable_Ratio;
+                """,
+                [region, timestamp]
+            )
         except psycopg2.Error as ex:
             raise ValueError ("Failed to upload new data") from ex
     (count_all, count_insert, count_update) = result[0]
@@ -239,23 +273,23 @@ def upload_new_data(conn, region, timestamp, d_power_mw_by_category):
     return (count_insert, count_update)
 
 
-def fetch_and_update(conn, region, run_timestamp):
+def fetch_and_update(conn, session, region, run_timestamp):
     if args.backfill:
         l_result = []
         if args.days_for_backfill:
             for date_offset in range(args.days_for_backfill):
                 target_date = arrow.get().shift(days=-1 - date_offset).datetime
-                l_result += fetch_new_data(region, target_datetime=target_date)
+                l_result += fetch_new_data(region, session, target_datetime=target_date)
         elif args.backfill_begin_date and args.backfill_end_date:
             backfill_current_date = arrow.get(args.backfill_begin_date)
             backfill_end_date = arrow.get(args.backfill_end_date)
             while backfill_current_date <= backfill_end_date:
-                l_result += fetch_new_data(region, target_datetime=backfill_current_date.datetime)
+                l_result += fetch_new_data(region, session, target_datetime=backfill_current_date.datetime)
                 backfill_current_date = backfill_current_date.shift(days=1)
         else:
             raise NotImplementedError()
     else:
-        l_result = fetch_new_data(region)
+        l_result = fetch_new_data(region, session)
     if args.dry_run:
         print('Dry run mode on. Not updating database ...')
     else:
@@ -280,14 +314,92 @@ def should_run_now(conn, region, run_timestamp):
     return delta_since_last_update > map_regions[region]['updateFrequency']
 
 
-def crawl_region(conn, region):
-    print(f'Region: {region}')
+def crawl_region(conn, session, region):
     run_timestamp = datetime.now()
     if args.backfill or args.force:
-        fetch_and_update(conn, region, run_timestamp)
+        fetch_and_update(conn, session, region, run_timestamp)
     else:
         if should_run_now(conn, region, run_timestamp):
-            fetch_and_update(conn, region, run_timestamp)
+            fetch_and_update(conn, session, region, run_timestamp)
+
+
+class RegionOutput(io.TextIOBase):
+    """Stdout that buffers the output of each crawler worker, so that the logs of regions crawled concurrently
+        are printed one region at a time rather than interleaved."""
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.d_buffers: dict[str, io.StringIO] = {}
+
+    def start(self, region: str):
+        self.local.region = region
+        with self.lock:
+            self.d_buffers[region] = io.StringIO()
+
+    def finish(self) -> str:
+        region = self.local.region
+        del self.local.region
+        return self.get(region)
+
+    def get(self, region: str) -> str:
+        with self.lock:
+            return self.d_buffers[region].getvalue()
+
+    def write(self, s: str) -> int:
+        region = getattr(self.local, 'region', None)
+        if region is None:
+            return self.stdout.write(s)
+        with self.lock:
+            return self.d_buffers[region].write(s)
+
+    def flush(self):
+        self.stdout.flush()
+
+
+region_output = RegionOutput(sys.stdout)
+
+
+class TimeoutHTTPAdapter(requests.adapters.HTTPAdapter):
+    """A TransportAdapter that sets a timeout on the requests without one, as the parsers don't set any."""
+    def __init__(self, timeout: float, *args, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_http_session(timeout: timedelta) -> requests.Session:
+    """Get an HTTP session for the parsers, whose requests time out after `timeout`."""
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(timeout.total_seconds())
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def crawl_region_in_worker(pool, region, request_timeout, d_start_times) -> str:
+    """Crawl the region on a pooled connection, and return its buffered output."""
+    region_output.start(region)
+    d_start_times[region] = datetime.now()
+    print(f'Region: {region}')
+    conn = None
+    try:
+        conn = pool.getconn()
+        with get_http_session(request_timeout) as session:
+            crawl_region(conn, session, region)
+    except Exception as ex:
+        print(datetime.now().isoformat(),
+              f"Exception occurred while crawling region {region}: {ex}",
+              file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+    finally:
+        if conn is not None:
+            pool.putconn(conn)
+    return region_output.finish()
 
 
 def crawl_all_regions():
@@ -308,19 +420,59 @@ def crawl_all_regions():
         else:
             raise ValueError("Backfill mode is on, but neither days-for-backfill nor "
                              "(backfill-begin-date and backfill-end-date) is specified.")
-    conn = get_db_connection()
-    for region in map_regions:
-        if args.regions and region not in args.regions:
-            continue
-        try:
-            crawl_region(conn, region)
-        except Exception as ex:
-            print(datetime.now().isoformat(),
-                  f"Exception occurred while crawling region {region}: {ex}",
-                  file=sys.stderr)
-            print(traceback.format_exc(), file=sys.stderr)
-    conn.close()
-
+    l_regions = [region for region in map_regions if not args.regions or region in args.regions]
+    if args.timeout is not None:
+        region_timeout = timedelta(seconds=args.timeout)
+    else:
+        region_timeout = None if args.backfill else DEFAULT_REGION_TIMEOUT
+    request_timeout = min(filter(None, [region_timeout, DEFAULT_REQUEST_TIMEOUT]))
+    run_deadline = None
+    if region_timeout is not None:
+        # Enough for each wave of regions on the workers to run until its timeout.
+        run_time = region_timeout * math.ceil(len(l_regions) / args.workers)
+        run_deadline = datetime.now() + (run_time if args.backfill else min(run_time, MAX_RUN_TIME))
+    pool = get_db_connection_pool(args.workers)
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='crawler')
+    d_start_times: dict[str, datetime] = {}
+    d_futures: dict[Future, str] = {
+        executor.submit(crawl_region_in_worker, pool, region, request_timeout, d_start_times): region
+        for region in l_regions}
+    l_timed_out_regions = []
+    pending = set(d_futures)
+    while pending:
+        (done, pending) = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+        for future in done:
+            print(future.result(), end='', flush=True)
+        now = datetime.now()
+        for future in list(pending):
+            region = d_futures[future]
+            start_time = d_start_times.get(region, None)
+            if run_deadline is not None and now > run_deadline:
+                reason = 'Reached the deadline of the run' if start_time else \
+                    'Not started before the deadline of the run'
+            elif region_timeout is not None and start_time and now - start_time > region_timeout:
+                reason = f'Timed out after {region_timeout.total_seconds():.0f}s'
+            else:
+                continue
+            pending.remove(future)
+            # Regions that are still queued are not started anymore.
+            future.cancel()
+            l_timed_out_regions.append(region)
+            if start_time:
+                print(region_output.get(region), end='')
+            print(now.isoformat(), f"{reason} while crawling region {region}", file=sys.stderr)
+    if l_timed_out_regions:
+        print(f'Timed out regions: {", ".join(l_timed_out_regions)}')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        executor.shutdown(wait=False, cancel_futures=True)
+        pool.closeall()
+        # The hung workers cannot be interrupted, and the interpreter would wait for them at exit, so exit without
+        #   it. Their transactions are rolled back and LastUpdated is left untouched for the next run to retry.
+        os._exit(1)
+    executor.shutdown()
+    pool.closeall()
 
 if __name__ == '__main__':
+    sys.stdout = region_output
     crawl_all_regions()
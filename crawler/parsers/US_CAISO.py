@@ -24,7 +24,8 @@ def fetch_production(zone_key='US-CAISO', session=None, target_datetime=None,
 
     # Get the production from the CSV
     url = f'http://www.caiso.com/outlook/SP/History/{target_date}/fuelsource.csv'
-    response = requests.get(url)
+    s = session or requests.Session()
+    response = s.get(url)
     response.raise_for_status()
     # NOTE: temporary check, as CAISO seems to return 404 HTML page with a 200 status code
     if '404 - Page Not Found' in response.text:
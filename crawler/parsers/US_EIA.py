@@ -123,7 +123,7 @@ def parse_eia_response(response, eia_respondent: str) -> dict:
         production_by_timestamp[timestamp][fuel_type] = power_in_mw
     return production_by_timestamp
 
-def fetch_production(zone_key = 'US-CAISO', target_datetime=None, logger=getLogger(__name__)) -> dict:
+def fetch_production(zone_key = 'US-CAISO', session=None, target_datetime=None, logger=getLogger(__name__)) -> dict:
     """
         Requests the last known production mix (in MW) of a given zone.
         Note: UTC time is used in this EIA API wrapper, so we convert @target_datetime to utc before invoking EIA API.
@@ -133,7 +133,7 @@ def fetch_production(zone_key = 'US-CAISO', target_datetime=None, logger=getLogg
     request_end = target_datetime.shift(days=1).shift(minutes=-1)
 
     eia_respondent = get_eia_v2_region(zone_key)
-    response = get_data_json([eia_respondent], request_start, request_end)
+    response = get_data_json([eia_respondent], request_start, request_end, session=session)
     production_by_timestamp = parse_eia_response(response, eia_respondent)
     data = []
     for timestamp, production in production_by_timestamp.items():
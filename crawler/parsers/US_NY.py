@@ -6,10 +6,12 @@
 from collections import defaultdict
 from datetime import timedelta
 from operator import itemgetter
-from urllib.error import HTTPError
+from io import StringIO
 
 import arrow
 import pandas as pd
+import requests
+from requests.exceptions import HTTPError
 
 # Dual Fuel systems can run either Natural Gas or Oil, they represent
 # significantly more capacity in NY State than plants that can only
@@ -33,10 +35,13 @@ mapping = {
 }
 
 
-def read_csv_data(url):
+def read_csv_data(url, session=None):
     """Gets csv data from a url and returns a dataframe."""
 
-    csv_data = pd.read_csv(url)
+    s = session or requests.Session()
+    req = s.get(url)
+    req.raise_for_status()
+    csv_data = pd.read_csv(StringIO(req.text))
 
     return csv_data
 
@@ -105,7 +110,7 @@ def fetch_production(zone_key='US-NY', session=None, target_datetime=None, logge
     ny_date = target_datetime.format('YYYYMMDD')
     mix_url = 'http://mis.nyiso.com/public/csv/rtfuelmix/{}rtfuelmix.csv'.format(ny_date)
     try:
-        raw_data = read_csv_data(mix_url)
+        raw_data = read_csv_data(mix_url, session=session)
     except HTTPError:
         # this can happen when target_datetime has no data available
         return None
@@ -17,5 +17,10 @@ ROLLBACK TRANSACTION;
 
 -- COMMIT TRANSACTION;
 
+-- After committing, refresh the materialized carbon intensity of the copied rows, which the crawler does not see.
+-- SELECT refresh_carbon_intensity_by_renewable_materialized(NULL,
+--     (SELECT MIN(datetime) FROM energymixture_delta_20220804),
+--     (SELECT MAX(datetime) FROM energymixture_delta_20220804));
+
 -- Optionally drops the temp table.
 -- DROP TABLE energymixture_delta_20220804;
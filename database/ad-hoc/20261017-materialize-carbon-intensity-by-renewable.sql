@@ -0,0 +1,58 @@
+-- This creates the materialized CarbonIntensityByRenewable table, the function to refresh it, and backfills it.
+-- Run with user postgres in the same database, e.g. `sudo su postgres` and then `psql -d electricity-data`.
+-- The crawler keeps it up-to-date afterwards. Anything else that writes EnergyMixture directly, e.g. the ad-hoc copy
+--  or backfill scripts, must refresh the affected range after committing, e.g.
+--      SELECT refresh_carbon_intensity_by_renewable_materialized('US-CAISO', '2022-08-01', '2022-08-05');
+--  Re-run the full backfill, i.e. the function without arguments, if CarbonIntensityByFuelType is changed.
+
+CREATE TABLE IF NOT EXISTS CarbonIntensityByRenewableMaterialized(
+    DateTime TIMESTAMP WITH TIME ZONE NOT NULL,
+    Region VARCHAR(32) NOT NULL,
+    Renewable_CarbonIntensity DOUBLE PRECISION NOT NULL,
+    NonRenewable_CarbonIntensity DOUBLE PRECISION NOT NULL,
+    Renewable_Ratio DOUBLE PRECISION,
+    CONSTRAINT carbonintensitybyrenewablematerialized_unique_region_datetime UNIQUE (Region, DateTime)
+);
+
+-- Recomputes the rows of the region in [start_time, end_time] from the CarbonIntensityByRenewable view, where NULL
+--  means all regions or an open end, and deletes the rows that are no longer in the view, e.g. after timestamps or
+--  regions are renamed. Returns the number of rows inserted or updated.
+CREATE OR REPLACE FUNCTION refresh_carbon_intensity_by_renewable_materialized(
+        refresh_region VARCHAR DEFAULT NULL,
+        start_time TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+        end_time TIMESTAMP WITH TIME ZONE DEFAULT NULL)
+    RETURNS BIGINT
+    LANGUAGE plpgsql
+AS $$
+DECLARE
+    count_upsert BIGINT;
+BEGIN
+    DELETE FROM CarbonIntensityByRenewableMaterialized AS m
+        WHERE (refresh_region IS NULL OR m.Region = refresh_region)
+            AND (start_time IS NULL OR m.DateTime >= start_time)
+            AND (end_time IS NULL OR m.DateTime <= end_time)
+            AND NOT EXISTS (SELECT 1 FROM CarbonIntensityByRenewable AS v
+                                WHERE v.Region = m.Region AND v.DateTime = m.DateTime);
+
+    INSERT INTO CarbonIntensityByRenewableMaterialized
+            (DateTime, Region, Renewable_CarbonIntensity, NonRenewable_CarbonIntensity, Renewable_Ratio)
+        SELECT DateTime, Region, Renewable_CarbonIntensity, NonRenewable_CarbonIntensity, Renewable_Ratio
+            FROM CarbonIntensityByRenewable
+            WHERE (refresh_region IS NULL OR Region = refresh_region)
+                AND (start_time IS NULL OR DateTime >= start_time)
+                AND (end_time IS NULL OR DateTime <= end_time)
+        ON CONFLICT ON CONSTRAINT carbonintensitybyrenewablematerialized_unique_region_datetime
+        DO UPDATE SET Renewable_CarbonIntensity = EXCLUDED.Renewable_CarbonIntensity,
+                      NonRenewable_CarbonIntensity = EXCLUDED.NonRenewable_CarbonIntensity,
+                      Renewable_Ratio = EXCLUDED.Renewable_Ratio;
+    GET DIAGNOSTICS count_upsert = ROW_COUNT;
+    RETURN count_upsert;
+END;
+$$;
+
+SELECT refresh_carbon_intensity_by_renewable_materialized();
+
+-- The crawler upserts the materialized rows of each upload from the view.
+GRANT SELECT ON TABLE CarbonIntensityByRenewable to crawler_rw;
+GRANT SELECT, INSERT, UPDATE ON TABLE CarbonIntensityByRenewableMaterialized to crawler_rw;
+GRANT SELECT ON TABLE CarbonIntensityByRenewableMaterialized to restapi_ro;
@@ -0,0 +1,11 @@
+-- Materialized version of the CarbonIntensityByRenewable view, maintained by the crawler on each upload.
+-- Direct writes to EnergyMixture must call refresh_carbon_intensity_by_renewable_materialized(), see
+--  ad-hoc/20261017-materialize-carbon-intensity-by-renewable.sql.
+CREATE TABLE CarbonIntensityByRenewableMaterialized(
+    DateTime TIMESTAMP WITH TIME ZONE NOT NULL,
+    Region VARCHAR(32) NOT NULL,
+    Renewable_CarbonIntensity DOUBLE PRECISION NOT NULL,
+    NonRenewable_CarbonIntensity DOUBLE PRECISION NOT NULL,
+    Renewable_Ratio DOUBLE PRECISION,
+    CONSTRAINT carbonintensitybyrenewablematerialized_unique_region_datetime UNIQUE (Region, DateTime)
+)
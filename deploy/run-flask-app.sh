@@ -25,6 +25,15 @@ if [[ -n $DEBUG ]]; then
      --reload \
     'api:create_app()'
 else
+  # Share the carbon data and balancing authority caches between the workers, starting empty on every deploy.
+  # The cache files are in directories private to this user, as the cached values are unpickled.
+  export SHARED_CACHE_TYPE=sqlite
+  export SHARED_CACHE_SQLITE_PATH="${SHARED_CACHE_SQLITE_PATH:-/tmp/energy-data-api-$(id -u)/cache.sqlite3}"
+  mkdir -p -m 700 "$(dirname "$SHARED_CACHE_SQLITE_PATH")"
+  rm -f "$SHARED_CACHE_SQLITE_PATH" "$SHARED_CACHE_SQLITE_PATH-wal" "$SHARED_CACHE_SQLITE_PATH-shm"
+  # Keep the balancing authority lookups across deploys. Remove this file after updating the boundaries.
+  export BA_LOOKUP_CACHE_PATH="${BA_LOOKUP_CACHE_PATH:-/var/tmp/energy-data-api-$(id -u)/ba-lookup.sqlite3}"
+  mkdir -p -m 700 "$(dirname "$BA_LOOKUP_CACHE_PATH")"
   gunicorn --workers=4 \
     --log-level=info \
     --access-logfile - \
@@ -0,0 +1,65 @@
+-- Benchmark the EMap time series lookup done by api/helpers/carbon_intensity_shared.py:fetch_time_series_in_range().
+--
+-- Fills a temporary copy of EMapCarbonIntensity (same unique (ZoneId, DateTime) index) with growing amounts of
+--   hourly data and reports the execution time and buffer hits of the one-day lookup query for each size.
+-- The bounds/bracket probes are index-only `ORDER BY ... LIMIT 1` scans, so buffer hits should only grow with the B-tree
+--   depth, i.e. O(log n), as the table grows, while the fetched series stays at 25 rows.
+--
+-- Usage: psql -d electricity-data < postgres.benchmark-emap-bracket-lookup.sql
+
+CREATE TEMPORARY TABLE EMapCarbonIntensityBenchmark (LIKE EMapCarbonIntensity);
+CREATE UNIQUE INDEX ON EMapCarbonIntensityBenchmark (ZoneId, DateTime);
+
+CREATE TEMPORARY TABLE EMapCarbonIntensityBenchmarkResult (
+    NumRows BIGINT,
+    NumRowsFetched BIGINT,
+    BufferHits BIGINT,
+    ExecutionTimeMs DOUBLE PRECISION
+);
+
+DO $$
+DECLARE
+    num_zones INTEGER;
+    num_hours INTEGER := 24 * 365;
+    plan JSON;
+BEGIN
+    FOREACH num_zones IN ARRAY ARRAY[1, 10, 100, 1000] LOOP
+        TRUNCATE EMapCarbonIntensityBenchmark;
+        INSERT INTO EMapCarbonIntensityBenchmark
+            SELECT '2022-01-01'::TIMESTAMPTZ + hour * INTERVAL '1 hour', 'ZONE-' || zone, random() * 500, 0, 0
+            FROM generate_series(1, num_zones) AS zone, generate_series(0, num_hours - 1) AS hour;
+        ANALYZE EMapCarbonIntensityBenchmark;
+        -- Warm up the cache, then measure.
+        FOR i IN 1..2 LOOP
+            EXECUTE $query$EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+                SELECT bounds.available_start, bounds.available_end, series.*
+                FROM (SELECT
+                        (SELECT DateTime FROM EMapCarbonIntensityBenchmark WHERE ZoneId = $1
+                            ORDER BY DateTime LIMIT 1) AS available_start,
+                        (SELECT DateTime FROM EMapCarbonIntensityBenchmark WHERE ZoneId = $1
+                            ORDER BY DateTime DESC LIMIT 1) AS available_end,
+                        (SELECT DateTime FROM EMapCarbonIntensityBenchmark WHERE ZoneId = $1 AND DateTime <= $2
+                            ORDER BY DateTime DESC LIMIT 1) AS bracket_start,
+                        (SELECT DateTime FROM EMapCarbonIntensityBenchmark WHERE ZoneId = $1 AND DateTime >= $3
+                            ORDER BY DateTime LIMIT 1) AS bracket_end
+                    ) AS bounds
+                LEFT JOIN LATERAL (
+                    SELECT DateTime, CarbonIntensity FROM EMapCarbonIntensityBenchmark
+                        WHERE ZoneId = $1
+                            AND DateTime >= COALESCE(bounds.bracket_start, bounds.available_start)
+                            AND DateTime <= COALESCE(bounds.bracket_end, bounds.available_end)
+                ) AS series ON TRUE
+                ORDER BY series.DateTime;$query$
+                INTO plan
+                USING 'ZONE-1', '2022-07-01 00:30:00+00'::TIMESTAMPTZ, '2022-07-02 00:00:00+00'::TIMESTAMPTZ;
+        END LOOP;
+        INSERT INTO EMapCarbonIntensityBenchmarkResult VALUES (
+            num_zones::BIGINT * num_hours,
+            (plan -> 0 -> 'Plan' ->> 'Actual Rows')::BIGINT,
+            -- Temporary tables live in local buffers.
+            (plan -> 0 -> 'Plan' ->> 'Shared Hit Blocks')::BIGINT + (plan -> 0 -> 'Plan' ->> 'Local Hit Blocks')::BIGINT,
+            (plan -> 0 ->> 'Execution Time')::DOUBLE PRECISION);
+    END LOOP;
+END $$;
+
+SELECT * FROM EMapCarbonIntensityBenchmarkResult ORDER BY NumRows;